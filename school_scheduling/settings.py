@@ -33,6 +33,10 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['.herokuapp.com', '127.0.0.1',]
 
+# Serve the read-only schedule pages with async views. Only worth it when
+# running under ASGI (see "Running under ASGI" in the README).
+ASYNC_READ_VIEWS = os.environ.get("ASYNC_READ_VIEWS") == "1"
+
 
 # Application definition
 
@@ -51,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'timetabling.instrumentation.QueryBudgetMiddleware',
+    'timetabling.replicas.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -58,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'timetabling.middleware.RoleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,6 +104,44 @@ DATABASES = {
     'default': dj_database_url.parse(os.environ.get("DATABASE_URL"))
 }
 
+# Optional read replica for the read-only schedule pages (see "Read
+# replica" in the README). Tests use the primary's test database for it.
+REPLICA_DATABASE = None
+if os.environ.get("REPLICA_DATABASE_URL"):
+    REPLICA_DATABASE = 'replica'
+    DATABASES[REPLICA_DATABASE] = dj_database_url.parse(os.environ["REPLICA_DATABASE_URL"])
+    DATABASES[REPLICA_DATABASE]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['timetabling.replicas.ReplicaRouter']
+
+# How long a client that wrote keeps reading from the primary, so it sees
+# its own changes while the replica catches up
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 10))
+
+# Version counters, cached pages and roles must be seen by every worker
+# process, so production needs a shared cache (see "Shared cache" in the
+# README). Without REDIS_URL each process has its own, which is only right
+# for a single process such as runserver or the tests.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ["REDIS_URL"],
+        }
+    }
+    SHARED_CACHE = True
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+    SHARED_CACHE = False
+
+# Solver passes run by the generate schedule page, inside the request and
+# without a process pool. `manage.py solve_timetable` has no such limit.
+SOLVER_REQUEST_RESTARTS = int(os.environ.get("SOLVER_REQUEST_RESTARTS", 4))
+
 CSRF_TRUSTED_ORIGINS = [
     "https://*.codeinstitute-ide.net/",
     "https://*.herokuapp.com"
@@ -1,20 +1,55 @@
-document.querySelectorAll('.delete-form').forEach(form => {
-    form.addEventListener('submit', function(e) {
-        e.preventDefault();
-        Swal.fire({
-            title: 'Are you sure?',
-            text: 'This lesson will be permanently deleted.',
-            icon: 'warning',
-            showCancelButton: true,
-            confirmButtonText: 'Yes, delete it',
-            cancelButtonText: 'Cancel',
-            confirmButtonColor: '#C8793A',
-            cancelButtonColor: '#2E5FA3',
-        }).then((result) => {
-            if (result.isConfirmed) {
-                form.submit();
+function showSuccess(text) {
+    Swal.fire({
+        icon: 'success',
+        title: 'Success',
+        text: text,
+        timer: 3000,
+        showConfirmButton: false,
+    });
+}
+
+function showError(text) {
+    Swal.fire({
+        icon: 'error',
+        title: 'Conflict',
+        text: text,
+        confirmButtonColor: '#2E5FA3',
+    });
+}
+
+
+// Delegated, so rows added by the lesson editor are covered too
+document.addEventListener('submit', function (e) {
+    const form = e.target;
+    if (!form.classList.contains('delete-form')) {
+        return;
+    }
+    e.preventDefault();
+    Swal.fire({
+        title: 'Are you sure?',
+        text: 'This lesson will be permanently deleted.',
+        icon: 'warning',
+        showCancelButton: true,
+        confirmButtonText: 'Yes, delete it',
+        cancelButtonText: 'Cancel',
+        confirmButtonColor: '#C8793A',
+        cancelButtonColor: '#2E5FA3',
+    }).then((result) => {
+        if (!result.isConfirmed) {
+            return;
+        }
+        const row = form.closest('tr[data-lesson]');
+        if (!row) {
+            form.submit();
+            return;
+        }
+        postFragment(form.action, new FormData(form)).then((response) => {
+            if (!response.ok) {
+                throw new Error(response.statusText);
             }
-        });
+            row.remove();
+            showSuccess('Lesson deleted successfully!');
+        }).catch(() => showError('The lesson could not be deleted. Please reload the page.'));
     });
 });
 
@@ -41,4 +76,141 @@ document.addEventListener("DOMContentLoaded", function () {
             });
         });
     });
-});
\ No newline at end of file
+});
+
+
+// -------------------------
+// Lesson editor (Create Schedule)
+// -------------------------
+// A stage's choices come from the stage options API, and adding, editing
+// or deleting a lesson swaps a single table row instead of reloading the
+// page. Without JavaScript the forms still post and reload as before.
+const FRAGMENT_HEADERS = {'X-Requested-With': 'XMLHttpRequest'};
+
+function postFragment(url, body) {
+    return fetch(url, {method: 'POST', headers: FRAGMENT_HEADERS, body: body, credentials: 'same-origin'});
+}
+
+function csrfToken() {
+    return document.querySelector('[name=csrfmiddlewaretoken]').value;
+}
+
+function lessonRow(html) {
+    const template = document.createElement('template');
+    template.innerHTML = html.trim();
+    return template.content.firstElementChild;
+}
+
+function firstError(container) {
+    const error = container.querySelector('.errorlist li');
+    return error ? error.textContent.trim() : 'Please check the lesson details.';
+}
+
+function editLesson(url, row, html) {
+    Swal.fire({
+        title: 'Edit Lesson',
+        html: `<form class="swal-lesson-form">${html}</form>`,
+        showCancelButton: true,
+        confirmButtonText: 'Save Changes',
+        confirmButtonColor: '#2E5FA3',
+        cancelButtonColor: '#C8793A',
+        showLoaderOnConfirm: true,
+        preConfirm: () => {
+            const form = Swal.getPopup().querySelector('.swal-lesson-form');
+            const data = new FormData(form);
+            data.append('csrfmiddlewaretoken', csrfToken());
+            return postFragment(url, data).then((response) => response.text().then((body) => {
+                if (response.ok) {
+                    return body;
+                }
+                if (response.status !== 400) {
+                    throw new Error(response.statusText);
+                }
+                // The form again, with its errors
+                form.innerHTML = body;
+                Swal.showValidationMessage(firstError(form));
+                return false;
+            })).catch(() => {
+                Swal.showValidationMessage('The lesson could not be saved. Please reload the page.');
+                return false;
+            });
+        },
+    }).then((result) => {
+        if (result.isConfirmed) {
+            row.replaceWith(lessonRow(result.value));
+            showSuccess('Lesson updated successfully!');
+        }
+    });
+}
+
+const stageForm = document.querySelector('.stage-select');
+const editor = document.querySelector('.lesson-editor');
+
+if (stageForm && editor) {
+    const stageSelect = stageForm.querySelector('select[name=stage]');
+    const lessonForm = editor.querySelector('.lesson-form');
+    const fields = editor.querySelector('.lesson-form-fields');
+    stageForm.querySelector('[name=select_stage]').hidden = true;
+
+    stageSelect.addEventListener('change', function () {
+        if (!stageSelect.value) {
+            editor.hidden = true;
+            return;
+        }
+        const url = stageForm.dataset.optionsUrl.replace(/0\/$/, `${stageSelect.value}/`);
+        fetch(url, {credentials: 'same-origin'}).then((response) => {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        }).then((data) => {
+            Object.entries(data.options).forEach(([name, options]) => {
+                const select = fields.querySelector(`select[name="${name}"]`);
+                if (select) {
+                    select.replaceChildren(
+                        new Option('---------', ''),
+                        ...options.map((option) => new Option(option.label, option.id)),
+                    );
+                }
+            });
+            lessonForm.querySelector('input[name=stage]').value = data.stage;
+            editor.querySelector('.lesson-editor-stage').textContent =
+                stageSelect.options[stageSelect.selectedIndex].text.trim();
+            editor.hidden = false;
+        }).catch(() => stageForm.submit());
+    });
+
+    lessonForm.addEventListener('submit', function (e) {
+        e.preventDefault();
+        const data = new FormData(lessonForm);
+        data.append('save_lesson', '');
+        postFragment(lessonForm.action, data).then((response) => response.text().then((html) => {
+            if (response.status === 201) {
+                const body = document.querySelector('.lesson-table tbody');
+                body.querySelector('.lesson-table-empty')?.remove();
+                body.prepend(lessonRow(html));
+                showSuccess('Lesson added successfully!');
+            } else if (response.status === 400) {
+                fields.innerHTML = html;
+                showError(firstError(fields));
+            } else {
+                throw new Error(response.statusText);
+            }
+        })).catch(() => showError('The lesson could not be saved. Please reload the page.'));
+    });
+
+    document.addEventListener('submit', function (e) {
+        const form = e.target;
+        const row = form.closest('tr[data-lesson]');
+        if (!form.classList.contains('edit-form') || !row) {
+            return;
+        }
+        e.preventDefault();
+        fetch(form.action, {headers: FRAGMENT_HEADERS, credentials: 'same-origin'}).then((response) => {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.text();
+        }).then((html) => editLesson(form.action, row, html)).catch(() => form.submit());
+    });
+}
@@ -1,5 +1,12 @@
-from django.contrib import admin
-from .models import Stage, Subject, Room, ClassGroup, TimeSlot, Teacher, Lesson
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
+from .bells import expand_bell_schedule, find_overlaps, retime_stage
+from .calendars import reset_feed_key
+from .models import (
+    Stage, Subject, Room, ClassGroup, TimeSlot, Teacher, Lesson, LessonRequirement, BellSchedule, BellPeriod,
+    DraftSchedule, DraftLesson, Term, Holiday, LessonOverride,
+)
 # Register your models here.
 
 @admin.register(Stage)
@@ -20,10 +27,19 @@ class RoomAdmin(admin.ModelAdmin):
     list_filter = ('stage',)
 
 
+@admin.action(description='Reset calendar links (old ones stop working)')
+def reset_calendar_links(modeladmin, request, queryset):
+    kind = 'teacher' if queryset.model is Teacher else 'class_group'
+    for entity in queryset:
+        reset_feed_key(kind, entity)
+    modeladmin.message_user(request, f"Reset {len(queryset)} calendar link(s).")
+
+
 @admin.register(ClassGroup)
 class ClassGroupAdmin(admin.ModelAdmin):
     list_display = ('name', 'stage')
     list_filter = ('stage',)
+    actions = [reset_calendar_links]
 
 
 @admin.register(TimeSlot)
@@ -37,14 +53,115 @@ class TeacherAdmin(admin.ModelAdmin):
     list_display = ('user', 'stage')
     list_filter = ('stage',)
     search_fields = ('user__username', 'user__first_name', 'user__last_name')
+    actions = [reset_calendar_links]
 
 
 @admin.register(Lesson)
 class LessonAdmin(admin.ModelAdmin):
     list_display = ('subject', 'class_group', 'teacher', 'room', 'timeslot')
-    list_filter = ('timeslot__day', 'teacher__stage')
+    list_filter = ('stage', 'timeslot__day')
+    search_fields = (
+        'subject__name',
+        'class_group__name',
+        'teacher__user__last_name',
+    )
+
+
+@admin.register(LessonRequirement)
+class LessonRequirementAdmin(admin.ModelAdmin):
+    list_display = ('class_group', 'subject', 'teacher', 'periods_per_week')
+    list_filter = ('class_group__stage',)
+    search_fields = ('class_group__name', 'subject__name', 'teacher__user__last_name')
+
+
+class BellPeriodFormSet(BaseInlineFormSet):
+
+    def clean(self):
+        super().clean()
+        # Check the periods against each other once, in memory
+        periods = [
+            (form.cleaned_data['start_time'], form.cleaned_data['end_time'])
+            for form in self.forms
+            if form.cleaned_data and not form.cleaned_data.get('DELETE')
+            and form.cleaned_data.get('start_time') and form.cleaned_data.get('end_time')
+        ]
+        overlaps = find_overlaps(periods)
+        if overlaps:
+            raise ValidationError([
+                f"{a[0]:%H:%M}–{a[1]:%H:%M} overlaps {b[0]:%H:%M}–{b[1]:%H:%M}." for a, b in overlaps
+            ])
+
+
+class BellPeriodInline(admin.TabularInline):
+    model = BellPeriod
+    formset = BellPeriodFormSet
+    extra = 1
+
+
+@admin.register(BellSchedule)
+class BellScheduleAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    filter_horizontal = ('stages',)
+    inlines = [BellPeriodInline]
+    actions = ['generate_timeslots', 'retime_timeslots']
+
+    def _apply(self, request, queryset, func, verb):
+        for bell_schedule in queryset.prefetch_related('stages'):
+            for stage in bell_schedule.stages.all():
+                try:
+                    count = func(bell_schedule, stage)
+                except ValidationError as e:
+                    for message in e.messages:
+                        self.message_user(request, message, messages.ERROR)
+                else:
+                    self.message_user(request, f"{stage.name}: {count} timeslots {verb} from {bell_schedule.name}.")
+
+    @admin.action(description='Generate timeslots for the selected schedules\' stages')
+    def generate_timeslots(self, request, queryset):
+        self._apply(request, queryset, expand_bell_schedule, 'created')
+
+    @admin.action(description='Re-time the selected schedules\' stages to match')
+    def retime_timeslots(self, request, queryset):
+        self._apply(request, queryset, retime_stage, 're-timed')
+
+
+@admin.register(DraftSchedule)
+class DraftScheduleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'stage', 'created_at', 'published_at')
+    list_filter = ('stage',)
+
+
+@admin.register(DraftLesson)
+class DraftLessonAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'class_group', 'teacher', 'room', 'timeslot', 'draft')
+    list_filter = ('draft', 'timeslot__day')
+    list_select_related = ('subject', 'class_group', 'teacher__user', 'teacher__stage', 'room', 'timeslot__stage', 'draft')
     search_fields = (
         'subject__name',
         'class_group__name',
         'teacher__user__last_name',
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(Term)
+class TermAdmin(admin.ModelAdmin):
+    list_display = ('name', 'stage', 'start_date', 'end_date')
+    list_filter = ('stage',)
+
+
+@admin.register(Holiday)
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ('name', 'stage', 'start_date', 'end_date')
+    list_filter = ('stage',)
+
+
+@admin.register(LessonOverride)
+class LessonOverrideAdmin(admin.ModelAdmin):
+    list_display = ('date', 'lesson', 'cancelled', 'room', 'teacher', 'note')
+    list_filter = ('cancelled', 'lesson__stage')
+    list_select_related = (
+        'lesson__subject', 'lesson__class_group', 'lesson__timeslot__stage', 'lesson__teacher__user',
+        'lesson__teacher__stage', 'room', 'teacher__user', 'teacher__stage',
+    )
+    raw_id_fields = ('lesson',)
+    date_hierarchy = 'date'
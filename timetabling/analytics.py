@@ -0,0 +1,249 @@
+"""
+Teacher, room and subject utilisation.
+
+UtilisationSummary holds, per stage, the periods and minutes taught by
+each teacher, in each room and of each subject on each weekday. The Lesson
+signals keep it current: a save or delete shifts the counts of the rows it
+touches with one UPDATE, in the same transaction as the lesson. Bulk
+writes (lessons_bulk_changed) and timeslot changes rebuild the stage's rows
+instead, with one aggregate query per kind. Lessons removed by a queryset
+delete or a cascade are not counted one by one either: their stage is
+rebuilt once on commit, unless a bulk change has rebuilt it since.
+
+The analytics pages then read the stage's summary rows and its cached
+resource names (availability.py), so they cost the same however many
+lessons the stage has.
+"""
+import threading
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from timetabling.models import Lesson, Subject, TimeSlot, UtilisationSummary
+from .availability import get_catalogue
+
+
+UTILISATION_KINDS = ('teacher', 'room', 'subject')
+
+DAYS = [day for day, _ in TimeSlot.DAY_CHOICES]
+
+# How often this thread has rebuilt each stage (None: every stage), so a
+# deferred rebuild can tell whether one has happened since it was queued
+_rebuilds = threading.local()
+
+
+def _minutes(start_time, end_time):
+    length = datetime.combine(date.min, end_time) - datetime.combine(date.min, start_time)
+    return int(length.total_seconds() // 60)
+
+
+def rebuild_utilisation(stage_ids=None):
+    """
+    Recompute the summary rows of ``stage_ids`` (every stage if None) from
+    their lessons, with one aggregate query per kind.
+    """
+    lessons = Lesson.objects.all()
+    summaries = UtilisationSummary.objects.all()
+    if stage_ids is not None:
+        lessons = lessons.filter(stage_id__in=stage_ids)
+        summaries = summaries.filter(stage_id__in=stage_ids)
+
+    length = ExpressionWrapper(F('timeslot__end_time') - F('timeslot__start_time'), output_field=DurationField())
+    rows = []
+    for kind in UTILISATION_KINDS:
+        totals = lessons.values_list('stage_id', f'{kind}_id', 'timeslot__weekday').annotate(
+            periods=Count('id'), length=Sum(length),
+        ).order_by()
+        rows.extend(
+            UtilisationSummary(
+                stage_id=stage_id, kind=kind, entity_id=entity_id, weekday=weekday,
+                periods=periods, minutes=int(total.total_seconds() // 60),
+            )
+            for stage_id, entity_id, weekday, periods, total in totals
+        )
+
+    summaries.delete()
+    UtilisationSummary.objects.bulk_create(rows, batch_size=1000)
+    counts = _rebuild_counts()
+    for stage_id in [None] if stage_ids is None else stage_ids:
+        counts[stage_id] = counts.get(stage_id, 0) + 1
+    return len(rows)
+
+
+def _rebuild_counts():
+    if not hasattr(_rebuilds, 'counts'):
+        _rebuilds.counts = {}
+    return _rebuilds.counts
+
+
+def _rebuild_count(stage_id):
+    counts = _rebuild_counts()
+    return counts.get(stage_id, 0) + counts.get(None, 0)
+
+
+def _booking(values):
+    # Lesson field -> id, from a Lesson or its _loaded dict
+    if isinstance(values, Lesson):
+        return {field: getattr(values, f'{field}_id') for field in Lesson.STAGE_FIELDS}
+    return dict(values)
+
+
+def _slot_info(lesson, timeslot_ids):
+    # Timeslot id -> (weekday, minutes); the lesson's own timeslot is often loaded already
+    info = {}
+    if Lesson.timeslot.is_cached(lesson) and lesson.timeslot is not None:
+        slot = lesson.timeslot
+        info[slot.pk] = (slot.weekday, _minutes(slot.start_time, slot.end_time))
+    missing = set(timeslot_ids) - set(info)
+    if missing:
+        slots = TimeSlot.objects.filter(pk__in=missing).values_list('id', 'weekday', 'start_time', 'end_time')
+        info.update((pk, (weekday, _minutes(start_time, end_time))) for pk, weekday, start_time, end_time in slots)
+    return info
+
+
+def _shift(stage_id, booking, slot, sign):
+    # Add (sign=1) or remove (sign=-1) one lesson from its teacher's, room's and subject's rows
+    weekday, minutes = slot
+    entities = {kind: booking[kind] for kind in UTILISATION_KINDS}
+
+    def rows(kinds):
+        match = Q()
+        for kind in kinds:
+            match |= Q(kind=kind, entity_id=entities[kind])
+        return UtilisationSummary.objects.filter(match, weekday=weekday)
+
+    change = {'periods': F('periods') + sign, 'minutes': F('minutes') + sign * minutes}
+    if rows(UTILISATION_KINDS).update(**change) == len(UTILISATION_KINDS) or sign < 0:
+        return
+
+    # The entity's first lesson of the day: create its row, then count the
+    # lesson. Another transaction may create it first, hence ignore_conflicts.
+    existing = set(rows(UTILISATION_KINDS).values_list('kind', flat=True).order_by())
+    missing = [kind for kind in UTILISATION_KINDS if kind not in existing]
+    UtilisationSummary.objects.bulk_create([
+        UtilisationSummary(stage_id=stage_id, kind=kind, entity_id=entities[kind], weekday=weekday)
+        for kind in missing
+    ], ignore_conflicts=True)
+    rows(missing).update(**change)
+
+
+def lesson_saved(lesson, created):
+    """
+    Move a saved lesson's counts from where it was loaded to where it is
+    now. A lesson saved without a known previous state rebuilds its stage.
+    """
+    new = _booking(lesson)
+    old = None if created else _booking(getattr(lesson, '_loaded', {}))
+    if old is not None and (not old or None in old.values()):
+        rebuild_utilisation([lesson.stage_id])
+        return
+    if old == new:
+        return
+
+    slots = _slot_info(lesson, {new['timeslot']} | ({old['timeslot']} if old else set()))
+    if old is not None:
+        _shift(lesson.stage_id, old, slots[old['timeslot']], -1)
+    _shift(lesson.stage_id, new, slots[new['timeslot']], 1)
+
+
+def lesson_deleted(lesson):
+    # A single lesson.delete(): shift its counts now
+    booking = _booking(getattr(lesson, '_loaded', None) or lesson)
+    slots = _slot_info(lesson, {booking['timeslot']})
+    if booking['timeslot'] in slots:
+        _shift(lesson.stage_id, booking, slots[booking['timeslot']], -1)
+
+
+def lesson_deleted_in_bulk(lesson, origin):
+    """
+    Count a lesson removed by a queryset delete or a cascade from ``origin``
+    (what delete() was called on) with one rebuild of its stage on commit.
+    Callers that send lessons_bulk_changed inside the transaction, as
+    publish_draft() and apply_repair() do, have rebuilt it already by then.
+    """
+    stage_id = lesson.stage_id
+    stages = origin.__dict__.setdefault('_utilisation_stages', set())
+    if stage_id in stages:
+        return
+    stages.add(stage_id)
+    queued_at = _rebuild_count(stage_id)
+
+    def rebuild():
+        if _rebuild_count(stage_id) == queued_at:
+            rebuild_utilisation([stage_id])
+
+    transaction.on_commit(rebuild)
+
+
+def entity_deleted(kind, pk):
+    UtilisationSummary.objects.filter(kind=kind, entity_id=pk).delete()
+
+
+def utilisation(stage):
+    """
+    Return a stage's utilisation: ``days`` as (day, timeslots) pairs, the
+    week's total ``slots``, and for each kind a list of entity dicts with
+    ``name``, ``days`` (periods and share of that day's timeslots, per
+    weekday), weekly ``periods`` and ``hours``, and ``occupancy`` as a
+    percentage of the stage's timeslots. Entities without lessons are
+    included.
+    """
+    catalogue = get_catalogue(stage.pk)
+    slots_per_day = [0] * len(DAYS)
+    for _, _, weekday, _, _ in catalogue['slots']:
+        slots_per_day[weekday] += 1
+    total_slots = sum(slots_per_day)
+
+    names = {
+        'teacher': catalogue['names']['teacher'],
+        'room': catalogue['names']['room'],
+        'subject': dict(Subject.objects.filter(stage=stage).values_list('id', 'name')),
+    }
+    totals = {}
+    for kind, entity_id, weekday, periods, minutes in UtilisationSummary.objects.filter(stage=stage).values_list(
+        'kind', 'entity_id', 'weekday', 'periods', 'minutes'
+    ).order_by():
+        totals[(kind, entity_id, weekday)] = (periods, minutes)
+
+    result = {'stage': stage, 'days': list(zip(DAYS, slots_per_day)), 'slots': total_slots}
+    for kind in UTILISATION_KINDS:
+        entities = []
+        for entity_id, name in names[kind].items():
+            days = [totals.get((kind, entity_id, weekday), (0, 0)) for weekday in range(len(DAYS))]
+            periods = sum(day[0] for day in days)
+            entities.append({
+                'id': entity_id,
+                'name': name,
+                'days': [
+                    {'periods': day_periods, 'share': day_periods / slots if slots else 0}
+                    for (day_periods, _), slots in zip(days, slots_per_day)
+                ],
+                'periods': periods,
+                'hours': round(sum(day[1] for day in days) / 60, 1),
+                'occupancy': round(100 * periods / total_slots) if total_slots else 0,
+            })
+        entities.sort(key=lambda entity: (-entity['periods'], entity['name']))
+        result[kind] = entities
+    return result
+
+
+UTILISATION_HEADER = ['Stage', 'Type', 'Name'] + DAYS + ['Periods', 'Hours', 'Occupancy %']
+
+KIND_LABELS = dict(UtilisationSummary.KIND_CHOICES)
+
+
+def utilisation_rows(data):
+    """
+    Yield one UTILISATION_HEADER row per entity of utilisation() ``data``.
+    """
+    for kind in UTILISATION_KINDS:
+        for entity in data[kind]:
+            yield [
+                data['stage'].name,
+                KIND_LABELS[kind],
+                entity['name'],
+                *(day['periods'] for day in entity['days']),
+                entity['periods'],
+                entity['hours'],
+                entity['occupancy'],
+            ]
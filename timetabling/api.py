@@ -0,0 +1,198 @@
+"""
+Read-only JSON timetables for the portal and mobile clients, and the
+choices for the secretary's lesson editor.
+
+Each timetable response carries an ETag made from the entity's stage
+version (caching.py). A poll with a matching If-None-Match gets a 304 after
+two cache reads (entity -> stage, stage -> version) and no lesson query; a
+changed version rebuilds the body once and caches it under that version.
+Stage options work the same way on the stage data version, which lesson
+saves do not move.
+"""
+import json
+
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import condition, require_GET
+from timetabling.models import Lesson, Stage, TimeSlot
+from .availability import availability_search
+from .caching import stage_data_version, stage_version
+from .cover import find_cover
+from .decorators import role_required
+from .exports import lesson_rows
+from .forms import CoverForm, LessonForm
+from .instrumentation import query_budget
+from .roles import SECRETARIES, TEACHERS
+from .timetables import GRID_CACHE_TIMEOUT, GRID_KINDS, cached_entity_stage_id
+
+
+# Keys for the columns of exports.lesson_rows()
+LESSON_KEYS = ('stage', 'day', 'start_time', 'end_time', 'class_group', 'subject', 'room', 'teacher')
+
+
+def api_cache_key(kind, pk, version):
+    return f"timetabling:api:{kind}:{pk}:{version}"
+
+
+def timetable_version(kind, pk):
+    if kind not in GRID_KINDS:
+        raise Http404("Unknown timetable type.")
+    stage_id = cached_entity_stage_id(kind, pk)
+    if stage_id is None:
+        raise Http404("No such timetable.")
+    return stage_version(stage_id)
+
+
+def timetable_etag(request, kind, pk):
+    return f"{kind}-{pk}-{timetable_version(kind, pk)}"
+
+
+def entity_name(kind, entity):
+    if kind == 'teacher':
+        return entity.user.get_full_name() or entity.user.username
+    return entity.name
+
+
+def build_payload(kind, pk, version):
+    """
+    Return the JSON body for one timetable: the entity and its lessons in
+    week order, with the same columns as the CSV export.
+    """
+    model, lookup = GRID_KINDS[kind]
+    entities = model.objects.select_related('user') if kind == 'teacher' else model.objects.all()
+    entity = entities.get(pk=pk)
+    lessons = Lesson.objects.filter(**{lookup: pk}).order_by(
+        'timeslot__weekday', 'timeslot__start_time', 'class_group__name'
+    )
+    return json.dumps({
+        'kind': kind,
+        'id': pk,
+        'name': entity_name(kind, entity),
+        'version': version,
+        'lessons': [dict(zip(LESSON_KEYS, row)) for row in lesson_rows(lessons)],
+    })
+
+
+@query_budget(7)
+@require_GET
+@role_required(SECRETARIES, TEACHERS)
+@condition(etag_func=timetable_etag)
+def api_timetable(request, kind, pk):
+    version = timetable_version(kind, pk)
+    key = api_cache_key(kind, pk, version)
+    body = cache.get(key)
+    if body is None:
+        body = build_payload(kind, pk, version)
+        cache.set(key, body, GRID_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type='application/json')
+    # Clients must revalidate, but may keep the body for a 304
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def stage_options_cache_key(stage_id, version):
+    return f"timetabling:api:options:{stage_id}:{version}"
+
+
+def stage_options_etag(request, stage_id):
+    return f"options-{stage_id}-{stage_data_version(stage_id)}"
+
+
+def build_stage_options(stage_id, version):
+    """
+    Return the JSON body listing a stage's choices for each LessonForm
+    field, labelled as the form labels them.
+    """
+    if not Stage.objects.filter(pk=stage_id).exists():
+        raise Http404("No such stage.")
+    form = LessonForm()
+    form.limit_to_stage(stage_id)
+    return json.dumps({
+        'stage': stage_id,
+        'version': version,
+        'options': {
+            name: [{'id': obj.pk, 'label': field.label_from_instance(obj)} for obj in field.queryset]
+            for name, field in form.fields.items()
+        },
+    })
+
+
+@query_budget(10)
+@require_GET
+@role_required(SECRETARIES)
+@condition(etag_func=stage_options_etag)
+def api_stage_options(request, stage_id):
+    version = stage_data_version(stage_id)
+    key = stage_options_cache_key(stage_id, version)
+    body = cache.get(key)
+    if body is None:
+        body = build_stage_options(stage_id, version)
+        cache.set(key, body, GRID_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type='application/json')
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@query_budget(9)
+@require_GET
+@role_required(SECRETARIES)
+def api_cover(request):
+    form = CoverForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    teacher, day = form.cleaned_data['teacher'], form.cleaned_data['day']
+    cover = find_cover(teacher, TimeSlot.WEEKDAY_NUMBERS[day])
+    return JsonResponse({
+        'teacher': teacher.pk,
+        'day': day,
+        'lessons': [
+            {
+                'id': entry['lesson'].pk,
+                'start_time': entry['lesson'].timeslot.start_time.strftime('%H:%M'),
+                'end_time': entry['lesson'].timeslot.end_time.strftime('%H:%M'),
+                'subject': entry['lesson'].subject.name,
+                'class_group': entry['lesson'].class_group.name,
+                'room': entry['lesson'].room.name,
+                'candidates': [
+                    {
+                        'id': candidate['teacher'].pk,
+                        'name': entity_name('teacher', candidate['teacher']),
+                        'teaches_subject': candidate['teaches_subject'],
+                        'day_load': candidate['day_load'],
+                        'week_load': candidate['week_load'],
+                    }
+                    for candidate in entry['candidates']
+                ],
+            }
+            for entry in cover
+        ],
+    })
+
+
+@query_budget(10)
+@require_GET
+@role_required(SECRETARIES, TEACHERS)
+def api_availability(request):
+    form, result = availability_search(request.GET)
+    if result is None:
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    return JsonResponse({
+        'stage': form.cleaned_data['stage'].pk,
+        'free_slots': [
+            {
+                'id': pk,
+                'day': day,
+                'start_time': start_time.strftime('%H:%M'),
+                'end_time': end_time.strftime('%H:%M'),
+            }
+            for pk, day, _, start_time, end_time in result['free_slots']
+        ],
+        'free': {
+            kind: [{'id': pk, 'name': name} for pk, name in resources]
+            for kind, resources in result['free'].items()
+        },
+    })
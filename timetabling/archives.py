@@ -0,0 +1,147 @@
+"""
+"All timetables" zip export: one CSV per teacher, class group and room plus
+the whole-school schedule.
+
+The lesson table is read once, in week order. Each row is written straight
+into the whole-school entry and appended to the rows of its teacher, class
+group and room; those files are then formatted (optionally in a process
+pool) and added to the archive. The finished zip is cached under the
+versions of every stage, so it is rebuilt only after something changes.
+"""
+import csv
+import hashlib
+import io
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.text import slugify
+from timetabling.models import Lesson, Stage, Teacher, ClassGroup, Room
+from .caching import stage_version, stage_version_key
+from .decorators import role_required
+from .exports import EXPORT_CHUNK_SIZE, LESSON_FIELDS, SCHEDULE_HEADER, format_lesson
+from .instrumentation import query_budget
+from .roles import SECRETARIES
+
+
+ARCHIVE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# kind -> folder in the archive
+ARCHIVE_FOLDERS = {
+    'teacher': 'teachers',
+    'class_group': 'class_groups',
+    'room': 'rooms',
+}
+
+
+def archive_cache_key():
+    """
+    Return a cache key that changes whenever any stage's version does, or a
+    stage is added or removed.
+    """
+    stage_ids = sorted(Stage.objects.values_list('id', flat=True))
+    versions = cache.get_many([stage_version_key(stage_id) for stage_id in stage_ids])
+    state = ','.join(
+        f"{stage_id}:{versions.get(stage_version_key(stage_id)) or stage_version(stage_id)}"
+        for stage_id in stage_ids
+    )
+    return f"timetabling:archive:{hashlib.md5(state.encode()).hexdigest()}"
+
+
+def render_csv(rows):
+    """
+    Return CSV text for a header plus rows. Module-level so it can run in
+    a worker process.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SCHEDULE_HEADER)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def _entries():
+    # (kind, id) -> archive path for every teacher, class group and room,
+    # including those without lessons
+    teachers = Teacher.objects.values_list(
+        'id', 'stage__name', 'user__first_name', 'user__last_name', 'user__username'
+    )
+    names = {
+        ('teacher', pk): f"{stage}-{f'{first_name} {last_name}'.strip() or username}"
+        for pk, stage, first_name, last_name, username in teachers
+    }
+    for kind, model in [('class_group', ClassGroup), ('room', Room)]:
+        names.update(
+            ((kind, pk), f"{stage}-{name}")
+            for pk, stage, name in model.objects.values_list('id', 'stage__name', 'name')
+        )
+    return {
+        key: f"{ARCHIVE_FOLDERS[key[0]]}/{slugify(name)}-{key[1]}.csv"
+        for key, name in names.items()
+    }
+
+
+def write_archive(fileobj, workers=None):
+    """
+    Write the zip to a binary file object and return the number of lessons
+    in it. ``workers`` > 1 formats the per-entity files in that many
+    processes.
+    """
+    entries = _entries()
+    grouped = defaultdict(list)
+    lessons = Lesson.objects.order_by('timeslot__weekday', 'timeslot__start_time', 'stage_id', 'class_group__name')
+    count = 0
+
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('full_schedule.csv', 'w') as entry:
+            text = io.TextIOWrapper(entry, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(SCHEDULE_HEADER)
+            rows = lessons.values_list('teacher_id', 'class_group_id', 'room_id', *LESSON_FIELDS)
+            for teacher_id, class_group_id, room_id, *fields in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                row = format_lesson(fields)
+                writer.writerow(row)
+                grouped[('teacher', teacher_id)].append(row)
+                grouped[('class_group', class_group_id)].append(row)
+                grouped[('room', room_id)].append(row)
+                count += 1
+            text.flush()
+            text.detach()
+
+        keys = list(entries)
+        row_lists = [grouped.get(key, []) for key in keys]
+        if workers and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                contents = pool.map(render_csv, row_lists, chunksize=32)
+                for key, content in zip(keys, contents):
+                    archive.writestr(entries[key], content)
+        else:
+            for key, rows in zip(keys, row_lists):
+                archive.writestr(entries[key], render_csv(rows))
+
+    return count
+
+
+def get_archive(workers=None):
+    """
+    Return the zip as bytes, from the cache when no stage has changed since
+    it was built.
+    """
+    key = archive_cache_key()
+    content = cache.get(key)
+    if content is None:
+        buffer = io.BytesIO()
+        write_archive(buffer, workers=workers)
+        content = buffer.getvalue()
+        cache.set(key, content, ARCHIVE_CACHE_TIMEOUT)
+    return content
+
+
+@query_budget(9)
+@role_required(SECRETARIES)
+def export_all_timetables(request):
+    response = HttpResponse(get_archive(), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="timetables.zip"'
+    return response
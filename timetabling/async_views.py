@@ -0,0 +1,146 @@
+"""
+Async versions of the read-only pages, served in place of the sync ones
+when ASYNC_READ_VIEWS is on and the site runs under ASGI (see README).
+
+Lessons are read with the async ORM and role checks use what
+RoleMiddleware already resolved, so a worker can hold many concurrent
+readers while their queries are in flight. They keep the query budgets of
+the views they replace.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.text import slugify
+from timetabling.models import Lesson, TimeSlot, Stage, ClassGroup, Teacher
+from .api import api_cache_key, build_payload, timetable_version
+from .calendars import feed_url
+from .decorators import role_required
+from .exports import (
+    SCHEDULE_EMPTY_ROW, SCHEDULE_HEADER, TEACHER_EMPTY_ROW, TEACHER_HEADER,
+    alesson_rows, astream_csv, csv_response, schedule_lessons, teacher_lessons,
+)
+from .instrumentation import query_budget
+from .pagination import akeyset_page, filter_lessons
+from .replicas import replica_reads
+from .roles import SECRETARIES, TEACHERS
+from .timetables import GRID_CACHE_TIMEOUT
+
+
+# -------------------------
+# Home page
+# -------------------------
+@query_budget(4)
+@replica_reads
+async def home(request):
+    return render(request, "timetabling/index.html", {
+        'is_secretary': SECRETARIES in request.roles,
+        'is_teacher': TEACHERS in request.roles,
+    })
+
+
+# -------------------------
+# Teachers: view schedule
+# -------------------------
+@query_budget(5)
+@replica_reads
+@role_required(TEACHERS)
+async def view_schedule(request):
+    lessons = Lesson.objects.filter(
+        teacher=request.teacher
+    ).select_related(
+        'subject', 'room', 'class_group', 'timeslot'
+    ).order_by('timeslot__weekday', 'timeslot__start_time')
+
+    return render(request, "timetabling/view_schedule.html", {
+        'lessons': [lesson async for lesson in lessons],
+        'calendar_url': feed_url('teacher', request.teacher) if request.teacher else None,
+    })
+
+
+# -------------------------
+# Admin: full schedule
+# -------------------------
+@query_budget(8)
+@replica_reads
+async def admin_schedule(request):
+    # staff_member_required is sync-only
+    if not (request.user.is_active and request.user.is_staff):
+        return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+
+    lessons, filters = filter_lessons(Lesson.objects.select_related(
+        'stage', 'teacher__user', 'subject', 'room', 'class_group', 'timeslot'
+    ), request.GET)
+
+    # Templates cannot run queries in async code, so every list is read here
+    return render(request, "timetabling/admin_schedule.html", {
+        **await akeyset_page(lessons, request.GET),
+        'filters': filters,
+        'days': [day for day, _ in TimeSlot.DAY_CHOICES],
+        'stages': [stage async for stage in Stage.objects.all()],
+        'teachers': [
+            teacher async for teacher in Teacher.objects.select_related('user', 'stage').order_by('user__last_name')
+        ],
+        'class_groups': [
+            group async for group in ClassGroup.objects.select_related('stage').order_by('stage', 'name')
+        ],
+    })
+
+
+# -------------------------
+# CSV exports
+# -------------------------
+@query_budget(5)
+@replica_reads
+@role_required(SECRETARIES)
+async def export_schedule_csv(request):
+    return csv_response(
+        astream_csv(SCHEDULE_HEADER, alesson_rows(schedule_lessons(request.GET)), SCHEDULE_EMPTY_ROW),
+        'full_schedule.csv',
+    )
+
+
+@query_budget(5)
+@replica_reads
+@role_required(TEACHERS)
+async def export_teacher_schedule_csv(request):
+    async def rows():
+        async for row in alesson_rows(teacher_lessons(request.teacher)):
+            yield row[:7]
+
+    return csv_response(
+        astream_csv(TEACHER_HEADER, rows(), TEACHER_EMPTY_ROW),
+        f"{slugify(request.user.username)}_schedule.csv",
+    )
+
+
+# -------------------------
+# JSON timetables
+# -------------------------
+@query_budget(7)
+@role_required(SECRETARIES, TEACHERS)
+async def api_timetable(request, kind, pk):
+    # django.views.decorators.http.condition is sync-only
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    version = await sync_to_async(timetable_version)(kind, pk)
+    etag = quote_etag(f"{kind}-{pk}-{version}")
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    key = api_cache_key(kind, pk, version)
+    body = await cache.aget(key)
+    if body is None:
+        body = await sync_to_async(build_payload)(kind, pk, version)
+        await cache.aset(key, body, GRID_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
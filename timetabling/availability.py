@@ -0,0 +1,111 @@
+"""
+Availability search: free timeslots for a set of teachers, class groups and
+rooms, and the resources free at given timeslots.
+
+Bookings come from the stage's occupancy index (occupancy.py, one query
+when built, then kept current as lessons change); the stage's timeslots
+and resource names are cached under its data version. A search is then
+pure set operations with no queries, quick enough for an interactive
+picker.
+"""
+from django.core.cache import cache
+from timetabling.models import TimeSlot, Teacher, ClassGroup, Room
+from .caching import stage_data_version
+from .forms import AvailabilityForm
+from .occupancy import KINDS, get_occupancy
+
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def catalogue_cache_key(stage_id, version):
+    return f"timetabling:availability:{stage_id}:{version}"
+
+
+def build_catalogue(stage_id):
+    """
+    Return ``{'slots': [...], 'names': {kind: {id: name}}}`` for a stage,
+    with slots as (id, day, weekday, start_time, end_time) in week order.
+    """
+    slots = list(
+        TimeSlot.objects.filter(stage_id=stage_id).order_by('weekday', 'start_time')
+        .values_list('id', 'day', 'weekday', 'start_time', 'end_time')
+    )
+    teachers = Teacher.objects.filter(stage_id=stage_id).order_by('user__last_name', 'user__first_name').values_list(
+        'id', 'user__first_name', 'user__last_name', 'user__username'
+    )
+    names = {
+        'teacher': {
+            pk: f"{first_name} {last_name}".strip() or username
+            for pk, first_name, last_name, username in teachers
+        },
+        'class_group': dict(ClassGroup.objects.filter(stage_id=stage_id).order_by('name').values_list('id', 'name')),
+        'room': dict(Room.objects.filter(stage_id=stage_id).order_by('name').values_list('id', 'name')),
+    }
+    return {'slots': slots, 'names': names}
+
+
+def get_catalogue(stage_id):
+    key = catalogue_cache_key(stage_id, stage_data_version(stage_id))
+    catalogue = cache.get(key)
+    if catalogue is None:
+        catalogue = build_catalogue(stage_id)
+        cache.set(key, catalogue, CATALOGUE_CACHE_TIMEOUT)
+    return catalogue
+
+
+def search(stage_id, resources=None, timeslots=(), weekday=None, catalogue=None):
+    """
+    ``resources`` maps a kind ('teacher', 'class_group', 'room') to ids.
+    Returns ``{'free_slots': [...], 'free': {kind: [(id, name), ...]}}``:
+    the stage's slots (on ``weekday`` if given) where none of the resources
+    is booked, and, when ``timeslots`` are given, every resource of each
+    kind that is free at all of them.
+    """
+    catalogue = catalogue or get_catalogue(stage_id)
+    busy = get_occupancy(stage_id).busy
+    resources = {kind: set(ids) for kind, ids in (resources or {}).items() if ids}
+
+    free_slots = [
+        slot for slot in catalogue['slots']
+        if (weekday is None or slot[2] == weekday)
+        and all(busy[kind].get(slot[0], {}).keys().isdisjoint(ids) for kind, ids in resources.items())
+    ]
+
+    free = {}
+    if timeslots:
+        for kind in KINDS:
+            booked = set().union(*(busy[kind].get(timeslot_id, {}).keys() for timeslot_id in timeslots))
+            free[kind] = [(pk, name) for pk, name in catalogue['names'][kind].items() if pk not in booked]
+
+    return {'free_slots': free_slots, 'free': free}
+
+
+def bind_stage_form(form_class, params):
+    """
+    Bind ``form_class`` to ``params``, passing it the catalogue of the stage
+    the params name so its choices cost no queries.
+    """
+    stage_id = params.get('stage', '')
+    catalogue = get_catalogue(int(stage_id)) if stage_id.isdigit() else None
+    return form_class(params or None, catalogue=catalogue)
+
+
+def availability_search(params):
+    """
+    Bind an AvailabilityForm to ``params`` and run the search it describes.
+    Returns ``(form, result)``; ``result`` is None until the form is valid.
+    """
+    form = bind_stage_form(AvailabilityForm, params)
+    if not form.is_valid():
+        return form, None
+
+    data = form.cleaned_data
+    result = search(
+        data['stage'].pk,
+        resources={kind: data[kind] for kind in KINDS},
+        timeslots=data['timeslot'],
+        weekday=data['day'],
+        catalogue=form.catalogue,
+    )
+    return form, result
@@ -0,0 +1,134 @@
+"""
+Bell schedules: expand a day's periods into a stage's TimeSlots, or re-time
+existing TimeSlots when the bell schedule changes.
+
+TimeSlot.save() validates each slot with its own overlap query. Here the
+overlap check is done once per day in memory by sorting the intervals, and
+the rows are written with bulk_create / bulk_update in one transaction.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from timetabling.models import Lesson, TimeSlot
+from .signals import lessons_bulk_changed
+
+
+WEEKDAYS = [day for day, _ in TimeSlot.DAY_CHOICES]
+
+
+def find_overlaps(intervals):
+    """
+    Return the pairs of overlapping (start, end) intervals. Sorting by start
+    means each interval only has to be compared with the latest-ending one
+    before it.
+    """
+    overlaps = []
+    latest = None
+    for interval in sorted(intervals):
+        if latest is not None and interval[0] < latest[1]:
+            overlaps.append((latest, interval))
+        if latest is None or interval[1] > latest[1]:
+            latest = interval
+    return overlaps
+
+
+def _format(interval):
+    return f"{interval[0].strftime('%H:%M')}–{interval[1].strftime('%H:%M')}"
+
+
+def bell_periods(bell_schedule):
+    """
+    Return the schedule's (start, end) periods in order, or raise
+    ValidationError if any of them overlap.
+    """
+    periods = sorted(bell_schedule.periods.values_list('start_time', 'end_time'))
+    overlaps = find_overlaps(periods)
+    if overlaps:
+        raise ValidationError([
+            f"{bell_schedule.name}: {_format(a)} overlaps {_format(b)}." for a, b in overlaps
+        ])
+    return periods
+
+
+def _stage_slots(stage, days):
+    # day -> [TimeSlot, ...] ordered by start time
+    slots = defaultdict(list)
+    for slot in TimeSlot.objects.filter(stage=stage, day__in=days).order_by('start_time'):
+        slots[slot.day].append(slot)
+    return slots
+
+
+def expand_bell_schedule(bell_schedule, stage, days=None):
+    """
+    Create the stage's missing TimeSlots for each of ``days`` (default all
+    weekdays) from the bell schedule. Periods that already exist are skipped;
+    anything that would overlap an existing slot is reported and nothing is
+    written. Returns the number of TimeSlots created.
+    """
+    days = days or WEEKDAYS
+    periods = bell_periods(bell_schedule)
+    existing = _stage_slots(stage, days)
+
+    new_slots = []
+    errors = []
+    for day in days:
+        current = {(slot.start_time, slot.end_time) for slot in existing[day]}
+        missing = [period for period in periods if period not in current]
+        for a, b in find_overlaps(list(current) + missing):
+            errors.append(f"{day}: {_format(a)} overlaps {_format(b)} in {stage.name}.")
+        new_slots.extend(
+            TimeSlot(stage=stage, day=day, weekday=TimeSlot.WEEKDAY_NUMBERS[day], start_time=start_time, end_time=end_time)
+            for start_time, end_time in missing
+        )
+
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        TimeSlot.objects.bulk_create(new_slots)
+        # New slots change the stage's timetable grids
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=[stage.pk])
+    return len(new_slots)
+
+
+def retime_stage(bell_schedule, stage, days=None):
+    """
+    Move the stage's existing TimeSlots onto the bell schedule's times, the
+    n-th slot of each day taking the n-th period. Lessons keep their slots.
+    Each day must have exactly as many slots as the schedule has periods.
+    Returns the number of TimeSlots changed.
+    """
+    days = days or WEEKDAYS
+    periods = bell_periods(bell_schedule)
+    existing = _stage_slots(stage, days)
+
+    errors = [
+        f"{day}: {stage.name} has {len(existing[day])} timeslots but {bell_schedule.name} has {len(periods)} periods."
+        for day in days if existing[day] and len(existing[day]) != len(periods)
+    ]
+    if errors:
+        raise ValidationError(errors)
+
+    changed = []
+    for day in days:
+        for slot, (start_time, end_time) in zip(existing[day], periods):
+            if (slot.start_time, slot.end_time) != (start_time, end_time):
+                slot.start_time, slot.end_time = start_time, end_time
+                changed.append(slot)
+
+    with transaction.atomic():
+        # Shifting 9/10/11 onto 10/11/12 in one UPDATE trips the unique
+        # (stage, day, start, end) constraint part way through, so the slots
+        # are first parked on placeholder times a few seconds after midnight
+        targets = [(slot.start_time, slot.end_time) for slot in changed]
+        for n, slot in enumerate(changed, start=1):
+            slot.start_time = datetime.min.time()
+            slot.end_time = (datetime.min + timedelta(seconds=n)).time()
+        TimeSlot.objects.bulk_update(changed, ['start_time', 'end_time'])
+        for slot, (start_time, end_time) in zip(changed, targets):
+            slot.start_time, slot.end_time = start_time, end_time
+        TimeSlot.objects.bulk_update(changed, ['start_time', 'end_time'])
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=[stage.pk])
+    return len(changed)
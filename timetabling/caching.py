@@ -0,0 +1,83 @@
+"""
+Shared version counters for schedule data.
+
+Each stage has a counter in the cache that is bumped whenever its lessons
+change. Anything derived from a stage's schedule (in-process indexes, cached
+pages) records the version it was built from and is rebuilt once the
+counter has moved on.
+
+That keeps several worker processes consistent only when they share the
+cache, i.e. with REDIS_URL set (see settings and checks.py); Redis also
+makes every bump an atomic increment. The process-local fallback is for
+running a single process.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def stage_version_key(stage_id):
+    return f"timetabling:stage-version:{stage_id}"
+
+
+def _initial_version():
+    # A fresh, time-based start means an evicted counter never comes back
+    # with a value some process has already seen
+    return int(time.time() * 1000)
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing or evicted: start a new sequence
+        cache.add(key, _initial_version(), None)
+        return cache.incr(key)
+
+
+def stage_version(stage_id):
+    return _version(stage_version_key(stage_id))
+
+
+def bump_stage_version(stage_id):
+    """
+    Advance a stage's version and return the new value.
+    """
+    return _bump(stage_version_key(stage_id))
+
+
+# Finer-grained counters for data derived from a single teacher's or class
+# group's lessons. The entity version moves when one of its lessons is
+# saved or deleted; the stage data version moves on everything else that
+# can change its contents (bulk lesson writes, renamed rooms, re-timed
+# slots), but not on single lesson saves elsewhere in the stage.
+def entity_version_key(kind, pk):
+    return f"timetabling:entity-version:{kind}:{pk}"
+
+
+def entity_version(kind, pk):
+    return _version(entity_version_key(kind, pk))
+
+
+def bump_entity_version(kind, pk):
+    return _bump(entity_version_key(kind, pk))
+
+
+def stage_data_version_key(stage_id):
+    return f"timetabling:stage-data-version:{stage_id}"
+
+
+def stage_data_version(stage_id):
+    return _version(stage_data_version_key(stage_id))
+
+
+def bump_stage_data_version(stage_id):
+    return _bump(stage_data_version_key(stage_id))
@@ -0,0 +1,177 @@
+"""
+Subscribable iCalendar feeds for teachers and class groups.
+
+Each lesson becomes a weekly recurring event on its timeslot's weekday.
+Feeds are fetched by calendar apps without a session, so the URL carries a
+signed token naming the teacher or class group and its current feed_key;
+reset_feed_key() replaces the key, which revokes every earlier link.
+
+A feed body is cached under that entity's own version and its stage's data
+version (caching.py), so it is only rebuilt when one of its lessons, or
+something they show, changes; polling is a few cache reads and no queries.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core import signing
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from timetabling.models import Lesson, Teacher, ClassGroup, new_feed_key
+from .caching import entity_version, stage_data_version
+from .instrumentation import query_budget
+from .timetables import GRID_CACHE_TIMEOUT
+
+
+FEED_KINDS = {
+    'teacher': (Teacher, 'teacher_id'),
+    'class_group': (ClassGroup, 'class_group_id'),
+}
+
+FEED_SALT = 'timetabling.calendars'
+
+ICAL_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR']
+
+
+def feed_token(kind, entity):
+    return signing.Signer(salt=FEED_SALT).sign(f"{kind}.{entity.pk}.{entity.feed_key}")
+
+
+def feed_url(kind, entity):
+    return reverse('calendar_feed', args=[feed_token(kind, entity)])
+
+
+def read_token(token):
+    # Returns (kind, pk, feed_key), or None for an unknown or tampered token
+    try:
+        kind, pk, key = signing.Signer(salt=FEED_SALT).unsign(token).split('.')
+        pk = int(pk)
+    except (signing.BadSignature, ValueError):
+        return None
+    return (kind, pk, key) if kind in FEED_KINDS else None
+
+
+def feed_entity_cache_key(kind, pk):
+    return f"timetabling:feed-entity:{kind}:{pk}"
+
+
+def cached_feed_entity(kind, pk):
+    """
+    Return ``(feed_key, stage_id)`` for a teacher or class group, or None if
+    it does not exist. Cached, and cleared by signals.py when it is saved.
+    """
+    key = feed_entity_cache_key(kind, pk)
+    entity = cache.get(key)
+    if entity is None:
+        entity = FEED_KINDS[kind][0].objects.filter(pk=pk).values_list('feed_key', 'stage_id').first()
+        if entity is not None:
+            cache.set(key, entity, GRID_CACHE_TIMEOUT)
+    return entity
+
+
+def reset_feed_key(kind, entity):
+    """
+    Give a teacher or class group a new feed_key, so links to its calendar
+    handed out so far stop working. Returns the new feed URL.
+    """
+    entity.feed_key = new_feed_key()
+    entity.save(update_fields=['feed_key'])
+    return feed_url(kind, entity)
+
+
+def feed_cache_key(kind, pk, version, data_version):
+    return f"timetabling:ical:{kind}:{pk}:{version}:{data_version}"
+
+
+def escape(text):
+    return (
+        text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def fold(line):
+    # Content lines are limited to 75 octets; continuations start with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74
+        # Never split inside a multi-byte character
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode())
+        encoded = encoded[size:]
+    return '\r\n '.join(parts)
+
+
+def build_calendar(kind, pk):
+    """
+    Return the iCalendar text for a teacher's or class group's lessons. The
+    first occurrence of each lesson is in the current week; it then repeats
+    weekly.
+    """
+    model, lookup = FEED_KINDS[kind]
+    entity = (model.objects.select_related('user') if kind == 'teacher' else model.objects).get(pk=pk)
+    name = (entity.user.get_full_name() or entity.user.username) if kind == 'teacher' else entity.name
+
+    today = timezone.localdate()
+    monday = today - timedelta(days=today.weekday())
+    stamp = datetime.now(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//school_scheduling//timetable//EN',
+        'CALSCALE:GREGORIAN',
+        f"X-WR-CALNAME:{escape(name)}",
+        f"X-WR-TIMEZONE:{timezone.get_current_timezone_name()}",
+    ]
+    lessons = Lesson.objects.filter(**{lookup: pk}).values_list(
+        'id', 'timeslot__weekday', 'timeslot__start_time', 'timeslot__end_time',
+        'subject__name', 'class_group__name', 'room__name',
+        'teacher__user__first_name', 'teacher__user__last_name', 'teacher__user__username',
+    ).order_by('timeslot__weekday', 'timeslot__start_time')
+    for lesson_id, weekday, start_time, end_time, subject, class_group, room, first_name, last_name, username in lessons:
+        day = monday + timedelta(days=weekday)
+        teacher = f"{first_name} {last_name}".strip() or username
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:lesson-{lesson_id}@school_scheduling",
+            f"DTSTAMP:{stamp}",
+            # Floating local times: the school's wall clock in any time zone
+            f"DTSTART:{datetime.combine(day, start_time).strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND:{datetime.combine(day, end_time).strftime('%Y%m%dT%H%M%S')}",
+            f"RRULE:FREQ=WEEKLY;BYDAY={ICAL_DAYS[weekday]}",
+            f"SUMMARY:{escape(subject)} ({escape(class_group if kind == 'teacher' else teacher)})",
+            f"LOCATION:{escape(room)}",
+            f"DESCRIPTION:{escape(f'{subject} with {teacher} for {class_group} in {room}')}",
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(fold(line) for line in lines) + '\r\n'
+
+
+@query_budget(7)
+@require_GET
+def calendar_feed(request, token):
+    entity = read_token(token)
+    if entity is None:
+        raise Http404("Unknown calendar.")
+    kind, pk, feed_key = entity
+    current = cached_feed_entity(kind, pk)
+    # Gone, or its key has been reset since the link was handed out
+    if current is None or current[0] != feed_key:
+        raise Http404("Unknown calendar.")
+    stage_id = current[1]
+
+    key = feed_cache_key(kind, pk, entity_version(kind, pk), stage_data_version(stage_id))
+    body = cache.get(key)
+    if body is None:
+        body = build_calendar(kind, pk)
+        cache.set(key, body, GRID_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = f'inline; filename="{kind}-{pk}.ics"'
+    return response
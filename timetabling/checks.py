@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Several worker processes only see each other's version bumps and role
+    changes through a shared cache (caching.py, roles.py).
+    """
+    if getattr(settings, 'SHARED_CACHE', False):
+        return []
+    return [
+        Warning(
+            "The default cache is local to each process.",
+            hint="Set REDIS_URL before running more than one worker process, or schedules and cached "
+                 "pages go stale in the other workers.",
+            id='timetabling.W001',
+        )
+    ]
@@ -0,0 +1,65 @@
+"""
+Cover finder: who can take an absent teacher's lessons on a given day.
+
+Candidates come from the stage's occupancy index (occupancy.py), which
+keeps each teacher's taught timeslots and subjects up to date as lessons
+change, so checking every teacher against every affected lesson is a set
+lookup rather than a query. A whole day takes four queries however many
+lessons and teachers are involved.
+"""
+from collections import Counter
+
+from timetabling.models import Lesson, Teacher, TimeSlot
+from .occupancy import get_occupancy
+
+
+def find_cover(teacher, weekday):
+    """
+    Return one entry per lesson ``teacher`` has on ``weekday`` (Monday = 0),
+    in time order: ``{'lesson': Lesson, 'candidates': [...]}``. Candidates
+    are the stage's other teachers free at that time, each a dict with
+    ``teacher``, ``teaches_subject``, ``day_load`` and ``week_load``, best
+    first: teachers of the same subject, then the lightest load that day,
+    then that week.
+    """
+    occupancy = get_occupancy(teacher.stage_id)
+    lessons = list(
+        Lesson.objects.filter(teacher=teacher, timeslot__weekday=weekday)
+        .select_related('subject', 'class_group', 'room', 'timeslot')
+        .order_by('timeslot__start_time')
+    )
+    day_slots = set(
+        TimeSlot.objects.filter(stage_id=teacher.stage_id, weekday=weekday).values_list('id', flat=True)
+    )
+    others = list(
+        Teacher.objects.filter(stage_id=teacher.stage_id).exclude(pk=teacher.pk)
+        .select_related('user').order_by('user__last_name', 'user__first_name')
+    )
+
+    loads = {
+        other.pk: (len(occupancy.teacher_slots.get(other.pk, set()) & day_slots),
+                   len(occupancy.teacher_slots.get(other.pk, ())))
+        for other in others
+    }
+    # Cover already handed out in this plan counts towards the load, so
+    # one free teacher is not suggested first for every lesson
+    assigned = Counter()
+
+    cover = []
+    for lesson in lessons:
+        candidates = []
+        for other in others:
+            if not occupancy.is_free(other.pk, lesson.timeslot_id):
+                continue
+            day_load, week_load = loads[other.pk]
+            candidates.append({
+                'teacher': other,
+                'teaches_subject': occupancy.teaches(other.pk, lesson.subject_id),
+                'day_load': day_load + assigned[other.pk],
+                'week_load': week_load,
+            })
+        candidates.sort(key=lambda c: (not c['teaches_subject'], c['day_load'], c['week_load']))
+        if candidates:
+            assigned[candidates[0]['teacher'].pk] += 1
+        cover.append({'lesson': lesson, 'candidates': candidates})
+    return cover
@@ -0,0 +1,35 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import redirect
+
+
+def role_required(*roles):
+    """
+    Require a logged-in user in at least one of the given groups; anyone
+    else is sent home. Relies on RoleMiddleware having set ``request.roles``.
+    Works on sync and async views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            # login_required is sync-only; RoleMiddleware has already
+            # loaded the user, so checking it here needs no query
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if not request.user.is_authenticated:
+                    return redirect_to_login(request.get_full_path())
+                if request.roles.isdisjoint(roles):
+                    return redirect('home')
+                return await view_func(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view_func)
+        @login_required
+        def wrapper(request, *args, **kwargs):
+            if request.roles.isdisjoint(roles):
+                return redirect('home')
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
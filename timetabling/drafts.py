@@ -0,0 +1,118 @@
+"""
+Draft timetables: clone, diff and publish.
+
+Every step works on whole sets of rows in the database rather than on
+model instances. Cloning is a single INSERT ... SELECT, the diff is two
+EXCEPT queries, and publishing deletes the live lessons the draft drops and
+inserts the ones it adds in one transaction. A stage's lessons that are
+the same in the draft and live keep their rows and ids.
+"""
+from django.db import connections, models, router, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+from timetabling.models import DraftLesson, DraftSchedule, Lesson
+from .signals import lessons_bulk_changed
+
+
+# The columns that make up a lesson, in the order they are copied
+LESSON_FIELDS = ('teacher', 'subject', 'room', 'class_group', 'timeslot')
+
+# Columns compared and shown by draft_diff()
+DIFF_FIELDS = (
+    'timeslot_id', 'class_group_id', 'subject_id', 'teacher_id', 'room_id',
+    'timeslot__weekday', 'timeslot__day', 'timeslot__start_time', 'class_group__name', 'subject__name', 'room__name',
+    'teacher__user__first_name', 'teacher__user__last_name', 'teacher__user__username',
+)
+
+
+def insert_select(model, fields, queryset):
+    """
+    Insert the rows of ``queryset``, a values_list() in the same column
+    order as ``fields``, into ``model``'s table with a single
+    INSERT ... SELECT. Returns the number of rows inserted.
+    """
+    # A write, so both halves run on (and compile for) the write database
+    alias = router.db_for_write(model)
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    sql, params = queryset.using(alias).query.get_compiler(alias).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {quote(model._meta.db_table)} ({columns}) {sql}", params)
+        return cursor.rowcount
+
+
+def _constant(value):
+    return models.Value(value, output_field=models.IntegerField())
+
+
+def _lesson_columns(queryset, first):
+    # ``first`` followed by the lesson's columns. All are annotations, as
+    # the SQL puts plain fields before annotations whatever values_list()
+    # asks for, and INSERT ... SELECT goes by position.
+    columns = {'column_0': first}
+    columns.update((f'column_{i + 1}', F(f'{field}_id')) for i, field in enumerate(LESSON_FIELDS))
+    return queryset.annotate(**columns).values_list(*columns).order_by()
+
+
+def create_draft(stage, name, source=None):
+    """
+    Create a draft of ``stage`` holding a copy of ``source``'s lessons, or
+    of the live timetable if ``source`` is None.
+    """
+    with transaction.atomic():
+        draft = DraftSchedule.objects.create(stage=stage, name=name)
+        if source is None:
+            rows = Lesson.objects.filter(stage=stage)
+        else:
+            rows = DraftLesson.objects.filter(draft=source)
+        insert_select(DraftLesson, ('draft',) + LESSON_FIELDS, _lesson_columns(rows, _constant(draft.pk)))
+    return draft
+
+
+def draft_diff(draft):
+    """
+    Return ``{'added': [...], 'removed': [...], 'changed': [...]}`` between a
+    draft and its stage's live lessons. Rows are dicts of DIFF_FIELDS; a
+    class group whose lesson in a timeslot differs appears in ``changed``
+    as a (live, draft) pair rather than as a removal and an addition.
+    """
+    live = Lesson.objects.filter(stage_id=draft.stage_id).values_list(*DIFF_FIELDS).order_by()
+    drafted = DraftLesson.objects.filter(draft=draft).values_list(*DIFF_FIELDS).order_by()
+
+    def rows(queryset):
+        ordered = queryset.order_by('timeslot__weekday', 'timeslot__start_time', 'class_group__name')
+        return [dict(zip(DIFF_FIELDS, row)) for row in ordered]
+
+    removed_at = {(row['timeslot_id'], row['class_group_id']): row for row in rows(live.difference(drafted))}
+    # Each drafted row with the live row it replaces, or None
+    pairs = [
+        (removed_at.pop((row['timeslot_id'], row['class_group_id']), None), row)
+        for row in rows(drafted.difference(live))
+    ]
+    changed = [(before, row) for before, row in pairs if before is not None]
+    added = [row for before, row in pairs if before is None]
+    removed = list(removed_at.values())
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def publish_draft(draft):
+    """
+    Make a draft the stage's live timetable in one transaction: delete the
+    live lessons the draft does not have, then insert the draft lessons
+    that are not live. Returns ``(removed, added)`` row counts.
+    """
+    same = {f'{field}_id': OuterRef(f'{field}_id') for field in LESSON_FIELDS}
+    with transaction.atomic():
+        _, deleted = Lesson.objects.filter(stage_id=draft.stage_id).exclude(
+            Exists(DraftLesson.objects.filter(draft=draft, **same))
+        ).delete()
+        added = insert_select(Lesson, ('stage',) + LESSON_FIELDS, _lesson_columns(
+            DraftLesson.objects.filter(draft=draft).exclude(
+                Exists(Lesson.objects.filter(stage_id=draft.stage_id, **same))
+            ),
+            _constant(draft.stage_id),
+        ))
+        DraftSchedule.objects.filter(pk=draft.pk).update(published_at=timezone.now())
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=[draft.stage_id])
+    return deleted.get(Lesson._meta.label, 0), added
@@ -1,85 +1,171 @@
 import csv
-from django.http import HttpResponse
-from django.shortcuts import redirect
-from django.contrib.auth.decorators import login_required
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
 from django.utils.text import slugify
 from timetabling.models import Lesson
+from .decorators import role_required
+from .instrumentation import query_budget
+from .replicas import replica_reads
+from .roles import SECRETARIES, TEACHERS
+
+
+# Rows fetched per round trip (a server-side cursor on PostgreSQL)
+EXPORT_CHUNK_SIZE = 2000
+
+# Lesson columns fetched as plain tuples; no model instances are built
+LESSON_FIELDS = (
+    'stage__name',
+    'timeslot__day',
+    'timeslot__start_time',
+    'timeslot__end_time',
+    'class_group__name',
+    'subject__name',
+    'room__name',
+    'teacher__user__first_name',
+    'teacher__user__last_name',
+    'teacher__user__username',
+)
+
+
+class Echo:
+    """
+    Pseudo-buffer for csv.writer: write() hands the formatted line back
+    instead of storing it, so rows can be streamed one chunk at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def format_lesson(row):
+    # A LESSON_FIELDS tuple as [stage, day, start, end, class group, subject, room, teacher]
+    stage, day, start_time, end_time, class_group, subject, room, first_name, last_name, username = row
+    return [
+        stage,
+        day,
+        start_time.strftime('%H:%M'),
+        end_time.strftime('%H:%M'),
+        class_group,
+        subject,
+        room,
+        # Same as User.get_full_name() with a username fallback
+        f"{first_name} {last_name}".strip() or username,
+    ]
+
+
+def lesson_rows(lessons):
+    """
+    Yield [stage, day, start, end, class group, subject, room, teacher] rows
+    for a Lesson queryset, iterating it in chunks from the database.
+    """
+    for row in lessons.values_list(*LESSON_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield format_lesson(row)
+
+
+async def alesson_rows(lessons):
+    """
+    Async version of lesson_rows().
+    """
+    # QuerySet.aiterator() runs values_list() queries on the event loop in
+    # Django 4.2, so the sync iterator is advanced a chunk at a time in a
+    # thread instead
+    rows = lesson_rows(lessons)
+    while chunk := await sync_to_async(list)(islice(rows, EXPORT_CHUNK_SIZE)):
+        for row in chunk:
+            yield row
+
+
+def stream_csv(header, rows, empty_row):
+    """
+    Yield CSV text for a header and rows, batching lines so each chunk sent
+    to the client holds many rows. ``empty_row`` is written when there are
+    no rows, which saves a separate exists() query.
+    """
+    writer = csv.writer(Echo())
+    chunk = [writer.writerow(header)]
+    empty = True
+
+    for row in rows:
+        empty = False
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= 500:
+            yield ''.join(chunk)
+            chunk = []
+
+    if empty:
+        chunk.append(writer.writerow(empty_row))
+    yield ''.join(chunk)
+
+
+async def astream_csv(header, rows, empty_row):
+    """
+    Async version of stream_csv() for an async iterable of rows.
+    """
+    writer = csv.writer(Echo())
+    chunk = [writer.writerow(header)]
+    empty = True
+
+    async for row in rows:
+        empty = False
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= 500:
+            yield ''.join(chunk)
+            chunk = []
+
+    if empty:
+        chunk.append(writer.writerow(empty_row))
+    yield ''.join(chunk)
+
+
+def csv_response(content, filename):
+    response = StreamingHttpResponse(content, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
-@login_required
-def export_schedule_csv(request):
-    if not request.user.groups.filter(name='Secretaries').exists():
-        return redirect('home')
+SCHEDULE_HEADER = ['Stage', 'Day', 'Start Time', 'End Time', 'Class Group', 'Subject', 'Room', 'Teacher']
+SCHEDULE_EMPTY_ROW = ['No lessons match the selected filters.', '', '', '', '', '', '', '']
+TEACHER_HEADER = SCHEDULE_HEADER[:7]
+TEACHER_EMPTY_ROW = ['No lessons scheduled.', '', '', '', '', '', '']
+
 
-    lessons = Lesson.objects.select_related(
-        'teacher__user', 'teacher__stage',
-        'subject', 'room', 'class_group', 'timeslot'
-    ).order_by('timeslot__day', 'timeslot__start_time')
+def schedule_lessons(params):
+    # The full schedule in week order, narrowed by the teacher / class_group GET filters
+    lessons = Lesson.objects.order_by('timeslot__weekday', 'timeslot__start_time')
 
-    teacher_id = request.GET.get('teacher')
-    class_group_id = request.GET.get('class_group')
+    teacher_id = params.get('teacher')
+    class_group_id = params.get('class_group')
 
     if teacher_id:
         lessons = lessons.filter(teacher__id=teacher_id)
     if class_group_id:
         lessons = lessons.filter(class_group__id=class_group_id)
+    return lessons
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="full_schedule.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow(['Stage', 'Day', 'Start Time', 'End Time', 'Class Group', 'Subject', 'Room', 'Teacher'])
 
-    if not lessons.exists():
-        writer.writerow(['No lessons match the selected filters.', '', '', '', '', '', '', ''])
-        return response
+def teacher_lessons(teacher):
+    return Lesson.objects.filter(teacher=teacher).order_by('timeslot__weekday', 'timeslot__start_time')
 
-    for lesson in lessons:
-        writer.writerow([
-            lesson.teacher.stage.name,
-            lesson.timeslot.day,
-            lesson.timeslot.start_time.strftime('%H:%M'),
-            lesson.timeslot.end_time.strftime('%H:%M'),
-            lesson.class_group.name,
-            lesson.subject.name,
-            lesson.room.name,
-            lesson.teacher.user.get_full_name() or lesson.teacher.user.username,
-        ])
 
-    return response
-
-@login_required
+@query_budget(5)
+@replica_reads
+@role_required(SECRETARIES)
+def export_schedule_csv(request):
+    return csv_response(
+        stream_csv(SCHEDULE_HEADER, lesson_rows(schedule_lessons(request.GET)), SCHEDULE_EMPTY_ROW),
+        'full_schedule.csv',
+    )
+
+@query_budget(5)
+@replica_reads
+@role_required(TEACHERS)
 def export_teacher_schedule_csv(request):
-    if not request.user.groups.filter(name='Teachers').exists():
-        return redirect('home')
-
-    lessons = Lesson.objects.filter(
-        teacher__user=request.user
-    ).select_related(
-        'teacher__user', 'teacher__stage',
-        'subject', 'room', 'class_group', 'timeslot'
-    ).order_by('timeslot__day', 'timeslot__start_time')
-
-    filename = f"{slugify(request.user.username)}_schedule.csv"
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-    writer = csv.writer(response)
-    writer.writerow(['Stage', 'Day', 'Start Time', 'End Time', 'Class Group', 'Subject', 'Room'])
-
-    if not lessons.exists():
-        writer.writerow(['No lessons scheduled.', '', '', '', '', '', ''])
-        return response
-
-    for lesson in lessons:
-        writer.writerow([
-            lesson.teacher.stage.name,
-            lesson.timeslot.day,
-            lesson.timeslot.start_time.strftime('%H:%M'),
-            lesson.timeslot.end_time.strftime('%H:%M'),
-            lesson.class_group.name,
-            lesson.subject.name,
-            lesson.room.name,
-        ])
-
-    return response
\ No newline at end of file
+    return csv_response(
+        stream_csv(
+            TEACHER_HEADER,
+            (row[:7] for row in lesson_rows(teacher_lessons(request.teacher))),
+            TEACHER_EMPTY_ROW,
+        ),
+        f"{slugify(request.user.username)}_schedule.csv",
+    )
@@ -1,6 +1,7 @@
 # timetabling/forms.py
 from django import forms
-from .models import Lesson, ClassGroup, Subject, Room, Teacher, TimeSlot
+from .models import Lesson, ClassGroup, Subject, Room, Teacher, TimeSlot, Stage, DraftSchedule
+from .occupancy import get_occupancy
 
 class LessonForm(forms.ModelForm):
     class Meta:
@@ -11,4 +12,168 @@ class LessonForm(forms.ModelForm):
     subject = forms.ModelChoiceField(queryset=Subject.objects.none(), required=True)
     room = forms.ModelChoiceField(queryset=Room.objects.none(), required=True)
     teacher = forms.ModelChoiceField(queryset=Teacher.objects.none(), required=True)
-    timeslot = forms.ModelChoiceField(queryset=TimeSlot.objects.none(), required=True)
\ No newline at end of file
+    timeslot = forms.ModelChoiceField(queryset=TimeSlot.objects.none(), required=True)
+
+    CONFLICT_FIELDS = {
+        'teacher': "This teacher",
+        'room': "This room",
+        'class_group': "This class group",
+    }
+
+    def limit_to_stage(self, stage_id):
+        # Option labels include the stage (and the teacher's user), so load
+        # them with the choices rather than once per option
+        self.fields['class_group'].queryset = ClassGroup.objects.filter(stage_id=stage_id).select_related('stage')
+        self.fields['subject'].queryset = Subject.objects.filter(stage_id=stage_id).select_related('stage')
+        self.fields['room'].queryset = Room.objects.filter(stage_id=stage_id).select_related('stage')
+        self.fields['teacher'].queryset = Teacher.objects.filter(stage_id=stage_id).select_related('user', 'stage')
+        self.fields['timeslot'].queryset = TimeSlot.objects.filter(stage_id=stage_id).select_related('stage')
+
+    def hide_booked(self, timeslot):
+        # Only offer teachers, rooms and class groups free at this timeslot.
+        # Meant for unbound forms; submitted data is checked in clean().
+        occupancy = get_occupancy(timeslot.stage_id)
+        for field in self.CONFLICT_FIELDS:
+            busy = occupancy.busy_ids(field, timeslot.pk, exclude=self.instance.pk)
+            self.fields[field].queryset = self.fields[field].queryset.exclude(pk__in=busy)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        timeslot = cleaned_data.get('timeslot')
+        resources = {
+            field: cleaned_data[field].pk
+            for field in self.CONFLICT_FIELDS if cleaned_data.get(field)
+        }
+
+        if timeslot and resources:
+            # Report every double-booking at once from the occupancy index
+            conflicts = get_occupancy(timeslot.stage_id).conflicts(
+                timeslot.pk, exclude=self.instance.pk, **resources
+            )
+            for field in conflicts:
+                self.add_error(field, f"{self.CONFLICT_FIELDS[field]} is already booked at {timeslot.day} "
+                                      f"{timeslot.start_time.strftime('%H:%M')}.")
+
+        return cleaned_data
+
+    def save(self, commit=True):
+        lesson = super().save(commit=False)
+        if commit:
+            # is_valid() has already run the model's validation
+            lesson.save(validate=False)
+        return lesson
+
+class GenerateScheduleForm(forms.Form):
+    stage = forms.ModelChoiceField(queryset=Stage.objects.all(), required=True)
+    replace = forms.BooleanField(
+        required=False,
+        label="Replace existing lessons",
+        help_text="Leave unticked to keep existing lessons and only fill missing periods.",
+    )
+
+
+class ScheduleImportForm(forms.Form):
+    file = forms.FileField(label="CSV file", help_text="Same columns as the schedule CSV export.")
+    replace = forms.BooleanField(
+        required=False,
+        label="Replace existing lessons",
+        help_text="Remove the existing lessons of every stage in the file before importing.",
+    )
+
+
+class CoverForm(forms.Form):
+    teacher = forms.ModelChoiceField(
+        queryset=Teacher.objects.select_related('user', 'stage').order_by('user__last_name', 'user__first_name'),
+        label="Absent teacher",
+    )
+    day = forms.ChoiceField(choices=TimeSlot.DAY_CHOICES)
+
+
+class AvailabilityForm(forms.Form):
+    stage = forms.ModelChoiceField(queryset=Stage.objects.all())
+    teacher = forms.TypedMultipleChoiceField(coerce=int, required=False, label="Teachers")
+    class_group = forms.TypedMultipleChoiceField(coerce=int, required=False, label="Class groups")
+    room = forms.TypedMultipleChoiceField(coerce=int, required=False, label="Rooms")
+    day = forms.TypedChoiceField(
+        choices=[('', 'Any day')] + [(weekday, day) for day, weekday in TimeSlot.WEEKDAY_NUMBERS.items()],
+        coerce=int, empty_value=None, required=False,
+    )
+    timeslot = forms.TypedMultipleChoiceField(
+        coerce=int, required=False, label="Free at",
+        help_text="List the teachers, class groups and rooms free at all of these times.",
+    )
+
+    def __init__(self, *args, catalogue=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Choices come from the stage's cached catalogue (availability.py)
+        self.catalogue = catalogue
+        if catalogue:
+            for kind in ('teacher', 'class_group', 'room'):
+                self.fields[kind].choices = list(catalogue['names'][kind].items())
+            self.fields['timeslot'].choices = [
+                (pk, f"{day} {start_time:%H:%M}") for pk, day, _, start_time, _ in catalogue['slots']
+            ]
+
+
+class RepairForm(forms.Form):
+    stage = forms.ModelChoiceField(queryset=Stage.objects.all())
+    resource = forms.ChoiceField(label="Teacher, room or time")
+    unavailable = forms.TypedMultipleChoiceField(
+        coerce=int, required=False, label="Only unavailable at",
+        help_text="Leave empty if the teacher, room or time is being removed.",
+    )
+
+    def __init__(self, *args, catalogue=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.catalogue = catalogue
+        if catalogue:
+            slots = [(pk, f"{day} {start_time:%H:%M}") for pk, day, _, start_time, _ in catalogue['slots']]
+            self.fields['resource'].choices = [
+                ('Teachers', [(f"teacher:{pk}", name) for pk, name in catalogue['names']['teacher'].items()]),
+                ('Rooms', [(f"room:{pk}", name) for pk, name in catalogue['names']['room'].items()]),
+                ('Times', [(f"timeslot:{pk}", label) for pk, label in slots]),
+            ]
+            self.fields['unavailable'].choices = slots
+
+    def clean_resource(self):
+        kind, pk = self.cleaned_data['resource'].split(':')
+        return kind, int(pk)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        kind, _ = cleaned_data.get('resource', (None, None))
+        if kind == 'timeslot' and cleaned_data.get('unavailable'):
+            self.add_error('unavailable', "A time can only be removed, not made unavailable.")
+        return cleaned_data
+
+
+class DraftScheduleForm(forms.ModelForm):
+    class Meta:
+        model = DraftSchedule
+        fields = ['stage', 'name']
+
+    source = forms.ModelChoiceField(
+        queryset=DraftSchedule.objects.select_related('stage'),
+        required=False,
+        empty_label="Live timetable",
+        label="Copy from",
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        stage, source = cleaned_data.get('stage'), cleaned_data.get('source')
+        if stage and source and source.stage_id != stage.pk:
+            self.add_error('source', "Copy from a draft of the same stage.")
+        return cleaned_data
+
+
+class ReportForm(forms.Form):
+    stage = forms.ModelChoiceField(queryset=Stage.objects.all())
+    max_gaps = forms.IntegerField(min_value=0, required=False, label="Most free periods between lessons in a day")
+    max_consecutive = forms.IntegerField(min_value=1, required=False, label="Most lessons in a row")
+    max_daily = forms.IntegerField(min_value=1, required=False, label="Most lessons in a day")
+    max_subject_daily = forms.IntegerField(min_value=1, required=False, label="Most lessons of one subject in a day")
+
+
+class UtilisationForm(forms.Form):
+    stage = forms.ModelChoiceField(queryset=Stage.objects.all())
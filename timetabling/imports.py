@@ -0,0 +1,205 @@
+import csv
+import io
+from datetime import time
+
+from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.shortcuts import redirect, render
+from timetabling.models import Lesson, Stage, TimeSlot, ClassGroup, Subject, Room, Teacher
+from .decorators import role_required
+from .forms import ScheduleImportForm
+from .roles import SECRETARIES
+from .signals import lessons_bulk_changed
+
+
+# Same columns as exports.export_schedule_csv writes
+IMPORT_COLUMNS = ['Stage', 'Day', 'Start Time', 'End Time', 'Class Group', 'Subject', 'Room', 'Teacher']
+
+
+def _lookup(model, stage_ids):
+    # (stage_id, name) -> id for one stage-scoped model
+    return {
+        (stage_id, name): pk
+        for pk, stage_id, name in model.objects.filter(stage_id__in=stage_ids).values_list('id', 'stage_id', 'name')
+    }
+
+
+def _teacher_lookup(stage_ids):
+    # Teachers are exported by full name (or username), so index both
+    lookup = {}
+    teachers = Teacher.objects.filter(stage_id__in=stage_ids).values_list(
+        'id', 'stage_id', 'user__username', 'user__first_name', 'user__last_name'
+    )
+    for pk, stage_id, username, first_name, last_name in teachers:
+        full_name = f"{first_name} {last_name}".strip()
+        for name in {full_name or username, username}:
+            key = (stage_id, name)
+            # None marks a name shared by two teachers in one stage
+            lookup[key] = None if key in lookup and lookup[key] != pk else pk
+    return lookup
+
+
+def _parse_time(value):
+    try:
+        return time.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def build_lessons(rows, replace=False):
+    """
+    Resolve and validate CSV rows (dicts keyed by IMPORT_COLUMNS) as a batch.
+
+    Names are resolved with a handful of queries up front, and stage
+    consistency and double-booking are checked in memory against both the
+    existing lessons and the rest of the batch. Returns unsaved Lesson
+    objects, or raises ValidationError listing every problem row at once.
+    """
+    rows = [
+        (number, {column: (row.get(column) or '').strip() for column in IMPORT_COLUMNS})
+        for number, row in rows
+    ]
+    # Skip blank lines and the "No lessons" placeholder row from exports
+    rows = [(number, row) for number, row in rows if any(row[column] for column in IMPORT_COLUMNS[1:])]
+
+    stages = dict(Stage.objects.filter(name__in={row['Stage'] for _, row in rows}).values_list('name', 'id'))
+    stage_ids = list(stages.values())
+
+    slots = {
+        (stage_id, day, start_time, end_time): pk
+        for pk, stage_id, day, start_time, end_time in TimeSlot.objects.filter(
+            stage_id__in=stage_ids
+        ).values_list('id', 'stage_id', 'day', 'start_time', 'end_time')
+    }
+    class_groups = _lookup(ClassGroup, stage_ids)
+    subjects = _lookup(Subject, stage_ids)
+    rooms = _lookup(Room, stage_ids)
+    teachers = _teacher_lookup(stage_ids)
+
+    # (kind, resource_id, timeslot_id) -> row number, or 0 for an existing lesson
+    booked = {}
+    if not replace:
+        existing = Lesson.objects.filter(stage_id__in=stage_ids).values_list(
+            'teacher_id', 'room_id', 'class_group_id', 'timeslot_id'
+        )
+        for teacher_id, room_id, class_group_id, timeslot_id in existing:
+            booked[('teacher', teacher_id, timeslot_id)] = 0
+            booked[('room', room_id, timeslot_id)] = 0
+            booked[('class group', class_group_id, timeslot_id)] = 0
+
+    lessons = []
+    errors = []
+
+    for number, row in rows:
+        stage_id = stages.get(row['Stage'])
+        if stage_id is None:
+            errors.append(f"Row {number}: unknown stage '{row['Stage']}'.")
+            continue
+
+        # Every name is looked up within the row's stage, which is what
+        # keeps all five entities on the same stage
+        start_time, end_time = _parse_time(row['Start Time']), _parse_time(row['End Time'])
+        resolved = {
+            'timeslot': slots.get((stage_id, row['Day'].capitalize(), start_time, end_time)),
+            'class group': class_groups.get((stage_id, row['Class Group'])),
+            'subject': subjects.get((stage_id, row['Subject'])),
+            'room': rooms.get((stage_id, row['Room'])),
+            'teacher': teachers.get((stage_id, row['Teacher'])),
+        }
+        # A teacher name in the lookup but without an id is shared by several
+        ambiguous = resolved['teacher'] is None and (stage_id, row['Teacher']) in teachers
+        missing = [name for name, pk in resolved.items() if pk is None and not (name == 'teacher' and ambiguous)]
+        if missing or ambiguous:
+            problems = [f"no matching {', '.join(missing)} in {row['Stage']}"] if missing else []
+            if ambiguous:
+                problems.append(
+                    f"teacher '{row['Teacher']}' matches several teachers in {row['Stage']}; use their username"
+                )
+            errors.append(f"Row {number}: {'; '.join(problems)}.")
+            continue
+
+        timeslot_id = resolved['timeslot']
+        keys = {
+            (kind, resolved[kind], timeslot_id): column
+            for kind, column in [('teacher', 'Teacher'), ('room', 'Room'), ('class group', 'Class Group')]
+        }
+        conflicts = [
+            f"{key[0]} {row[column]} is already booked by "
+            f"{f'row {booked[key]}' if booked[key] else 'an existing lesson'}"
+            for key, column in keys.items() if key in booked
+        ]
+        if conflicts:
+            errors.append(f"Row {number}: {'; '.join(conflicts)} at {row['Day']} {row['Start Time']}.")
+            continue
+        booked.update(dict.fromkeys(keys, number))
+
+        lessons.append(Lesson(
+            stage_id=stage_id,
+            teacher_id=resolved['teacher'],
+            subject_id=resolved['subject'],
+            room_id=resolved['room'],
+            class_group_id=resolved['class group'],
+            timeslot_id=timeslot_id,
+        ))
+
+    if errors:
+        raise ValidationError(errors)
+    return lessons, stage_ids
+
+
+def import_lessons(rows, replace=False):
+    """
+    Validate a batch of rows and insert them with a single bulk_create in one
+    transaction. With ``replace`` the affected stages' lessons are removed
+    first. Returns the number of lessons created.
+    """
+    lessons, stage_ids = build_lessons(rows, replace=replace)
+
+    with transaction.atomic():
+        if replace:
+            Lesson.objects.filter(stage_id__in=stage_ids).delete()
+        Lesson.objects.bulk_create(lessons, batch_size=1000)
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=stage_ids)
+    return len(lessons)
+
+
+def read_csv(text):
+    """
+    Parse CSV text in the export format into (row_number, dict) pairs,
+    numbering rows as a spreadsheet would (header is row 1).
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [column for column in IMPORT_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValidationError(f"Missing columns: {', '.join(missing)}.")
+    return [(number, row) for number, row in enumerate(reader, start=2)]
+
+
+@role_required(SECRETARIES)
+def import_schedule_csv(request):
+    errors = []
+
+    if request.method == "POST":
+        form = ScheduleImportForm(request.POST, request.FILES)
+
+        if form.is_valid():
+            try:
+                text = form.cleaned_data['file'].read().decode('utf-8-sig')
+                created = import_lessons(read_csv(text), replace=form.cleaned_data['replace'])
+            except UnicodeDecodeError:
+                errors = ["The file must be UTF-8 encoded CSV."]
+            except ValidationError as e:
+                errors = e.messages
+            else:
+                messages.success(request, f"{created} lessons imported successfully!")
+                return redirect('create_schedule')
+
+    else:
+        form = ScheduleImportForm()
+
+    return render(request, "timetabling/import_schedule.html", {
+        'form': form,
+        'import_errors': errors,
+        'columns': IMPORT_COLUMNS,
+    })
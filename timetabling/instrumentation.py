@@ -0,0 +1,110 @@
+"""
+SQL query counting for views.
+
+QueryCounter counts the queries (and their time) run on every database
+connection while it is active. QueryBudgetMiddleware wraps each request in
+one, logs views that go over the budget set with @query_budget, and in
+DEBUG adds X-Query-Count / X-Query-Time headers to responses.
+
+Streaming responses run their queries after the view returns, so only the
+setup part of those views is counted here; the tests consume the stream
+inside a counter to cover them fully.
+"""
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('timetabling.queries')
+
+
+class QueryCounter:
+    """
+    Context manager exposing ``count`` and ``duration`` (seconds) of the
+    queries executed inside it. Use ``async with`` in async code: database
+    connections belong to a thread, so the counter is attached on the
+    thread that sync_to_async() runs the ORM's queries on.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    async def __aenter__(self):
+        return await sync_to_async(self.__enter__)()
+
+    async def __aexit__(self, *exc_info):
+        await sync_to_async(self.__exit__)(*exc_info)
+
+
+def query_budget(max_queries):
+    """
+    Declare the most queries a view should need. Exceeding it is logged by
+    QueryBudgetMiddleware and fails the query-budget tests.
+    """
+    def decorator(view_func):
+        # Decorators built with functools.wraps carry the attribute outwards
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.query_budget = None
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        return self.report(request, response, counter)
+
+    async def __acall__(self, request):
+        request.query_budget = None
+        async with QueryCounter() as counter:
+            response = await self.get_response(request)
+        return self.report(request, response, counter)
+
+    def report(self, request, response, counter):
+        budget = request.query_budget
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                "%s %s ran %d queries (budget %d) in %.1fms",
+                request.method, request.path, counter.count, budget, counter.duration * 1000,
+            )
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(counter.count)
+            response['X-Query-Time'] = f"{counter.duration * 1000:.1f}ms"
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
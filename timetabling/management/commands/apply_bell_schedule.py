@@ -0,0 +1,40 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from timetabling.bells import WEEKDAYS, expand_bell_schedule, retime_stage
+from timetabling.models import BellSchedule, Stage
+
+
+class Command(BaseCommand):
+    help = "Creates (or re-times) stages' timeslots from a bell schedule"
+
+    def add_arguments(self, parser):
+        parser.add_argument('bell_schedule', help='Name of the bell schedule')
+        parser.add_argument('--stage', action='append', dest='stages', metavar='STAGE',
+                            help='Stage to apply it to (repeatable; default: the stages linked to the schedule)')
+        parser.add_argument('--day', action='append', dest='days', choices=WEEKDAYS, metavar='DAY',
+                            help='Weekday to apply it to (repeatable; default: every weekday)')
+        parser.add_argument('--retime', action='store_true',
+                            help="Move the stages' existing timeslots onto the schedule's times instead")
+
+    def handle(self, *args, **options):
+        try:
+            bell_schedule = BellSchedule.objects.get(name=options['bell_schedule'])
+        except BellSchedule.DoesNotExist:
+            raise CommandError(f"Bell schedule '{options['bell_schedule']}' does not exist.")
+
+        stages = bell_schedule.stages.all()
+        if options['stages']:
+            stages = Stage.objects.filter(name__in=options['stages'])
+            missing = set(options['stages']) - {stage.name for stage in stages}
+            if missing:
+                raise CommandError(f"Unknown stage(s): {', '.join(sorted(missing))}.")
+        if not stages:
+            raise CommandError(f"{bell_schedule.name} is not linked to any stage; pass --stage.")
+
+        func, verb = (retime_stage, 're-timed') if options['retime'] else (expand_bell_schedule, 'created')
+        for stage in stages:
+            try:
+                count = func(bell_schedule, stage, days=options['days'])
+            except ValidationError as e:
+                raise CommandError('\n'.join(e.messages))
+            self.stdout.write(self.style.SUCCESS(f"{stage.name}: {count} timeslots {verb}."))
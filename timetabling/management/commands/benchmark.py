@@ -0,0 +1,136 @@
+import json
+import platform
+import statistics
+import time
+
+import django
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from timetabling.instrumentation import QueryCounter
+from timetabling.models import Stage, ClassGroup, Room, TimeSlot, Teacher, Lesson
+from timetabling.roles import SECRETARIES, TEACHERS, invalidate_roles
+
+
+class Command(BaseCommand):
+    help = 'Times the main views, the CSV exports and model validation, and writes the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per benchmark')
+        parser.add_argument('--validations', type=int, default=200, help='Lessons to full_clean() per run')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every run')
+
+    def handle(self, *args, **options):
+        lesson = Lesson.objects.select_related('teacher__user').first()
+        if lesson is None:
+            raise CommandError('No lessons to benchmark. Run "seed_school --synthetic" first.')
+
+        # The benchmark user, group memberships and sessions are rolled back
+        # afterwards so the database is left as it was found
+        with transaction.atomic():
+            report, user_ids = self.run(lesson, options)
+            transaction.set_rollback(True)
+        invalidate_roles(*user_ids)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
+        else:
+            self.stdout.write(output)
+
+    def run(self, lesson, options):
+        secretary = self.benchmark_user('benchmark-secretary', SECRETARIES)
+        teacher_user = lesson.teacher.user
+        teacher_user.groups.add(Group.objects.get_or_create(name=TEACHERS)[0])
+        stage_id = lesson.stage_id
+
+        # 127.0.0.1 is in ALLOWED_HOSTS, the test client's default host is not
+        secretary_client = Client(SERVER_NAME='127.0.0.1')
+        secretary_client.force_login(secretary)
+        teacher_client = Client(SERVER_NAME='127.0.0.1')
+        teacher_client.force_login(teacher_user)
+
+        pages = {
+            'home': (secretary_client, 'get', reverse('home'), None),
+            'create_schedule': (secretary_client, 'get', reverse('create_schedule'), None),
+            'create_schedule_select_stage': (
+                secretary_client, 'post', reverse('create_schedule'), {'stage': stage_id, 'select_stage': ''}
+            ),
+            'edit_lesson': (secretary_client, 'get', reverse('edit_lesson', args=[lesson.pk]), None),
+            'admin_schedule': (secretary_client, 'get', reverse('admin_schedule'), None),
+            'timetable_stage': (secretary_client, 'get', reverse('timetable', args=['stage', stage_id]), None),
+            'export_schedule_csv': (secretary_client, 'get', reverse('export_schedule_csv'), None),
+            'view_schedule': (teacher_client, 'get', reverse('view_schedule'), None),
+            'export_teacher_schedule_csv': (teacher_client, 'get', reverse('export_teacher_schedule_csv'), None),
+        }
+
+        results = {}
+        for name, (client, method, url, data) in pages.items():
+            self.stdout.write(f'  {name}...', ending='')
+            results[name] = self.measure(lambda: self.fetch(client, method, url, data), options)
+            self.stdout.write(f" {results[name]['median_ms']:.1f}ms")
+
+        lessons = list(Lesson.objects.all()[:options['validations']])
+        timeslots = list(TimeSlot.objects.all()[:options['validations']])
+        results['lesson_full_clean'] = self.measure(lambda: [item.full_clean() for item in lessons], options)
+        results['timeslot_full_clean'] = self.measure(lambda: [item.full_clean() for item in timeslots], options)
+
+        report = {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': Lesson.objects.db,
+            'runs': options['runs'],
+            'dataset': {
+                'stages': Stage.objects.count(),
+                'teachers': Teacher.objects.count(),
+                'rooms': Room.objects.count(),
+                'class_groups': ClassGroup.objects.count(),
+                'timeslots': TimeSlot.objects.count(),
+                'lessons': Lesson.objects.count(),
+            },
+            'results': results,
+        }
+        return report, [secretary.pk, teacher_user.pk]
+
+    def benchmark_user(self, username, role):
+        user, created = User.objects.get_or_create(username=username, defaults={'is_staff': True})
+        if created:
+            user.set_unusable_password()
+            user.save()
+        user.groups.add(Group.objects.get_or_create(name=role)[0])
+        return user
+
+    def fetch(self, client, method, url, data):
+        response = getattr(client, method)(url, data)
+        if response.streaming:
+            # Streaming responses do their work while being consumed
+            for _ in response.streaming_content:
+                pass
+        if response.status_code != 200:
+            raise CommandError(f'{method.upper()} {url} returned {response.status_code}.')
+
+    def measure(self, func, options):
+        timings = []
+        queries = []
+        for _ in range(options['runs']):
+            if options['cold']:
+                cache.clear()
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+        return {
+            'min_ms': round(min(timings), 2),
+            'median_ms': round(statistics.median(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': max(queries),
+        }
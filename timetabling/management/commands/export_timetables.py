@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from timetabling.archives import write_archive
+
+
+class Command(BaseCommand):
+    help = 'Writes a zip with a CSV timetable per teacher, class group and room plus the whole school'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Where to write the zip file')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Format the per-entity files in this many processes')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with open(options['path'], 'wb') as f:
+            count = write_archive(f, workers=options['workers'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} lessons to {options['path']} in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from timetabling.imports import build_lessons, import_lessons, read_csv
+
+
+class Command(BaseCommand):
+    help = 'Imports lessons from a CSV file in the schedule export format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--replace', action='store_true', help="Remove the file's stages' existing lessons first")
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without saving anything')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                rows = read_csv(f.read())
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+
+        started = time.perf_counter()
+        try:
+            if options['dry_run']:
+                count = len(build_lessons(rows, replace=options['replace'])[0])
+            else:
+                count = import_lessons(rows, replace=options['replace'])
+        except ValidationError as e:
+            for message in e.messages:
+                self.stderr.write(message)
+            raise CommandError(f'{len(e.messages)} rows failed validation; nothing was imported.')
+        elapsed = time.perf_counter() - started
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{count} lessons are valid ({elapsed:.2f}s). Dry run: nothing saved.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{count} lessons imported in {elapsed:.2f}s.'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from timetabling.analytics import rebuild_utilisation
+from timetabling.models import Stage
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the utilisation summary from the lessons, e.g. after writing lessons with raw SQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', action='append', help='Name of a stage to rebuild (default: all)')
+
+    def handle(self, *args, **options):
+        stage_ids = None
+        if options['stage']:
+            stages = dict(Stage.objects.filter(name__in=options['stage']).values_list('name', 'id'))
+            missing = set(options['stage']) - set(stages)
+            if missing:
+                raise CommandError(f"Stage '{sorted(missing)[0]}' does not exist.")
+            stage_ids = list(stages.values())
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            rows = rebuild_utilisation(stage_ids)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} utilisation rows in {elapsed:.2f}s."))
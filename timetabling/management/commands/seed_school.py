@@ -1,12 +1,32 @@
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
 from timetabling.models import Teacher, Subject, Room, ClassGroup, TimeSlot, Stage
+from timetabling.synthetic import generate_school
 
 
 class Command(BaseCommand):
     help = 'Seeds the database with Middle and High School test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Generate a large synthetic school (with lessons) instead of the fixed test data')
+        parser.add_argument('--stages', type=int, default=2)
+        parser.add_argument('--teachers', type=int, default=40, help='Teachers per stage')
+        parser.add_argument('--rooms', type=int, default=30, help='Rooms per stage')
+        parser.add_argument('--class-groups', type=int, default=24, help='Class groups per stage')
+        parser.add_argument('--periods-per-day', type=int, default=7)
+        parser.add_argument('--fill', type=float, default=0.8,
+                            help='Fraction of the available lesson places to fill (0-1)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible dataset')
+        parser.add_argument('--prefix', default='Synthetic', help='Prefix for the generated stage names')
+
     def handle(self, *args, **kwargs):
+        if kwargs['synthetic']:
+            return self.handle_synthetic(**kwargs)
+
         self.stdout.write('Seeding data...')
 
         # -------------------------
@@ -127,4 +147,25 @@ class Command(BaseCommand):
             ClassGroup.objects.get_or_create(name=name, stage=high)
         self.stdout.write('  High School class groups created.')
 
-        self.stdout.write(self.style.SUCCESS('Database seeded successfully!'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS('Database seeded successfully!'))
+
+    def handle_synthetic(self, **options):
+        self.stdout.write('Generating synthetic school...')
+        started = time.perf_counter()
+        try:
+            counts = generate_school(
+                stages=options['stages'],
+                teachers=options['teachers'],
+                rooms=options['rooms'],
+                class_groups=options['class_groups'],
+                periods_per_day=options['periods_per_day'],
+                fill=options['fill'],
+                seed=options['seed'],
+                prefix=options['prefix'],
+            )
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        elapsed = time.perf_counter() - started
+        for name, count in counts.items():
+            self.stdout.write(f"  {name.replace('_', ' ').capitalize()}: {count}")
+        self.stdout.write(self.style.SUCCESS(f'Synthetic school generated in {elapsed:.1f}s!'))
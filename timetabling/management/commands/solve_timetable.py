@@ -0,0 +1,52 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from timetabling.models import Stage
+from timetabling.solver import apply_solution, load_problem, solve
+
+
+class Command(BaseCommand):
+    help = "Generates a stage's lessons from its lesson requirements"
+
+    def add_arguments(self, parser):
+        parser.add_argument('stage', help='Name of the stage to solve')
+        parser.add_argument('--restarts', type=int, default=16, help='Number of randomised solver passes')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+        parser.add_argument('--replace', action='store_true', help="Discard the stage's existing lessons first")
+        parser.add_argument('--dry-run', action='store_true', help='Solve but do not save anything')
+
+    def handle(self, *args, **options):
+        try:
+            stage = Stage.objects.get(name=options['stage'])
+        except Stage.DoesNotExist:
+            raise CommandError(f"Stage '{options['stage']}' does not exist.")
+
+        problem = load_problem(stage, replace=options['replace'])
+        self.stdout.write(
+            f"Solving {len(problem['units'])} periods over {len(problem['slot_ids'])} timeslots "
+            f"and {len(problem['room_ids'])} rooms..."
+        )
+
+        started = time.perf_counter()
+        unplaced_count, repeats, assignments, unplaced = solve(
+            problem,
+            restarts=options['restarts'],
+            workers=options['workers'],
+            seed=options['seed'],
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'  Placed {len(assignments)} periods in {elapsed:.2f}s ({repeats} same-day repeats).')
+
+        if unplaced_count:
+            self.stdout.write(self.style.WARNING(f'  {unplaced_count} periods could not be placed:'))
+            for (class_group, subject, teacher), count in sorted(Counter(unplaced).items()):
+                self.stdout.write(f'    class group #{class_group}, subject #{subject}, teacher #{teacher}: {count}')
+
+        if options['dry_run']:
+            self.stdout.write('Dry run: nothing saved.')
+            return
+
+        created = apply_solution(stage, assignments, replace=options['replace'])
+        self.stdout.write(self.style.SUCCESS(f'{created} lessons created for {stage.name}.'))
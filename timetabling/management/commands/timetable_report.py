@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from timetabling.models import Stage
+from timetabling.report import build_report, report_limits
+
+
+METRIC_LABELS = {
+    'gaps': 'free periods between lessons',
+    'longest_run': 'lessons in a row',
+    'load': 'lessons in the day',
+    'subject_daily': 'lessons of the subject in the day',
+}
+
+
+class Command(BaseCommand):
+    help = 'Reports teacher and class group gaps, consecutive periods, daily load and subject spread'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', action='append', help='Name of a stage to report on (default: all)')
+        parser.add_argument('--max-gaps', type=int, help='Most free periods between lessons in a day')
+        parser.add_argument('--max-consecutive', type=int, help='Most lessons in a row')
+        parser.add_argument('--max-daily', type=int, help='Most lessons in a day')
+        parser.add_argument('--max-subject-daily', type=int, help='Most lessons of one subject in a day')
+        parser.add_argument('--show', type=int, default=20, help='Violations to list per stage')
+
+    def handle(self, *args, **options):
+        stages = Stage.objects.all()
+        if options['stage']:
+            stages = stages.filter(name__in=options['stage'])
+            missing = set(options['stage']) - {stage.name for stage in stages}
+            if missing:
+                raise CommandError(f"Stage '{sorted(missing)[0]}' does not exist.")
+
+        limits = report_limits(
+            max_gaps=options['max_gaps'],
+            max_consecutive=options['max_consecutive'],
+            max_daily=options['max_daily'],
+            max_subject_daily=options['max_subject_daily'],
+        )
+
+        started = time.perf_counter()
+        total = 0
+        for stage in stages:
+            report = build_report(stage, limits)
+            violations = report['violations']
+            total += len(violations)
+            teacher, class_group = report['summary']['teacher'], report['summary']['class_group']
+            spread = report['summary']['subject_spread']
+
+            self.stdout.write(f"{stage.name}: {report['lessons']} lessons")
+            self.stdout.write(
+                f"  Teachers: {teacher['gaps']} gaps, {teacher['average_daily']} lessons a day on average, "
+                f"at most {teacher['max_daily']} a day and {teacher['longest_run']} in a row"
+            )
+            self.stdout.write(
+                f"  Class groups: {class_group['gaps']} gaps, at most {class_group['max_daily']} lessons a day "
+                f"and {class_group['longest_run']} in a row"
+            )
+            self.stdout.write(
+                f"  Subjects: {spread['clustered']} of {spread['subjects']} not spread over the week"
+            )
+
+            style = self.style.WARNING if violations else self.style.SUCCESS
+            self.stdout.write(style(f"  {len(violations)} violations"))
+            for violation in violations[:options['show']]:
+                self.stdout.write(
+                    f"    {violation['name']}, {violation['day']}: {violation['value']} "
+                    f"{METRIC_LABELS[violation['metric']]} (limit {violation['limit']})"
+                )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{total} violations in {len(stages)} stages, reported in {elapsed:.2f}s.")
@@ -0,0 +1,29 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from .roles import resolve_roles
+
+
+class RoleMiddleware:
+    """
+    Exposes ``request.roles`` (the user's group names) and ``request.teacher``
+    (their Teacher row or None). Must come after AuthenticationMiddleware.
+    Under ASGI it resolves them in a thread, which also loads
+    ``request.user`` so async views can read it without querying.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.roles, request.teacher = resolve_roles(request.user)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.roles, request.teacher = await sync_to_async(resolve_roles)(request.user)
+        return await self.get_response(request)
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.28 on 2026-10-18 07:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0006_lesson_teacher_alter_classgroup_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonRequirement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periods_per_week', models.PositiveSmallIntegerField(default=1)),
+                ('class_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='timetabling.classgroup')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='timetabling.subject')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='timetabling.teacher')),
+            ],
+            options={
+                'ordering': ['class_group', 'subject'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='lessonrequirement',
+            constraint=models.UniqueConstraint(fields=('class_group', 'subject'), name='unique_requirement_per_subject'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.28 on 2026-10-18 07:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0007_lessonrequirement_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['day', 'start_time'], name='timeslot_day_start_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.28 on 2026-10-18 07:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0008_timeslot_day_start_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BellSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('stages', models.ManyToManyField(blank=True, related_name='bell_schedules', to='timetabling.stage')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BellPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('bell_schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='periods', to='timetabling.bellschedule')),
+            ],
+            options={
+                'ordering': ['bell_schedule', 'start_time'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bellperiod',
+            constraint=models.UniqueConstraint(fields=('bell_schedule', 'start_time'), name='unique_period_start_per_schedule'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_stage(apps, schema_editor):
+    Lesson = apps.get_model('timetabling', 'Lesson')
+    TimeSlot = apps.get_model('timetabling', 'TimeSlot')
+    Lesson.objects.update(stage_id=models.Subquery(
+        TimeSlot.objects.filter(pk=models.OuterRef('timeslot_id')).values('stage_id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0009_bellschedule_bellperiod_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='stage',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lessons', to='timetabling.stage'),
+        ),
+        migrations.RunPython(backfill_stage, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='lesson',
+            name='stage',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='lessons', to='timetabling.stage'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['stage', 'timeslot'], name='lesson_stage_timeslot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['stage', 'teacher'], name='lesson_stage_teacher_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['stage', 'class_group'], name='lesson_stage_classgroup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['stage', 'room'], name='lesson_stage_room_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+
+def backfill_weekday(apps, schema_editor):
+    TimeSlot = apps.get_model('timetabling', 'TimeSlot')
+    TimeSlot.objects.update(weekday=models.Case(
+        *[models.When(day=day, then=models.Value(number)) for number, day in enumerate(DAYS)],
+        output_field=models.PositiveSmallIntegerField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0010_lesson_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='weekday',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_weekday, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='weekday',
+            field=models.PositiveSmallIntegerField(editable=False),
+        ),
+        migrations.AlterModelOptions(
+            name='timeslot',
+            options={'ordering': ['stage', 'weekday', 'start_time']},
+        ),
+        migrations.RemoveIndex(
+            model_name='timeslot',
+            name='timeslot_day_start_idx',
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['stage', 'weekday', 'start_time'], name='timeslot_stage_weekday_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['weekday', 'start_time'], name='timeslot_weekday_start_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.28 on 2026-10-18 07:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0011_timeslot_weekday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DraftSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('published_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drafts', to='timetabling.stage')),
+            ],
+            options={
+                'ordering': ['stage', '-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DraftLesson',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.classgroup')),
+                ('draft', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lessons', to='timetabling.draftschedule')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.room')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.subject')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.teacher')),
+                ('timeslot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.timeslot')),
+            ],
+            options={
+                'ordering': ['draft', 'timeslot', 'class_group'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='draftschedule',
+            constraint=models.UniqueConstraint(fields=('stage', 'name'), name='unique_draft_name_per_stage'),
+        ),
+        migrations.AddConstraint(
+            model_name='draftlesson',
+            constraint=models.UniqueConstraint(fields=('draft', 'teacher', 'timeslot'), name='unique_draft_teacher_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='draftlesson',
+            constraint=models.UniqueConstraint(fields=('draft', 'room', 'timeslot'), name='unique_draft_room_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='draftlesson',
+            constraint=models.UniqueConstraint(fields=('draft', 'class_group', 'timeslot'), name='unique_draft_classgroup_timeslot'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.28 on 2026-10-18 07:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0012_draftschedule_draftlesson'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='timetabling.stage')),
+            ],
+            options={
+                'ordering': ['stage', 'start_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LessonOverride',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('cancelled', models.BooleanField(default=False)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='overrides', to='timetabling.lesson')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.room')),
+                ('teacher', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.teacher', verbose_name='cover teacher')),
+            ],
+            options={
+                'ordering': ['date', 'lesson'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Holiday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('stage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holidays', to='timetabling.stage')),
+            ],
+            options={
+                'ordering': ['start_date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='term',
+            constraint=models.UniqueConstraint(fields=('stage', 'name'), name='unique_term_name_per_stage'),
+        ),
+        migrations.AddIndex(
+            model_name='lessonoverride',
+            index=models.Index(fields=['date', 'teacher'], name='override_date_teacher_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lessonoverride',
+            index=models.Index(fields=['date', 'room'], name='override_date_room_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='lessonoverride',
+            constraint=models.UniqueConstraint(fields=('lesson', 'date'), name='unique_override_per_lesson_date'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.28 on 2026-10-18 07:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_utilisation(apps, schema_editor):
+    # Same aggregate as analytics.rebuild_utilisation()
+    Lesson = apps.get_model('timetabling', 'Lesson')
+    UtilisationSummary = apps.get_model('timetabling', 'UtilisationSummary')
+    length = models.ExpressionWrapper(
+        models.F('timeslot__end_time') - models.F('timeslot__start_time'), output_field=models.DurationField()
+    )
+    rows = []
+    for kind in ('teacher', 'room', 'subject'):
+        totals = Lesson.objects.values_list('stage_id', f'{kind}_id', 'timeslot__weekday').annotate(
+            periods=models.Count('id'), length=models.Sum(length),
+        ).order_by()
+        rows.extend(
+            UtilisationSummary(
+                stage_id=stage_id, kind=kind, entity_id=entity_id, weekday=weekday,
+                periods=periods, minutes=int(total.total_seconds() // 60),
+            )
+            for stage_id, entity_id, weekday, periods, total in totals
+        )
+    UtilisationSummary.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0013_term_holiday_lessonoverride'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtilisationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('teacher', 'Teacher'), ('room', 'Room'), ('subject', 'Subject')], max_length=10)),
+                ('entity_id', models.PositiveIntegerField()),
+                ('weekday', models.PositiveSmallIntegerField()),
+                ('periods', models.IntegerField(default=0)),
+                ('minutes', models.IntegerField(default=0)),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='timetabling.stage')),
+            ],
+            options={
+                'ordering': ['stage', 'kind', 'entity_id', 'weekday'],
+                'indexes': [models.Index(fields=['stage', 'kind'], name='utilisation_stage_kind_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='utilisationsummary',
+            constraint=models.UniqueConstraint(fields=('kind', 'entity_id', 'weekday'), name='unique_utilisation_per_day'),
+        ),
+        migrations.RunPython(backfill_utilisation, migrations.RunPython.noop),
+    ]
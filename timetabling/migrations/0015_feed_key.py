@@ -0,0 +1,35 @@
+# Generated by Django 4.2.28 on 2026-10-18 08:25
+
+from django.db import migrations, models
+import timetabling.models
+
+
+def give_each_row_a_key(apps, schema_editor):
+    # AddField fills every existing row with the same default
+    for model_name in ('ClassGroup', 'Teacher'):
+        model = apps.get_model('timetabling', model_name)
+        rows = list(model.objects.only('pk'))
+        for row in rows:
+            row.feed_key = timetabling.models.new_feed_key()
+        model.objects.bulk_update(rows, ['feed_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetabling', '0014_utilisationsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classgroup',
+            name='feed_key',
+            field=models.CharField(default=timetabling.models.new_feed_key, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='teacher',
+            name='feed_key',
+            field=models.CharField(default=timetabling.models.new_feed_key, editable=False, max_length=32),
+        ),
+        migrations.RunPython(give_each_row_a_key, migrations.RunPython.noop),
+    ]
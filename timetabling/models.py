@@ -1,3 +1,5 @@
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
@@ -17,11 +19,49 @@ class Stage(models.Model):
         return self.name
 
 
-class Subject(models.Model):
+def new_feed_key():
+    # Part of the signed calendar feed URL; replacing it revokes old links
+    return secrets.token_urlsafe(16)
+
+
+class StageScoped:
+    """
+    Mixin for the entities a Lesson copies its stage from. Lesson.stage would
+    go stale if one of them moved, so an entity with lessons keeps its stage.
+    ``lesson_field`` names the Lesson foreign key that points at the entity.
+    """
+    lesson_field = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stage_id = instance.__dict__.get('stage_id')
+        return instance
+
+    def check_stage_change(self):
+        loaded = getattr(self, '_loaded_stage_id', None)
+        if loaded is None or loaded == self.stage_id:
+            return
+        if Lesson.objects.filter(**{self.lesson_field: self.pk}).exists():
+            raise ValidationError({'stage': "Cannot change the stage while lessons use this. Move or delete them first."})
+
+    def clean(self):
+        super().clean()
+        self.check_stage_change()
+
+    def save(self, *args, **kwargs):
+        self.check_stage_change()
+        super().save(*args, **kwargs)
+        self._loaded_stage_id = self.stage_id
+
+
+class Subject(StageScoped, models.Model):
     """
     A subject taught at a given stage (e.g. Maths - High School).
     A subject name can be reused across stages but must be unique within one.
     """
+    lesson_field = 'subject'
+
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
 
@@ -35,11 +75,13 @@ class Subject(models.Model):
         return f"{self.name} ({self.stage})"
 
 
-class Room(models.Model):
+class Room(StageScoped, models.Model):
     """
     A physical room available for scheduling at a given stage.
     Room names must be unique within a stage.
     """
+    lesson_field = 'room'
+
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
 
@@ -53,13 +95,16 @@ class Room(models.Model):
         return f"{self.name} ({self.stage})"
 
 
-class ClassGroup(models.Model):
+class ClassGroup(StageScoped, models.Model):
     """
     A group of students that are scheduled together (e.g. Year 10A).
     Class group names must be unique within a stage.
     """
+    lesson_field = 'class_group'
+
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
+    feed_key = models.CharField(max_length=32, default=new_feed_key, editable=False)
 
     class Meta:
         ordering = ['stage', 'name']
@@ -71,11 +116,13 @@ class ClassGroup(models.Model):
         return f"{self.name} ({self.stage})"
 
 
-class TimeSlot(models.Model):
+class TimeSlot(StageScoped, models.Model):
     """
     A specific period on a given day within a stage's timetable.
     No two timeslots at the same stage can share the same day and time range.
     """
+    lesson_field = 'timeslot'
+
     DAY_CHOICES = [
         ('Monday', 'Monday'),
         ('Tuesday', 'Tuesday'),
@@ -83,25 +130,35 @@ class TimeSlot(models.Model):
         ('Thursday', 'Thursday'),
         ('Friday', 'Friday'),
     ]
+    # Monday = 0 ... Friday = 4, as in date.weekday()
+    WEEKDAY_NUMBERS = {day: number for number, (day, _) in enumerate(DAY_CHOICES)}
 
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
     day = models.CharField(max_length=9, choices=DAY_CHOICES)
+    # Copy of day that sorts in week order; set in save() and by bulk writers
+    weekday = models.PositiveSmallIntegerField(editable=False)
     start_time = models.TimeField()
     end_time = models.TimeField()
 
     class Meta:
-        ordering = ['stage', 'day', 'start_time']
+        ordering = ['stage', 'weekday', 'start_time']
         constraints = [
             models.UniqueConstraint(
                 fields=['stage', 'day', 'start_time', 'end_time'],
                 name='unique_timeslot_per_stage'
             )
         ]
+        indexes = [
+            # Serve the (weekday, start_time) ordering of the lesson tables
+            models.Index(fields=['stage', 'weekday', 'start_time'], name='timeslot_stage_weekday_idx'),
+            models.Index(fields=['weekday', 'start_time'], name='timeslot_weekday_start_idx'),
+        ]
 
     def __str__(self):
         return f"{self.day} {self.start_time.strftime('%H:%M')}–{self.end_time.strftime('%H:%M')} ({self.stage})"
 
     def clean(self):
+        super().clean()
         # Ensure start time is before end time
         if self.start_time >= self.end_time:
             raise ValidationError("Start time must be before end time.")
@@ -118,17 +175,21 @@ class TimeSlot(models.Model):
             raise ValidationError("This timeslot overlaps with an existing timeslot.")
 
     def save(self, *args, **kwargs):
+        self.weekday = self.WEEKDAY_NUMBERS.get(self.day)
         self.full_clean()
         super().save(*args, **kwargs)
 
 
-class Teacher(models.Model):
+class Teacher(StageScoped, models.Model):
     """
     A teacher account linked to a Django User and assigned to a stage.
     Name and display data are sourced from the related User object.
     """
+    lesson_field = 'teacher'
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
+    feed_key = models.CharField(max_length=32, default=new_feed_key, editable=False)
 
     class Meta:
         ordering = ['user__last_name', 'user__first_name']
@@ -141,7 +202,13 @@ class Lesson(models.Model):
     """
     The central scheduling record linking a teacher, subject, room, class group,
     and timeslot. Unique constraints prevent double-booking of any resource.
+    ``stage`` is copied from the related entities in clean() so stage-scoped
+    queries need no joins.
     """
+    STAGE_FIELDS = ('teacher', 'subject', 'room', 'class_group', 'timeslot')
+
+    # No index of its own: every composite index below starts with it
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='lessons', editable=False, db_index=False)
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
@@ -155,23 +222,389 @@ class Lesson(models.Model):
             models.UniqueConstraint(fields=['room', 'timeslot'], name='unique_room_timeslot'),
             models.UniqueConstraint(fields=['class_group', 'timeslot'], name='unique_classgroup_timeslot'),
         ]
+        indexes = [
+            models.Index(fields=['stage', 'timeslot'], name='lesson_stage_timeslot_idx'),
+            models.Index(fields=['stage', 'teacher'], name='lesson_stage_teacher_idx'),
+            models.Index(fields=['stage', 'class_group'], name='lesson_stage_classgroup_idx'),
+            models.Index(fields=['stage', 'room'], name='lesson_stage_room_idx'),
+        ]
 
     def __str__(self):
         return f"{self.subject} | {self.class_group} | {self.timeslot} | {self.teacher}"
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        lesson = super().from_db(db, field_names, values)
+        # Related ids as loaded, so the signals can update both sides of a move
+        lesson._loaded = {field: lesson.__dict__.get(f'{field}_id') for field in cls.STAGE_FIELDS}
+        return lesson
+
+    def owners(self):
+        """
+        Return the (kind, id) pairs of the teachers and class groups whose
+        timetables this lesson is, or was when loaded, part of.
+        """
+        owners = {('teacher', self.teacher_id), ('class_group', self.class_group_id)}
+        loaded = getattr(self, '_loaded', {})
+        owners.update(
+            (kind, loaded[kind]) for kind in ('teacher', 'class_group') if loaded.get(kind) is not None
+        )
+        return owners
+
+    def related_stage_ids(self):
+        """
+        Return the stage_id of each related entity that is set. Entities
+        already loaded (e.g. by a form) are read directly; the rest come
+        from a single UNION query instead of one fetch each.
+        """
+        stage_ids = {}
+        queries = []
+        for field in self.STAGE_FIELDS:
+            pk = getattr(self, f'{field}_id')
+            if pk is None:
+                continue
+            if self._meta.get_field(field).is_cached(self):
+                stage_ids[field] = getattr(self, field).stage_id
+            else:
+                model = self._meta.get_field(field).related_model
+                queries.append(
+                    model.objects.filter(pk=pk)
+                    .annotate(field=models.Value(field, output_field=models.CharField()))
+                    .values_list('field', 'stage_id')
+                    .order_by()
+                )
+        if queries:
+            stage_ids.update(queries[0].union(*queries[1:], all=True))
+        return stage_ids
+
     def clean(self):
-        # Ensure all related entities belong to the same stage
-        stages = {
-            self.teacher.stage,
-            self.subject.stage,
-            self.room.stage,
-            self.class_group.stage,
-            self.timeslot.stage,
-        }
-    
+        # Ensure all related entities belong to the same stage. Unset ones
+        # are skipped: their own field errors are reported by the form.
+        stages = set(self.related_stage_ids().values())
+
         if len(stages) > 1:
             raise ValidationError("All entities must belong to the same stage!")
-        
+        if stages:
+            self.stage_id = stages.pop()
+            # Reuse the Stage a loaded related entity already carries
+            for field in self.STAGE_FIELDS:
+                entity = self._meta.get_field(field).get_cached_value(self, None)
+                if entity is not None and entity._meta.get_field('stage').is_cached(entity):
+                    self.stage = entity.stage
+                    break
+
+    def clean_fields(self, exclude=None):
+        # Related objects already loaded (e.g. by a form's choice fields)
+        # exist, so skip the query per foreign key that would check it
+        exclude = set(exclude or ())
+        for field in self.STAGE_FIELDS:
+            if self._meta.get_field(field).get_cached_value(self, None) is not None:
+                exclude.add(field)
+        super().clean_fields(exclude=exclude)
+
+    def save(self, *args, validate=True, **kwargs):
+        # stage is filled in by clean(), so it is not validated beforehand.
+        # validate=False is for callers that have just run full_clean().
+        if validate:
+            self.full_clean(exclude=['stage'])
+        super().save(*args, **kwargs)
+
+
+class LessonRequirement(models.Model):
+    """
+    How many periods per week a class group must have of a subject, and with
+    which teacher. Used as the input for the automatic timetable solver.
+    """
+    class_group = models.ForeignKey(ClassGroup, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
+    periods_per_week = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        ordering = ['class_group', 'subject']
+        constraints = [
+            models.UniqueConstraint(fields=['class_group', 'subject'], name='unique_requirement_per_subject')
+        ]
+
+    def __str__(self):
+        return f"{self.class_group} | {self.subject.name} x{self.periods_per_week} | {self.teacher}"
+
+    def clean(self):
+        # Same rule as Lesson: everything must belong to one stage
+        stage_ids = {
+            self.class_group.stage_id,
+            self.subject.stage_id,
+            self.teacher.stage_id,
+        }
+
+        if len(stage_ids) > 1:
+            raise ValidationError("All entities must belong to the same stage!")
+        if self.periods_per_week < 1:
+            raise ValidationError("A requirement needs at least one period per week.")
+
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class BellSchedule(models.Model):
+    """
+    A reusable pattern of periods for one school day (e.g. "Standard Day").
+    It is expanded into TimeSlots for each weekday of the stages using it.
+    """
+    name = models.CharField(max_length=200, unique=True)
+    stages = models.ManyToManyField(Stage, blank=True, related_name='bell_schedules')
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class BellPeriod(models.Model):
+    """
+    One period of a bell schedule. Overlaps between periods are checked for
+    the whole schedule at once (see bells.py).
+    """
+    bell_schedule = models.ForeignKey(BellSchedule, on_delete=models.CASCADE, related_name='periods')
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        ordering = ['bell_schedule', 'start_time']
+        constraints = [
+            models.UniqueConstraint(fields=['bell_schedule', 'start_time'], name='unique_period_start_per_schedule')
+        ]
+
+    def __str__(self):
+        return f"{self.start_time.strftime('%H:%M')}–{self.end_time.strftime('%H:%M')} ({self.bell_schedule})"
+
+    def clean(self):
+        if self.start_time is not None and self.end_time is not None and self.start_time >= self.end_time:
+            raise ValidationError("Start time must be before end time.")
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+
+
+class DraftSchedule(models.Model):
+    """
+    A working copy of a stage's timetable. Its lessons are edited without
+    touching the live Lesson table and published in one transaction (see
+    drafts.py). Published drafts are kept as earlier versions.
+    """
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='drafts')
+    name = models.CharField(max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['stage', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['stage', 'name'], name='unique_draft_name_per_stage')
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.stage.name})"
+
+
+class DraftLesson(models.Model):
+    """
+    A lesson in a draft timetable, with the same double-booking rules as
+    Lesson within its draft.
+    """
+    STAGE_FIELDS = Lesson.STAGE_FIELDS
+
+    draft = models.ForeignKey(DraftSchedule, on_delete=models.CASCADE, related_name='lessons')
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='+')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='+')
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='+')
+    class_group = models.ForeignKey(ClassGroup, on_delete=models.CASCADE, related_name='+')
+    timeslot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        ordering = ['draft', 'timeslot', 'class_group']
+        constraints = [
+            models.UniqueConstraint(fields=['draft', 'teacher', 'timeslot'], name='unique_draft_teacher_timeslot'),
+            models.UniqueConstraint(fields=['draft', 'room', 'timeslot'], name='unique_draft_room_timeslot'),
+            models.UniqueConstraint(
+                fields=['draft', 'class_group', 'timeslot'], name='unique_draft_classgroup_timeslot'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} | {self.class_group} | {self.timeslot} | {self.teacher} ({self.draft.name})"
+
+    def clean(self):
+        # Same rule as Lesson, against the draft's stage
+        stage_ids = {
+            getattr(self, field).stage_id for field in self.STAGE_FIELDS if getattr(self, f'{field}_id') is not None
+        }
+        if self.draft_id is not None:
+            stage_ids.add(self.draft.stage_id)
+
+        if len(stage_ids) > 1:
+            raise ValidationError("All entities must belong to the draft's stage!")
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+
+
+class Term(models.Model):
+    """
+    A stretch of school dates (e.g. a quarter) during which a stage's
+    weekly timetable runs. Lessons have dated occurrences only inside
+    terms (see occurrences.py).
+    """
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='terms')
+    name = models.CharField(max_length=200)
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    class Meta:
+        ordering = ['stage', 'start_date']
+        constraints = [
+            models.UniqueConstraint(fields=['stage', 'name'], name='unique_term_name_per_stage')
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.stage.name})"
+
+    def clean(self):
+        if self.start_date is None or self.end_date is None:
+            return
+        if self.start_date > self.end_date:
+            raise ValidationError("A term must start before it ends.")
+        overlapping = Term.objects.filter(
+            stage_id=self.stage_id, start_date__lte=self.end_date, end_date__gte=self.start_date,
+        ).exclude(pk=self.pk)
+        if overlapping.exists():
+            raise ValidationError("This term overlaps another term of the stage.")
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+
+
+class Holiday(models.Model):
+    """
+    Dates without lessons, for one stage or, with no stage, the whole
+    school.
+    """
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, null=True, blank=True, related_name='holidays')
+    name = models.CharField(max_length=200)
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    class Meta:
+        ordering = ['start_date']
+
+    def __str__(self):
+        return f"{self.name} ({self.stage.name if self.stage_id else 'whole school'})"
+
+    def clean(self):
+        if self.start_date is not None and self.end_date is not None and self.start_date > self.end_date:
+            raise ValidationError("A holiday must start before it ends.")
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+
+
+class LessonOverride(models.Model):
+    """
+    A change to one dated occurrence of a weekly lesson: cancelled, moved
+    to another room, or covered by another teacher. Occurrences themselves
+    are never stored; overrides are layered on when they are generated.
+    """
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='overrides')
+    date = models.DateField()
+    cancelled = models.BooleanField(default=False)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    teacher = models.ForeignKey(
+        Teacher, on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name="cover teacher",
+    )
+    note = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['date', 'lesson']
+        constraints = [
+            models.UniqueConstraint(fields=['lesson', 'date'], name='unique_override_per_lesson_date')
+        ]
+        indexes = [
+            # Cover and room swaps are looked up by date for the new teacher or room
+            models.Index(fields=['date', 'teacher'], name='override_date_teacher_idx'),
+            models.Index(fields=['date', 'room'], name='override_date_room_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.lesson} on {self.date}"
+
+    def clean(self):
+        if self.lesson_id is None or self.date is None:
+            return
+        if self.date.weekday() != self.lesson.timeslot.weekday:
+            raise ValidationError(f"{self.date} is not a {self.lesson.timeslot.day}.")
+        if not (self.cancelled or self.room_id or self.teacher_id or self.note):
+            raise ValidationError("An override must cancel the lesson, change its room or teacher, or add a note.")
+
+        for field in ('room', 'teacher'):
+            resource = getattr(self, field)
+            if resource is None:
+                continue
+            if resource.stage_id != self.lesson.stage_id:
+                raise ValidationError("All entities must belong to the same stage!")
+            # Booked by its own weekly lesson at that time, unless that one is
+            # cancelled or moved elsewhere on the date
+            moved_away = LessonOverride.objects.filter(lesson=models.OuterRef('pk'), date=self.date).filter(
+                models.Q(cancelled=True) | models.Q(**{f'{field}__isnull': False})
+            )
+            weekly = Lesson.objects.filter(timeslot_id=self.lesson.timeslot_id, **{field: resource}).exclude(
+                pk=self.lesson_id
+            ).exclude(models.Exists(moved_away))
+            # ... or by another override on the same date
+            covering = LessonOverride.objects.filter(
+                date=self.date, lesson__timeslot_id=self.lesson.timeslot_id, cancelled=False, **{field: resource}
+            ).exclude(pk=self.pk)
+            if weekly.exists() or covering.exists():
+                raise ValidationError({field: f"{resource} is already booked at that time on {self.date}."})
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+
+
+class UtilisationSummary(models.Model):
+    """
+    Lessons and minutes taught per teacher, room and subject on each
+    weekday. Kept up to date from the Lesson signals and rebuilt in bulk
+    (see analytics.py), so the analytics pages read one row per entity and
+    day instead of aggregating lessons.
+    """
+    KIND_CHOICES = [
+        ('teacher', 'Teacher'),
+        ('room', 'Room'),
+        ('subject', 'Subject'),
+    ]
+
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    entity_id = models.PositiveIntegerField()
+    weekday = models.PositiveSmallIntegerField()
+    periods = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['stage', 'kind', 'entity_id', 'weekday']
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'entity_id', 'weekday'], name='unique_utilisation_per_day')
+        ]
+        indexes = [
+            models.Index(fields=['stage', 'kind'], name='utilisation_stage_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.entity_id}, day {self.weekday}: {self.periods} periods"
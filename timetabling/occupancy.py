@@ -0,0 +1,162 @@
+"""
+In-process occupancy index per stage.
+
+Maps each timeslot to the teachers, rooms and class groups already booked
+in it, so a lesson can be checked for every double-booking at once with a
+few dictionary lookups. An index is built from one query the first time a
+stage is needed, kept up to date by the Lesson save/delete receivers in
+signals.py, and rebuilt whenever the stage's shared version (caching.py)
+shows that another process has changed the schedule.
+"""
+import threading
+from collections import Counter, defaultdict
+
+from timetabling.models import Lesson
+from .caching import bump_stage_version, stage_version
+
+
+KINDS = ('teacher', 'room', 'class_group')
+
+
+class StageOccupancy:
+    """
+    Busy resources for one stage: ``busy[kind][timeslot_id]`` maps a
+    resource id to the id of the lesson that books it. Per teacher it also
+    keeps the set of timeslots they teach (everything else in the stage is
+    a free period) and how often they teach each subject.
+    """
+
+    def __init__(self, stage_id, version):
+        self.stage_id = stage_id
+        self.version = version
+        self.busy = {kind: defaultdict(dict) for kind in KINDS}
+        # lesson_id -> (timeslot_id, teacher_id, room_id, class_group_id, subject_id)
+        self.lessons = {}
+        self.teacher_slots = defaultdict(set)
+        self.teacher_subjects = defaultdict(Counter)
+
+    @classmethod
+    def build(cls, stage_id, version):
+        occupancy = cls(stage_id, version)
+        rows = Lesson.objects.filter(stage_id=stage_id).values_list(
+            'id', 'timeslot_id', 'teacher_id', 'room_id', 'class_group_id', 'subject_id'
+        )
+        for row in rows:
+            occupancy.add(*row)
+        return occupancy
+
+    def add(self, lesson_id, timeslot_id, teacher_id, room_id, class_group_id, subject_id=None):
+        self.remove(lesson_id)
+        self.lessons[lesson_id] = (timeslot_id, teacher_id, room_id, class_group_id, subject_id)
+        for kind, resource_id in zip(KINDS, (teacher_id, room_id, class_group_id)):
+            self.busy[kind][timeslot_id][resource_id] = lesson_id
+        self.teacher_slots[teacher_id].add(timeslot_id)
+        self.teacher_subjects[teacher_id][subject_id] += 1
+
+    def remove(self, lesson_id):
+        booking = self.lessons.pop(lesson_id, None)
+        if booking is None:
+            return
+        timeslot_id, teacher_id, room_id, class_group_id, subject_id = booking
+        for kind, resource_id in zip(KINDS, (teacher_id, room_id, class_group_id)):
+            self.busy[kind][timeslot_id].pop(resource_id, None)
+        self.teacher_slots[teacher_id].discard(timeslot_id)
+        self.teacher_subjects[teacher_id][subject_id] -= 1
+
+    def is_free(self, teacher_id, timeslot_id):
+        return timeslot_id not in self.teacher_slots.get(teacher_id, ())
+
+    def teaches(self, teacher_id, subject_id):
+        return self.teacher_subjects.get(teacher_id, {}).get(subject_id, 0) > 0
+
+    def busy_ids(self, kind, timeslot_id, exclude=None):
+        """
+        Ids of the resources of one kind booked at a timeslot, ignoring the
+        lesson ``exclude`` (the one being edited).
+        """
+        return {
+            resource_id
+            for resource_id, lesson_id in self.busy[kind].get(timeslot_id, {}).items()
+            if lesson_id != exclude
+        }
+
+    def conflicts(self, timeslot_id, exclude=None, **resources):
+        """
+        Return ``{kind: lesson_id}`` for every resource passed as
+        ``teacher=``, ``room=`` or ``class_group=`` that is already booked
+        at the timeslot by another lesson.
+        """
+        found = {}
+        for kind, resource_id in resources.items():
+            lesson_id = self.busy[kind].get(timeslot_id, {}).get(resource_id)
+            if lesson_id is not None and lesson_id != exclude:
+                found[kind] = lesson_id
+        return found
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_occupancy(stage_id):
+    """
+    Return the up-to-date occupancy index for a stage, building it if this
+    process has none or the stage has changed elsewhere.
+    """
+    version = stage_version(stage_id)
+    occupancy = _indexes.get(stage_id)
+    if occupancy is None or occupancy.version != version:
+        with _lock:
+            occupancy = StageOccupancy.build(stage_id, version)
+            _indexes[stage_id] = occupancy
+    return occupancy
+
+
+def _advance(stage_id):
+    # Bump the shared version and carry the local index forward only if no
+    # other process changed the stage since it was built
+    version = bump_stage_version(stage_id)
+    occupancy = _indexes.get(stage_id)
+    if occupancy is not None:
+        if occupancy.version == version - 1:
+            occupancy.version = version
+        else:
+            _indexes.pop(stage_id, None)
+
+
+def lesson_saved(lesson, stage_id):
+    with _lock:
+        # Drop the old booking, including from another stage it moved out of
+        moved_from = [
+            occupancy.stage_id for occupancy in _indexes.values()
+            if lesson.pk in occupancy.lessons and occupancy.stage_id != stage_id
+        ]
+        for old_stage_id in moved_from:
+            _indexes[old_stage_id].remove(lesson.pk)
+            _advance(old_stage_id)
+        occupancy = _indexes.get(stage_id)
+        if occupancy is not None:
+            occupancy.add(
+                lesson.pk, lesson.timeslot_id, lesson.teacher_id, lesson.room_id, lesson.class_group_id,
+                lesson.subject_id,
+            )
+        _advance(stage_id)
+
+
+def lesson_deleted(lesson_id, stage_id):
+    # By id: delete() has cleared the instance's pk before the commit
+    with _lock:
+        occupancy = _indexes.get(stage_id)
+        if occupancy is not None:
+            occupancy.remove(lesson_id)
+        _advance(stage_id)
+
+
+def stages_changed(stage_ids):
+    """
+    Invalidate after bulk writes that bypass Lesson.save() and delete().
+    """
+    with _lock:
+        for stage_id in stage_ids:
+            _indexes.pop(stage_id, None)
+            bump_stage_version(stage_id)
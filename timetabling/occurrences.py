@@ -0,0 +1,115 @@
+"""
+Dated lesson occurrences.
+
+Lessons are a weekly template: a lesson happens on every school day with
+its timeslot's weekday, where a school day is inside one of its stage's
+Terms and outside any Holiday. occurrences() expands the template for a
+date range lazily, as it is iterated, and layers each date's
+LessonOverrides (cancellations, room swaps, cover) on top.
+
+Nothing is stored per date except the overrides, so the tables do not grow
+with the length of a term. Expanding any range costs four queries, and a
+range shorter than a week only loads the lessons of its weekdays.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Q
+from timetabling.models import Holiday, Lesson, LessonOverride, Term, TimeSlot
+from .timetables import GRID_KINDS, cached_entity_stage_id
+
+
+# kind -> LessonOverride field that moves an occurrence to that resource
+OVERRIDE_FIELDS = {
+    'teacher': 'teacher_id',
+    'room': 'room_id',
+}
+
+LESSON_RELATED = ('timeslot', 'subject', 'class_group', 'room', 'teacher__user')
+
+
+def school_days(stage_id, start, end):
+    """
+    Yield the dates from ``start`` to ``end`` (inclusive) on which the
+    stage has lessons.
+    """
+    terms = Term.objects.filter(stage_id=stage_id, start_date__lte=end, end_date__gte=start).values_list(
+        'start_date', 'end_date'
+    )
+    holidays = list(Holiday.objects.filter(
+        Q(stage_id=stage_id) | Q(stage__isnull=True), start_date__lte=end, end_date__gte=start,
+    ).values_list('start_date', 'end_date'))
+
+    # Terms of a stage never overlap, so in start order they are in date order
+    for term_start, term_end in terms.order_by('start_date'):
+        day, last = max(start, term_start), min(end, term_end)
+        while day <= last:
+            if day.weekday() < len(TimeSlot.DAY_CHOICES) and not any(
+                holiday_start <= day <= holiday_end for holiday_start, holiday_end in holidays
+            ):
+                yield day
+            day += timedelta(days=1)
+
+
+def occurrence(day, lesson, override=None):
+    """
+    Return the dict for ``lesson`` on ``day`` with ``override`` applied:
+    its effective ``teacher`` and ``room``, ``cancelled`` and ``note``.
+    """
+    return {
+        'date': day,
+        'lesson': lesson,
+        'teacher': override.teacher if override and override.teacher_id else lesson.teacher,
+        'room': override.room if override and override.room_id else lesson.room,
+        'cancelled': bool(override and override.cancelled),
+        'covered': bool(override and override.teacher_id),
+        'note': override.note if override else '',
+    }
+
+
+def occurrences(kind, pk, start, end):
+    """
+    Yield the occurrences (see occurrence()) of a stage's, teacher's,
+    class group's or room's lessons from ``start`` to ``end`` in date and
+    time order. Cancelled occurrences are included and marked. A teacher
+    or room also gets the occurrences moved to them by an override, and
+    loses those moved away.
+    """
+    stage_id = cached_entity_stage_id(kind, pk)
+    if stage_id is None:
+        return
+    days = list(school_days(stage_id, start, end))
+    if not days:
+        return
+
+    lookup = GRID_KINDS[kind][1]
+    lessons = Lesson.objects.filter(**{lookup: pk}).select_related(*LESSON_RELATED)
+    if len(days) < 7:
+        lessons = lessons.filter(timeslot__weekday__in={day.weekday() for day in days})
+    by_weekday = defaultdict(list)
+    for lesson in lessons:
+        by_weekday[lesson.timeslot.weekday].append(lesson)
+
+    moved_to = OVERRIDE_FIELDS.get(kind)
+    affecting = Q(**{f'lesson__{lookup}': pk})
+    if moved_to:
+        affecting |= Q(**{moved_to: pk})
+    overrides = LessonOverride.objects.filter(affecting, date__gte=days[0], date__lte=days[-1]).select_related(
+        'room', 'teacher__user', *(f'lesson__{field}' for field in LESSON_RELATED)
+    )
+    by_date = defaultdict(dict)
+    for override in overrides:
+        by_date[override.date][override.lesson_id] = override
+
+    for day in days:
+        day_overrides = by_date.get(day, {})
+        entries = []
+        for lesson in by_weekday[day.weekday()]:
+            override = day_overrides.pop(lesson.pk, None)
+            if moved_to and getattr(override, moved_to, None) not in (None, pk):
+                continue
+            entries.append(occurrence(day, lesson, override))
+        # What is left was moved here from someone else's lesson
+        entries.extend(occurrence(day, override.lesson, override) for override in day_overrides.values())
+        entries.sort(key=lambda entry: (entry['lesson'].timeslot.start_time, entry['lesson'].class_group.name))
+        yield from entries
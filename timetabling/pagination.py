@@ -0,0 +1,108 @@
+"""
+Keyset pagination and server-side filters for the lesson tables.
+
+Pages are ordered by (weekday, start time, id) and a page is fetched with a
+"greater than the last row" condition on those columns instead of an
+OFFSET, so each render reads a bounded number of rows however deep the
+secretary pages.
+"""
+import base64
+from datetime import time
+
+from django.db.models import Q
+from timetabling.models import TimeSlot
+
+
+PAGE_SIZE = 50
+
+FILTER_FIELDS = {
+    'stage': 'stage_id',
+    'teacher': 'teacher_id',
+    'class_group': 'class_group_id',
+}
+
+
+def encode_cursor(lesson):
+    raw = f"{lesson.timeslot.weekday}|{lesson.timeslot.start_time.isoformat()}|{lesson.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token):
+    # Returns (weekday, start_time, id), or None for a missing or tampered cursor
+    try:
+        weekday, start_time, pk = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return int(weekday), time.fromisoformat(start_time), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def filter_lessons(lessons, params):
+    """
+    Apply the stage, teacher, class group and day filters from a GET
+    QueryDict. Returns the filtered queryset and the cleaned filter values.
+    """
+    filters = {}
+
+    for name, lookup in FILTER_FIELDS.items():
+        value = params.get(name, '')
+        if value.isdigit():
+            lessons = lessons.filter(**{lookup: int(value)})
+            filters[name] = int(value)
+
+    day = params.get('day', '')
+    if day in TimeSlot.WEEKDAY_NUMBERS:
+        lessons = lessons.filter(timeslot__weekday=TimeSlot.WEEKDAY_NUMBERS[day])
+        filters['day'] = day
+
+    return lessons, filters
+
+
+def page_query(lessons, params, page_size=PAGE_SIZE):
+    # The sliced queryset for the page after the ``after`` cursor, with one
+    # extra row that tells us whether there is a next page
+    lessons = lessons.order_by('timeslot__weekday', 'timeslot__start_time', 'id')
+
+    cursor = decode_cursor(params.get('after', ''))
+    if cursor:
+        weekday, start_time, pk = cursor
+        lessons = lessons.filter(
+            Q(timeslot__weekday__gt=weekday)
+            | Q(timeslot__weekday=weekday, timeslot__start_time__gt=start_time)
+            | Q(timeslot__weekday=weekday, timeslot__start_time=start_time, id__gt=pk)
+        )
+    return lessons[:page_size + 1]
+
+
+def page_context(rows, params, page_size=PAGE_SIZE):
+    page, has_next = rows[:page_size], len(rows) > page_size
+
+    next_query = None
+    if has_next:
+        query = params.copy()
+        query['after'] = encode_cursor(page[-1])
+        next_query = query.urlencode()
+
+    first_query = params.copy()
+    first_query.pop('after', None)
+
+    return {
+        'lessons': page,
+        'next_query': next_query,
+        'first_query': first_query.urlencode() if 'after' in params else None,
+    }
+
+
+def keyset_page(lessons, params, page_size=PAGE_SIZE):
+    """
+    Return the page of ``lessons`` after the ``after`` cursor in ``params``
+    as a context dict with the rows and the query string for the next page.
+    """
+    return page_context(list(page_query(lessons, params, page_size)), params, page_size)
+
+
+async def akeyset_page(lessons, params, page_size=PAGE_SIZE):
+    """
+    Async version of keyset_page().
+    """
+    rows = [lesson async for lesson in page_query(lessons, params, page_size)]
+    return page_context(rows, params, page_size)
@@ -0,0 +1,257 @@
+"""
+Schedule repair after a teacher, room or timeslot is removed or becomes
+unavailable.
+
+Deleting a Room or TimeSlot cascades to its lessons. plan_repair() first
+finds the lessons that would be lost (or that clash with an unavailability
+window) and works out where each can go instead: the same timeslot in
+another room, another timeslot, or, for a removed teacher, a free
+colleague who already teaches the subject. If none of those is free it
+moves one other lesson out of the way, so as few unaffected lessons as
+possible are touched.
+
+The search runs on a copy of the stage's occupancy index (occupancy.py)
+and the cached timeslot and resource lists (availability.py), so planning
+needs no queries once those are warm. apply_repair() writes the resulting
+moves, in order, in one transaction.
+"""
+from django.db import IntegrityError, transaction
+from timetabling.models import Lesson, Room, Teacher, TimeSlot
+from .availability import get_catalogue
+from .occupancy import KINDS, get_occupancy
+from .signals import lessons_bulk_changed
+
+
+REPAIR_SALT = 'timetabling.repair'
+
+REPAIR_KINDS = {
+    'teacher': Teacher,
+    'room': Room,
+    'timeslot': TimeSlot,
+}
+
+
+class RepairConflict(Exception):
+    """
+    A lesson in the plan is no longer where the plan expects it.
+    """
+
+
+class _StageModel:
+    """
+    Mutable bookings for one stage. Lessons are stored as
+    [timeslot, teacher, room, class_group, subject].
+    """
+
+    def __init__(self, occupancy, catalogue):
+        self.slots = [slot[0] for slot in catalogue['slots']]
+        self.slot_day = {slot[0]: slot[2] for slot in catalogue['slots']}
+        self.rooms = list(catalogue['names']['room'])
+        self.teachers = list(catalogue['names']['teacher'])
+        self.teacher_subjects = occupancy.teacher_subjects
+        self.lessons = {pk: list(booking) for pk, booking in occupancy.lessons.items()}
+        # (kind, resource, timeslot) -> lesson id
+        self.at = {}
+        for pk, booking in self.lessons.items():
+            self.book(pk, booking)
+        # Timeslots nobody may use, resources nobody may use, and
+        # (kind, resource) -> timeslots that resource may not use
+        self.closed_slots = set()
+        self.removed = set()
+        self.unavailable = {}
+
+    def book(self, pk, booking):
+        timeslot, teacher, room, class_group, _ = booking
+        for kind, resource in zip(KINDS, (teacher, room, class_group)):
+            self.at[(kind, resource, timeslot)] = pk
+
+    def unbook(self, pk):
+        timeslot, teacher, room, class_group, _ = self.lessons[pk]
+        for kind, resource in zip(KINDS, (teacher, room, class_group)):
+            del self.at[(kind, resource, timeslot)]
+
+    def move(self, pk, timeslot, teacher, room):
+        self.unbook(pk)
+        booking = self.lessons[pk]
+        booking[:3] = [timeslot, teacher, room]
+        self.book(pk, booking)
+
+    def usable(self, kind, resource, timeslot):
+        return (
+            timeslot not in self.closed_slots
+            and (kind, resource) not in self.removed
+            and timeslot not in self.unavailable.get((kind, resource), ())
+        )
+
+    def is_affected(self, pk):
+        timeslot, teacher, room, class_group, _ = self.lessons[pk]
+        return any(
+            not self.usable(kind, resource, timeslot)
+            for kind, resource in zip(KINDS, (teacher, room, class_group))
+        )
+
+    def free(self, kind, resource, timeslot, pk, ignore=None):
+        if not self.usable(kind, resource, timeslot):
+            return False
+        occupant = self.at.get((kind, resource, timeslot))
+        return occupant is None or occupant == pk or occupant == ignore
+
+    def placements(self, pk, ignore=None, timeslots=None):
+        """
+        Yield every (cost, timeslot, teacher, room) the lesson could move to
+        without displacing anything except ``ignore``. Lower costs change
+        less: keep the timeslot, then the day, then the room and teacher.
+        """
+        timeslot, teacher, room, class_group, subject = self.lessons[pk]
+        if ('teacher', teacher) in self.removed:
+            # Hand the lesson to a colleague who already teaches the subject
+            teachers = [other for other in self.teachers if self.teacher_subjects[other][subject]]
+        else:
+            teachers = [teacher]
+        rooms = [room] + [other for other in self.rooms if other != room]
+
+        for slot in (timeslots or self.slots):
+            if not self.free('class_group', class_group, slot, pk, ignore):
+                continue
+            new_teacher = next((t for t in teachers if self.free('teacher', t, slot, pk, ignore)), None)
+            new_room = next((r for r in rooms if self.free('room', r, slot, pk, ignore)), None)
+            if new_teacher is None or new_room is None:
+                continue
+            cost = (slot != timeslot, self.slot_day[slot] != self.slot_day.get(timeslot), new_room != room,
+                    new_teacher != teacher)
+            yield cost, slot, new_teacher, new_room
+
+    def best(self, pk, ignore=None, timeslots=None):
+        return min(self.placements(pk, ignore, timeslots), default=None)
+
+    def blockers(self, pk, slot):
+        # Lessons that keep ``pk`` out of ``slot`` through its class group or
+        # teacher; a room is only a blocker if every room is taken
+        _, teacher, _, class_group, _ = self.lessons[pk]
+        found = {self.at.get(('class_group', class_group, slot))}
+        if ('teacher', teacher) not in self.removed:
+            found.add(self.at.get(('teacher', teacher, slot)))
+        return found - {None, pk}
+
+    def eject(self, pk, fixed):
+        """
+        Find the cheapest way to place ``pk`` by first moving a single
+        lesson not in ``fixed`` out of its way. Returns
+        ``(other, other_placement, placement)`` or None.
+        """
+        best = None
+        for slot in self.slots:
+            blockers = self.blockers(pk, slot)
+            if len(blockers) != 1:
+                continue
+            other = blockers.pop()
+            if other in fixed:
+                continue
+            placement = self.best(pk, ignore=other, timeslots=[slot])
+            if placement is None:
+                continue
+            other_placement = self.best(other, timeslots=[s for s in self.slots if s != slot])
+            if other_placement is None:
+                continue
+            option = (placement[0], other_placement[0], other, other_placement, placement)
+            if best is None or option < best:
+                best = option
+        return best and best[2:]
+
+
+def plan_repair(stage_id, kind, resource_id, timeslot_ids=None):
+    """
+    Plan how to keep a stage's lessons when the ``kind`` ('teacher', 'room'
+    or 'timeslot') ``resource_id`` is removed or, with ``timeslot_ids``,
+    is unavailable at those timeslots.
+
+    Returns a JSON-serialisable dict whose ``moves`` are
+    ``[lesson_id, before, after, displaced]`` in the order they must be
+    applied, with ``before`` and ``after`` as [timeslot, teacher, room];
+    ``displaced`` marks lessons moved only to make room. ``unplaced`` lists
+    the affected lessons with nowhere to go.
+    """
+    model = _StageModel(get_occupancy(stage_id), get_catalogue(stage_id))
+    if kind == 'timeslot':
+        model.closed_slots.add(resource_id)
+    elif timeslot_ids:
+        model.unavailable[(kind, resource_id)] = set(timeslot_ids)
+    else:
+        model.removed.add((kind, resource_id))
+
+    affected = [pk for pk in model.lessons if model.is_affected(pk)]
+    # Fewest options first, while they still have some
+    affected.sort(key=lambda pk: (sum(1 for _ in model.placements(pk)), pk))
+
+    fixed = set(affected)
+    moves, unplaced = [], []
+    for pk in affected:
+        placement = model.best(pk)
+        if placement is None:
+            ejection = model.eject(pk, fixed)
+            if ejection is None:
+                unplaced.append(pk)
+                continue
+            other, other_placement, placement = ejection
+            moves.append([other, model.lessons[other][:3], list(other_placement[1:]), True])
+            model.move(other, *other_placement[1:])
+            # A lesson is moved at most once, so the moves apply in order
+            fixed.add(other)
+        moves.append([pk, model.lessons[pk][:3], list(placement[1:]), False])
+        model.move(pk, *placement[1:])
+
+    return {
+        'stage': stage_id,
+        'kind': kind,
+        'resource': resource_id,
+        'timeslots': sorted(timeslot_ids) if timeslot_ids and kind != 'timeslot' else None,
+        'moves': moves,
+        'unplaced': unplaced,
+    }
+
+
+def plan_rows(plan, catalogue):
+    """
+    Describe a plan for display: one dict per move and per unplaced lesson,
+    with its Lesson (class group and subject loaded) and readable
+    before/after bookings.
+    """
+    slots = {pk: f"{day} {start_time:%H:%M}" for pk, day, _, start_time, _ in catalogue['slots']}
+    names = catalogue['names']
+
+    def describe(booking):
+        timeslot, teacher, room = booking
+        return {'timeslot': slots.get(timeslot), 'teacher': names['teacher'].get(teacher), 'room': names['room'].get(room)}
+
+    lesson_ids = [move[0] for move in plan['moves']] + plan['unplaced']
+    lessons = Lesson.objects.select_related('class_group', 'subject').in_bulk(lesson_ids)
+    moves = [
+        {'lesson': lessons.get(pk), 'before': describe(before), 'after': describe(after), 'displaced': displaced}
+        for pk, before, after, displaced in plan['moves']
+    ]
+    unplaced = [lessons.get(pk) for pk in plan['unplaced']]
+    return moves, unplaced
+
+
+def apply_repair(plan, delete=False):
+    """
+    Apply a plan's moves in one transaction, and with ``delete`` remove the
+    resource afterwards, taking any unplaced lessons with it. Raises
+    RepairConflict, rolling everything back, if a lesson has moved, or
+    another has taken a place a move needs, since the plan was made.
+    """
+    with transaction.atomic():
+        for pk, before, after, _ in plan['moves']:
+            timeslot, teacher, room = before
+            try:
+                updated = Lesson.objects.filter(pk=pk, timeslot_id=timeslot, teacher_id=teacher, room_id=room).update(
+                    timeslot_id=after[0], teacher_id=after[1], room_id=after[2],
+                )
+            except IntegrityError as e:
+                raise RepairConflict(f"Lesson {pk} can no longer move: its new place has been taken.") from e
+            if not updated:
+                raise RepairConflict(f"Lesson {pk} has changed since the repair was planned.")
+        if delete:
+            REPAIR_KINDS[plan['kind']].objects.filter(pk=plan['resource']).delete()
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=[plan['stage']])
+    return len(plan['moves'])
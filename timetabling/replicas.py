@@ -0,0 +1,186 @@
+"""
+Read-replica routing.
+
+With REPLICA_DATABASE set (see settings and the README), views decorated
+with @replica_reads, and the streamed bodies of their responses, read
+from the replica. Everything else reads and writes the primary.
+
+A replica lags behind the primary, so a client that has just written
+would not see its change there. Any write during a request pins that
+request's remaining reads to the primary, and ReplicaPinMiddleware sets a
+short-lived cookie that pins the client's next requests too
+(REPLICA_PIN_SECONDS). Without a replica every read goes to the primary
+and no cookie is set.
+
+Only views that do not fill shared caches are routed: a page cached from
+a lagging replica would outlive the lag.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'replica_pin'
+
+# True while a @replica_reads view (or its streamed response) runs
+_replica_reads = ContextVar('replica_reads', default=False)
+
+# The current request's RequestState, set by ReplicaPinMiddleware
+_request_state = ContextVar('replica_request_state', default=None)
+
+_DONE = object()
+
+
+class RequestState:
+    """
+    Whether the request arrived pinned to the primary and whether it has
+    written. Mutated rather than replaced, so sync_to_async threads, which
+    run in a copy of the request's context, share it.
+    """
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', None)
+
+
+def reading_from_replica():
+    if not _replica_reads.get() or replica_alias() is None:
+        return False
+    state = _request_state.get()
+    return state is None or not (state.pinned or state.wrote)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Explicit even without a replica, so instances loaded from it
+        # never pull their relations from it outside a routed view
+        return replica_alias() if reading_from_replica() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != replica_alias()
+
+
+def _replica_chunks(chunks):
+    # Each chunk is produced with replica reads on, whoever iterates
+    chunks = iter(chunks)
+    while True:
+        token = _replica_reads.set(True)
+        try:
+            chunk = next(chunks, _DONE)
+        finally:
+            _replica_reads.reset(token)
+        if chunk is _DONE:
+            return
+        yield chunk
+
+
+async def _areplica_chunks(chunks):
+    chunks = aiter(chunks)
+    while True:
+        token = _replica_reads.set(True)
+        try:
+            chunk = await anext(chunks, _DONE)
+        finally:
+            _replica_reads.reset(token)
+        if chunk is _DONE:
+            return
+        yield chunk
+
+
+def _stream_from_replica(response, replica):
+    # Streaming responses run their queries after the view, and
+    # ReplicaPinMiddleware, have returned, so whether to use the replica
+    # is decided when the view ends
+    if replica and response.streaming:
+        if response.is_async:
+            response.streaming_content = _areplica_chunks(response.streaming_content)
+        else:
+            response.streaming_content = _replica_chunks(response.streaming_content)
+    return response
+
+
+def replica_reads(view_func):
+    """
+    Read from the replica, if there is one, while the view runs and while
+    its response streams. Works on sync and async views.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _replica_reads.set(True)
+            try:
+                response = await view_func(request, *args, **kwargs)
+                replica = reading_from_replica()
+            finally:
+                _replica_reads.reset(token)
+            return _stream_from_replica(response, replica)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            response = view_func(request, *args, **kwargs)
+            replica = reading_from_replica()
+        finally:
+            _replica_reads.reset(token)
+        return _stream_from_replica(response, replica)
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    """
+    Tracks writes per request and pins a client that wrote to the primary
+    for REPLICA_PIN_SECONDS. Goes before SessionMiddleware so session
+    writes count.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        if state.wrote and replica_alias() is not None:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
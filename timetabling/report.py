@@ -0,0 +1,168 @@
+"""
+Timetable quality report: gaps, consecutive-period runs, daily load and
+subject spread for every teacher and class group of a stage.
+
+The stage's lessons come from its occupancy index (occupancy.py) and are
+laid out once as boolean (entity x day x period) arrays. Every metric is
+then a numpy reduction over a whole array, so a stage costs the same few
+array operations whether it has ten teachers or a thousand, and no query
+per teacher or class group.
+"""
+import numpy as np
+from django.conf import settings
+from timetabling.models import Subject, TimeSlot
+from .availability import get_catalogue
+from .occupancy import get_occupancy
+
+
+# Override any of these with a TIMETABLE_REPORT_LIMITS dict in settings
+DEFAULT_LIMITS = {
+    # Free periods between a teacher's or class group's first and last lesson of a day
+    'max_gaps': 2,
+    # Lessons in a row without a free period
+    'max_consecutive': 4,
+    # Lessons in one day
+    'max_daily': 6,
+    # Lessons of one subject for a class group in one day
+    'max_subject_daily': 2,
+}
+
+REPORT_KINDS = ('teacher', 'class_group')
+
+DAYS = [day for day, _ in TimeSlot.DAY_CHOICES]
+
+
+def report_limits(**overrides):
+    limits = {**DEFAULT_LIMITS, **getattr(settings, 'TIMETABLE_REPORT_LIMITS', {})}
+    limits.update((name, value) for name, value in overrides.items() if value is not None)
+    return limits
+
+
+def _index(ids, values):
+    # Position of each value in the sorted array ``ids``
+    return np.searchsorted(ids, values)
+
+
+def day_metrics(grid, slot_exists):
+    """
+    Return per-(entity, day) arrays ``load``, ``gaps`` and ``longest_run``
+    for a boolean (entity x day x period) grid. Gaps only count periods
+    the stage has a timeslot for.
+    """
+    periods = grid.shape[2]
+    load = grid.sum(axis=2)
+    if periods == 0:
+        # No timeslots yet: argmax has nothing to look at
+        empty = np.zeros(load.shape, dtype=np.int32)
+        return {'load': load, 'gaps': empty, 'longest_run': empty.copy()}
+    busy = load > 0
+    first = grid.argmax(axis=2)
+    last = periods - 1 - grid[:, :, ::-1].argmax(axis=2)
+
+    # Timeslots from the first to the last lesson, counted with a running total per day
+    existing = np.cumsum(slot_exists, axis=1)
+    days = np.arange(grid.shape[1])
+    span = existing[days, last] - existing[days, first] + 1
+    gaps = np.where(busy, span - load, 0)
+
+    run = np.zeros(load.shape, dtype=np.int32)
+    longest_run = np.zeros(load.shape, dtype=np.int32)
+    for period in range(periods):
+        run = (run + 1) * grid[:, :, period]
+        np.maximum(longest_run, run, out=longest_run)
+
+    return {'load': load, 'gaps': gaps, 'longest_run': longest_run}
+
+
+def build_report(stage, limits=None):
+    """
+    Return the quality report for a stage: a summary per kind of entity and
+    the list of violations of ``limits`` (see DEFAULT_LIMITS), worst first.
+    """
+    limits = limits or report_limits()
+    catalogue = get_catalogue(stage.pk)
+    occupancy = get_occupancy(stage.pk)
+
+    # Timeslot -> (day, period), periods being the stage's distinct times
+    slots = catalogue['slots']
+    periods = sorted({(start_time, end_time) for _, _, _, start_time, end_time in slots})
+    period_index = {period: i for i, period in enumerate(periods)}
+    slot_ids = np.array([slot[0] for slot in slots], dtype=np.int64)
+    order = np.argsort(slot_ids)
+    slot_ids = slot_ids[order]
+    slot_days = np.array([slot[2] for slot in slots], dtype=np.int64)[order]
+    slot_periods = np.array([period_index[(slot[3], slot[4])] for slot in slots], dtype=np.int64)[order]
+    slot_exists = np.zeros((len(DAYS), len(periods)), dtype=bool)
+    slot_exists[slot_days, slot_periods] = True
+
+    # Columns: timeslot, teacher, room, class group, subject
+    lessons = np.array(list(occupancy.lessons.values()), dtype=np.int64).reshape(-1, 5)
+    positions = _index(slot_ids, lessons[:, 0])
+    lesson_days, lesson_periods = slot_days[positions], slot_periods[positions]
+
+    report = {'stage': stage, 'limits': limits, 'lessons': len(lessons), 'summary': {}, 'violations': []}
+    columns = {'teacher': 1, 'class_group': 3}
+    for kind in REPORT_KINDS:
+        names = catalogue['names'][kind]
+        ids = np.array(sorted(names), dtype=np.int64)
+        rows = _index(ids, lessons[:, columns[kind]])
+        grid = np.zeros((len(ids), len(DAYS), len(periods)), dtype=bool)
+        grid[rows, lesson_days, lesson_periods] = True
+
+        metrics = day_metrics(grid, slot_exists)
+        teaching_days = metrics['load'][metrics['load'] > 0]
+        report['summary'][kind] = {
+            'entities': len(ids),
+            'gaps': int(metrics['gaps'].sum()),
+            'average_daily': round(float(teaching_days.mean()), 1) if teaching_days.size else 0,
+            'max_daily': int(metrics['load'].max(initial=0)),
+            'longest_run': int(metrics['longest_run'].max(initial=0)),
+        }
+        for metric, limit in (('gaps', 'max_gaps'), ('longest_run', 'max_consecutive'), ('load', 'max_daily')):
+            over = np.argwhere(metrics[metric] > limits[limit])
+            report['violations'].extend(
+                {
+                    'kind': kind,
+                    'name': names[int(ids[row])],
+                    'day': DAYS[day],
+                    'metric': metric,
+                    'value': int(metrics[metric][row, day]),
+                    'limit': limits[limit],
+                }
+                for row, day in over
+            )
+
+    # Subject spread: lessons per (class group, subject, day)
+    group_ids = np.array(sorted(catalogue['names']['class_group']), dtype=np.int64)
+    subject_ids, subject_rows = np.unique(lessons[:, 4], return_inverse=True)
+    spread = np.zeros((len(group_ids), len(subject_ids), len(DAYS)), dtype=np.int32)
+    np.add.at(spread, (_index(group_ids, lessons[:, 3]), subject_rows, lesson_days), 1)
+
+    weekly = spread.sum(axis=2)
+    days_used = (spread > 0).sum(axis=2)
+    # Spread over as many days as possible: one a day until every day has one
+    clustered = days_used < np.minimum(weekly, len(DAYS))
+    report['summary']['subject_spread'] = {
+        'subjects': int((weekly > 0).sum()),
+        'clustered': int(clustered.sum()),
+        'max_subject_daily': int(spread.max(initial=0)),
+    }
+
+    over = np.argwhere(spread > limits['max_subject_daily'])
+    if len(over):
+        subject_names = dict(Subject.objects.filter(pk__in=subject_ids[over[:, 1]].tolist()).values_list('id', 'name'))
+        group_names = catalogue['names']['class_group']
+        report['violations'].extend(
+            {
+                'kind': 'class_group',
+                'name': f"{group_names[int(group_ids[row])]} ({subject_names[int(subject_ids[subject])]})",
+                'day': DAYS[day],
+                'metric': 'subject_daily',
+                'value': int(spread[row, subject, day]),
+                'limit': limits['max_subject_daily'],
+            }
+            for row, subject, day in over
+        )
+
+    report['violations'].sort(key=lambda violation: (violation['limit'] - violation['value'], violation['name']))
+    return report
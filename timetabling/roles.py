@@ -0,0 +1,52 @@
+"""
+Request-scoped role resolution.
+
+A user's group names and Teacher row (with its stage) are loaded once per
+request, so views can check ``request.roles`` and use ``request.teacher``
+without querying. With a shared cache (SHARED_CACHE, see settings) they
+are also kept there between requests, and the receivers in signals.py drop
+them whenever group membership or the Teacher row changes. A process-local
+cache would only be cleared in the process that made the change, leaving
+revoked roles in effect elsewhere, so roles are never cached there.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from timetabling.models import Teacher
+
+
+SECRETARIES = 'Secretaries'
+TEACHERS = 'Teachers'
+
+ROLE_CACHE_TIMEOUT = 60 * 60
+
+
+def role_cache_key(user_id):
+    return f"timetabling:roles:{user_id}"
+
+
+def resolve_roles(user):
+    """
+    Return ``(roles, teacher)`` for a user: a frozenset of group names and
+    their Teacher (stage preloaded) or None.
+    """
+    if not user.is_authenticated:
+        return frozenset(), None
+
+    key = role_cache_key(user.pk)
+    cached = cache.get(key) if settings.SHARED_CACHE else None
+    if cached is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        teacher = Teacher.objects.select_related('stage').filter(user_id=user.pk).first()
+        cached = (roles, teacher)
+        if settings.SHARED_CACHE:
+            cache.set(key, cached, ROLE_CACHE_TIMEOUT)
+
+    roles, teacher = cached
+    if teacher is not None:
+        # Reuse the request's user rather than fetching it again
+        teacher.user = user
+    return roles, teacher
+
+
+def invalidate_roles(*user_ids):
+    cache.delete_many([role_cache_key(user_id) for user_id in user_ids])
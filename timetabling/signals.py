@@ -0,0 +1,186 @@
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from timetabling.models import Lesson, Stage, Teacher, TimeSlot, Room, ClassGroup, Subject
+from . import analytics, occupancy
+from .calendars import FEED_KINDS, feed_entity_cache_key
+from .caching import bump_entity_version, bump_stage_data_version, bump_stage_version
+from .roles import invalidate_roles
+from .timetables import GRID_KINDS, entity_stage_cache_key
+
+
+# Sent with ``stage_ids`` after bulk writes to Lesson that bypass
+# save() and delete(), e.g. bulk_create or queryset updates
+lessons_bulk_changed = Signal()
+
+
+# -------------------------
+# Role cache invalidation
+# -------------------------
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        # user.groups.add(...) / remove(...) / clear()
+        invalidate_roles(instance.pk)
+    elif pk_set:
+        # group.user_set.add(...) / remove(...)
+        invalidate_roles(*pk_set)
+    elif action == 'pre_clear':
+        invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+def teacher_changed(sender, instance, **kwargs):
+    invalidate_roles(instance.user_id)
+
+
+@receiver(post_save, sender=Stage)
+def stage_renamed(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_roles(*instance.teacher_set.values_list('user_id', flat=True))
+
+
+# -------------------------
+# Schedule changes
+# -------------------------
+# Indexes are only touched once the change is committed, so a rolled-back
+# save never leaves them ahead of the database
+def bump_owner_versions(owners):
+    for kind, pk in owners:
+        bump_entity_version(kind, pk)
+
+
+def bump_stage_versions(stage_id):
+    bump_stage_version(stage_id)
+    bump_stage_data_version(stage_id)
+
+
+@receiver(post_save, sender=Lesson)
+def lesson_saved(sender, instance, created, **kwargs):
+    stage_id = instance.stage_id
+    owners = instance.owners()
+    # In the lesson's own transaction, so the counts commit or roll back with it
+    analytics.lesson_saved(instance, created)
+    # A later save of the same instance moves it from where it is now
+    instance._loaded = {field: getattr(instance, f'{field}_id') for field in Lesson.STAGE_FIELDS}
+    transaction.on_commit(lambda: occupancy.lesson_saved(instance, stage_id))
+    transaction.on_commit(lambda: bump_owner_versions(owners))
+
+
+@receiver(post_delete, sender=Lesson)
+def lesson_deleted(sender, instance, origin=None, **kwargs):
+    if origin is not None and not isinstance(origin, Lesson):
+        # One of many: a queryset delete or a cascade from another model
+        analytics.lesson_deleted_in_bulk(instance, origin)
+        deleted_in_bulk(instance, origin)
+        return
+    lesson_id, stage_id = instance.pk, instance.stage_id
+    owners = instance.owners()
+    analytics.lesson_deleted(instance)
+    transaction.on_commit(lambda: occupancy.lesson_deleted(lesson_id, stage_id))
+    transaction.on_commit(lambda: bump_owner_versions(owners))
+
+
+def deleted_in_bulk(lesson, origin):
+    # Collected on ``origin`` (what delete() was called on) and invalidated
+    # once on commit, rather than with two callbacks per lesson
+    deleted = origin.__dict__.get('_deleted_lessons')
+    if deleted is None:
+        deleted = origin._deleted_lessons = {'stages': set(), 'owners': set()}
+
+        def invalidate():
+            occupancy.stages_changed(deleted['stages'])
+            bump_owner_versions(deleted['owners'])
+
+        transaction.on_commit(invalidate)
+    deleted['stages'].add(lesson.stage_id)
+    deleted['owners'].update(lesson.owners())
+
+
+@receiver(lessons_bulk_changed)
+def lessons_bulk_changed_receiver(sender, stage_ids, **kwargs):
+    analytics.rebuild_utilisation(stage_ids)
+    transaction.on_commit(lambda: occupancy.stages_changed(stage_ids))
+    # Bulk writes do not say whose lessons changed
+    for stage_id in stage_ids:
+        transaction.on_commit(lambda stage_id=stage_id: bump_stage_data_version(stage_id))
+
+
+# Anything shown in a timetable grid invalidates its stage's cached pages.
+# Bumped on commit so no reader can cache pre-commit data under the new
+# version.
+@receiver(post_save, sender=TimeSlot)
+@receiver(post_delete, sender=TimeSlot)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=ClassGroup)
+@receiver(post_delete, sender=ClassGroup)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+def stage_data_changed(sender, instance, **kwargs):
+    stage_id = instance.stage_id
+    transaction.on_commit(lambda: bump_stage_versions(stage_id))
+
+
+# Lesson lengths come from their timeslots
+@receiver(post_save, sender=TimeSlot)
+def timeslot_saved(sender, instance, created, **kwargs):
+    if not created:
+        analytics.rebuild_utilisation([instance.stage_id])
+
+
+@receiver(post_delete, sender=Teacher)
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Subject)
+def utilisation_entity_deleted(sender, instance, **kwargs):
+    analytics.entity_deleted(sender._meta.model_name, instance.pk)
+
+
+@receiver(post_save, sender=Stage)
+def stage_saved(sender, instance, **kwargs):
+    stage_id = instance.pk
+    transaction.on_commit(lambda: bump_stage_versions(stage_id))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Teacher names come from the User; logins only touch last_login
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    for stage_id in Teacher.objects.filter(user_id=instance.pk).values_list('stage_id', flat=True):
+        transaction.on_commit(lambda stage_id=stage_id: bump_stage_versions(stage_id))
+
+
+# Stage, teacher, class group and room ids -> stage id, as cached by
+# timetables.cached_entity_stage_id(), and the calendar feed lookups
+ENTITY_KINDS = {model: kind for kind, (model, _) in GRID_KINDS.items()}
+
+
+@receiver(post_save, sender=Stage)
+@receiver(post_delete, sender=Stage)
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+@receiver(post_save, sender=ClassGroup)
+@receiver(post_delete, sender=ClassGroup)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def entity_changed(sender, instance, **kwargs):
+    kind = ENTITY_KINDS[sender]
+    keys = [entity_stage_cache_key(kind, instance.pk)]
+    if kind in FEED_KINDS:
+        keys.append(feed_entity_cache_key(kind, instance.pk))
+    transaction.on_commit(lambda: cache.delete_many(keys))
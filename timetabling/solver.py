@@ -0,0 +1,274 @@
+"""
+Automatic timetable solver.
+
+Fills a stage's TimeSlot grid from its LessonRequirements. Occupancy is kept
+as one integer bitset per teacher, room and class group (bit ``i`` set means
+the i-th timeslot of the stage is taken), so every double-booking check is a
+single AND. Each restart is an independent randomised greedy pass with a
+one-step repair; restarts are spread over a process pool and the best result
+wins.
+
+The search itself works on plain ids and tuples only, so worker processes
+never touch the ORM. Django models are imported inside the load/apply helpers
+to keep this module importable from a freshly spawned worker.
+"""
+import os
+import random
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _bits(mask):
+    # Yield the index of every set bit, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class _Grid:
+    """
+    Mutable occupancy state for one restart.
+    Placements are stored as [class_group, subject, teacher, room, slot].
+    """
+
+    def __init__(self, problem):
+        self.room_ids = problem['room_ids']
+        self.slot_days = problem['slot_days']
+        self.teacher = defaultdict(int, problem['teacher_busy'])
+        self.group = defaultdict(int, problem['group_busy'])
+        self.room = defaultdict(int, problem['room_busy'])
+        self.full = (1 << len(problem['slot_ids'])) - 1
+        self.placements = []
+        # (class_group, slot) and (teacher, slot) -> placement index
+        self.group_at = {}
+        self.teacher_at = {}
+        # (class_group, subject) -> bitset of days already used
+        self.subject_days = defaultdict(int)
+        self.preferred_room = {}
+
+    def free_slots(self, class_group, teacher):
+        return self.full & ~(self.group[class_group] | self.teacher[teacher])
+
+    def free_room(self, slot, preferred=None):
+        bit = 1 << slot
+        if preferred is not None and not self.room[preferred] & bit:
+            return preferred
+        for room in self.room_ids:
+            if not self.room[room] & bit:
+                return room
+        return None
+
+    def place(self, class_group, subject, teacher, room, slot):
+        bit = 1 << slot
+        self.group[class_group] |= bit
+        self.teacher[teacher] |= bit
+        self.room[room] |= bit
+        self.subject_days[(class_group, subject)] |= 1 << self.slot_days[slot]
+        self.preferred_room.setdefault((class_group, subject), room)
+        index = len(self.placements)
+        self.placements.append([class_group, subject, teacher, room, slot])
+        self.group_at[(class_group, slot)] = index
+        self.teacher_at[(teacher, slot)] = index
+        return index
+
+    def move(self, index, room, slot):
+        class_group, subject, teacher, old_room, old_slot = self.placements[index]
+        old_bit, bit = 1 << old_slot, 1 << slot
+        self.group[class_group] = (self.group[class_group] & ~old_bit) | bit
+        self.teacher[teacher] = (self.teacher[teacher] & ~old_bit) | bit
+        self.room[old_room] &= ~old_bit
+        self.room[room] |= bit
+        del self.group_at[(class_group, old_slot)]
+        del self.teacher_at[(teacher, old_slot)]
+        self.group_at[(class_group, slot)] = index
+        self.teacher_at[(teacher, slot)] = index
+        self.subject_days[(class_group, subject)] |= 1 << self.slot_days[slot]
+        self.placements[index] = [class_group, subject, teacher, room, slot]
+
+    def pick_slot(self, free, class_group, subject, rng):
+        # Prefer days on which the class group does not have this subject yet
+        used_days = self.subject_days[(class_group, subject)]
+        preferred = self.preferred_room.get((class_group, subject))
+        best = None
+        for slot in _bits(free):
+            room = self.free_room(slot, preferred)
+            if room is None:
+                continue
+            score = (bool(used_days & (1 << self.slot_days[slot])), rng.random())
+            if best is None or score < best[0]:
+                best = (score, slot, room)
+        return best
+
+    def try_repair(self, class_group, subject, teacher, rng):
+        # Look for a slot blocked by exactly one lesson placed in this run
+        # that can be moved somewhere else, then take its place
+        candidates = list(_bits(self.full))
+        rng.shuffle(candidates)
+        for slot in candidates:
+            bit = 1 << slot
+            blockers = set()
+            if self.group[class_group] & bit:
+                blockers.add(self.group_at.get((class_group, slot)))
+            if self.teacher[teacher] & bit:
+                blockers.add(self.teacher_at.get((teacher, slot)))
+            # None is a lesson that already existed, which never moves
+            if len(blockers) != 1 or None in blockers:
+                continue
+            index = blockers.pop()
+            other_group, other_subject, other_teacher, _, _ = self.placements[index]
+            target = self.pick_slot(
+                self.free_slots(other_group, other_teacher),
+                other_group, other_subject, rng,
+            )
+            if target is None:
+                continue
+            _, new_slot, new_room = target
+            self.move(index, new_room, new_slot)
+            # The group and teacher are now free, and the moved lesson
+            # freed its room, so there is always a room
+            room = self.free_room(slot, self.preferred_room.get((class_group, subject)))
+            return slot, room
+        return None
+
+
+def solve_once(problem, seed):
+    """
+    Run a single randomised greedy pass and return
+    ``(unplaced_count, repeat_penalty, assignments, unplaced)``.
+    """
+    rng = random.Random(seed)
+    grid = _Grid(problem)
+
+    units = list(problem['units'])
+    rng.shuffle(units)
+    # Most constrained first; the stable sort keeps the shuffle for ties
+    teacher_load = Counter(unit[2] for unit in units)
+    group_load = Counter(unit[0] for unit in units)
+    units.sort(key=lambda unit: -(teacher_load[unit[2]] + group_load[unit[0]]))
+
+    unplaced = []
+    for class_group, subject, teacher in units:
+        choice = grid.pick_slot(grid.free_slots(class_group, teacher), class_group, subject, rng)
+        if choice is not None:
+            _, slot, room = choice
+        else:
+            repaired = grid.try_repair(class_group, subject, teacher, rng)
+            if repaired is None:
+                unplaced.append((class_group, subject, teacher))
+                continue
+            slot, room = repaired
+        grid.place(class_group, subject, teacher, room, slot)
+
+    # Count lessons that share a day with the same subject for the same group
+    per_day = Counter(
+        (class_group, subject, problem['slot_days'][slot])
+        for class_group, subject, _, _, slot in grid.placements
+    )
+    repeat_penalty = sum(count - 1 for count in per_day.values())
+
+    slot_ids = problem['slot_ids']
+    assignments = [
+        (class_group, subject, teacher, room, slot_ids[slot])
+        for class_group, subject, teacher, room, slot in grid.placements
+    ]
+    return len(unplaced), repeat_penalty, assignments, unplaced
+
+
+def solve(problem, restarts=8, workers=None, seed=None):
+    """
+    Run ``restarts`` independent passes, in parallel when ``workers`` > 1,
+    and return the best result as produced by ``solve_once``.
+    """
+    if seed is None:
+        seed = random.randrange(1 << 30)
+    seeds = [seed + i for i in range(max(restarts, 1))]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(seeds))
+
+    if workers > 1 and problem['units']:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(solve_once, [problem] * len(seeds), seeds))
+    else:
+        results = [solve_once(problem, s) for s in seeds]
+
+    return min(results, key=lambda result: (result[0], result[1]))
+
+
+def load_problem(stage, replace=False):
+    """
+    Build the solver input for a stage from its TimeSlots, Rooms, existing
+    Lessons and LessonRequirements. With ``replace`` the existing lessons are
+    ignored; otherwise they stay put and only the missing periods are solved.
+    """
+    from .models import Lesson, LessonRequirement, Room, TimeSlot
+
+    slots = list(
+        TimeSlot.objects.filter(stage=stage)
+        .order_by('weekday', 'start_time')
+        .values_list('id', 'weekday')
+    )
+    slot_index = {slot_id: i for i, (slot_id, _) in enumerate(slots)}
+
+    teacher_busy = defaultdict(int)
+    group_busy = defaultdict(int)
+    room_busy = defaultdict(int)
+    scheduled = Counter()
+
+    if not replace:
+        existing = Lesson.objects.filter(stage=stage).values_list(
+            'class_group_id', 'subject_id', 'teacher_id', 'room_id', 'timeslot_id'
+        )
+        for class_group, subject, teacher, room, timeslot in existing:
+            bit = 1 << slot_index[timeslot]
+            teacher_busy[teacher] |= bit
+            group_busy[class_group] |= bit
+            room_busy[room] |= bit
+            scheduled[(class_group, subject)] += 1
+
+    units = []
+    requirements = LessonRequirement.objects.filter(class_group__stage=stage).values_list(
+        'class_group_id', 'subject_id', 'teacher_id', 'periods_per_week'
+    )
+    for class_group, subject, teacher, periods in requirements:
+        missing = periods - scheduled[(class_group, subject)]
+        units.extend([(class_group, subject, teacher)] * max(missing, 0))
+
+    return {
+        'slot_ids': [slot_id for slot_id, _ in slots],
+        'slot_days': [weekday for _, weekday in slots],
+        'room_ids': list(Room.objects.filter(stage=stage).values_list('id', flat=True)),
+        'teacher_busy': dict(teacher_busy),
+        'group_busy': dict(group_busy),
+        'room_busy': dict(room_busy),
+        'units': units,
+    }
+
+
+def apply_solution(stage, assignments, replace=False):
+    """
+    Write solver assignments as Lessons in one transaction and return the
+    number created. Every assignment is conflict-free by construction, so the
+    rows go straight to bulk_create; the database constraints still apply.
+    """
+    from django.db import transaction
+    from .models import Lesson
+    from .signals import lessons_bulk_changed
+
+    with transaction.atomic():
+        if replace:
+            Lesson.objects.filter(stage=stage).delete()
+        Lesson.objects.bulk_create([
+            Lesson(
+                stage=stage,
+                class_group_id=class_group,
+                subject_id=subject,
+                teacher_id=teacher,
+                room_id=room,
+                timeslot_id=timeslot,
+            )
+            for class_group, subject, teacher, room, timeslot in assignments
+        ])
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=[stage.pk])
+    return len(assignments)
@@ -0,0 +1,133 @@
+"""
+Synthetic school generator for load testing and benchmarks.
+
+Everything is written with bulk_create. Lessons are conflict-free by
+construction: in each timeslot a stage's teachers, rooms and class groups
+are sampled without replacement, so none of them can appear twice.
+"""
+import random
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.text import slugify
+from timetabling.models import Stage, Subject, Room, ClassGroup, TimeSlot, Teacher, Lesson
+from .signals import lessons_bulk_changed
+
+
+SUBJECT_NAMES = [
+    'Maths', 'English', 'Science', 'History', 'Geography', 'Art', 'Music',
+    'Physics', 'Chemistry', 'Biology', 'Arabic', 'Islamic Studies', 'PE', 'Computing',
+]
+
+BATCH_SIZE = 2000
+
+
+def period_times(periods_per_day, first_start='08:00', length=50, gap=10):
+    # [(start, end), ...] for one day's periods, which must end by midnight
+    start = datetime.strptime(first_start, '%H:%M')
+    midnight = start.replace(hour=0, minute=0) + timedelta(days=1)
+    times = []
+    for _ in range(periods_per_day):
+        end = start + timedelta(minutes=length)
+        if end >= midnight:
+            raise ValidationError(
+                f"{periods_per_day} periods of {length} minutes from {first_start} do not fit in one day."
+            )
+        times.append((start.time(), end.time()))
+        start = end + timedelta(minutes=gap)
+    return times
+
+
+def stage_names(stages, prefix):
+    return [f"{prefix} Stage {n + 1}" for n in range(stages)]
+
+
+def check_free(stages, teachers, prefix):
+    # The generated stages and teacher usernames must not exist yet
+    names = stage_names(stages, prefix)
+    taken = list(Stage.objects.filter(name__in=names).values_list('name', flat=True))
+    if taken:
+        raise ValidationError(f"Stages already exist: {', '.join(sorted(taken))}. Use another prefix.")
+    usernames = [f"{slugify(name)}-teacher-{i + 1}" for name in names for i in range(teachers)]
+    if User.objects.filter(username__in=usernames).exists():
+        raise ValidationError(f"Users named like '{slugify(names[0])}-teacher-1' already exist. Use another prefix.")
+
+
+def generate_school(stages=2, teachers=40, rooms=30, class_groups=24, periods_per_day=7,
+                    fill=0.8, seed=None, prefix='Synthetic'):
+    """
+    Create ``stages`` stages, each with the given number of teachers, rooms
+    and class groups and ``periods_per_day`` timeslots per weekday. Each
+    timeslot can hold as many lessons as the smallest of those three counts;
+    ``fill`` is the fraction of those places that get a lesson. Returns a
+    dict of created row counts, or raises ValidationError for impossible
+    sizes or a ``prefix`` already in use.
+    """
+    if min(stages, teachers, rooms, class_groups, periods_per_day) < 1 or not 0 <= fill <= 1:
+        raise ValidationError("Counts must be at least 1 and fill between 0 and 1.")
+    times = period_times(periods_per_day)
+    check_free(stages, teachers, prefix)
+
+    rng = random.Random(seed)
+    days = [day for day, _ in TimeSlot.DAY_CHOICES]
+    # A timeslot cannot hold more lessons than its scarcest resource allows
+    per_slot = min(teachers, rooms, class_groups)
+    counts = dict.fromkeys(['stages', 'teachers', 'rooms', 'class_groups', 'timeslots', 'lessons'], 0)
+
+    with transaction.atomic():
+        stage_objs = Stage.objects.bulk_create([Stage(name=name) for name in stage_names(stages, prefix)])
+        counts['stages'] = len(stage_objs)
+
+        for stage in stage_objs:
+            slug = slugify(stage.name)
+            slots = TimeSlot.objects.bulk_create([
+                TimeSlot(stage=stage, day=day, weekday=weekday, start_time=start, end_time=end)
+                for weekday, day in enumerate(days) for start, end in times
+            ], batch_size=BATCH_SIZE)
+            subjects = Subject.objects.bulk_create([Subject(stage=stage, name=name) for name in SUBJECT_NAMES])
+            room_ids = [room.pk for room in Room.objects.bulk_create(
+                [Room(stage=stage, name=f"Room {i + 1}") for i in range(rooms)], batch_size=BATCH_SIZE
+            )]
+            group_ids = [group.pk for group in ClassGroup.objects.bulk_create(
+                [ClassGroup(stage=stage, name=f"Group {i + 1}") for i in range(class_groups)], batch_size=BATCH_SIZE
+            )]
+            # Unusable passwords: no hashing cost, and nobody can log in as them
+            users = User.objects.bulk_create([
+                User(username=f"{slug}-teacher-{i + 1}", first_name=f"Teacher {i + 1}",
+                     last_name=stage.name, password=make_password(None))
+                for i in range(teachers)
+            ], batch_size=BATCH_SIZE)
+            teacher_ids = [teacher.pk for teacher in Teacher.objects.bulk_create(
+                [Teacher(user=user, stage=stage) for user in users], batch_size=BATCH_SIZE
+            )]
+
+            lessons = []
+            for slot in slots:
+                booked = sum(rng.random() < fill for _ in range(per_slot))
+                for teacher_id, room_id, group_id in zip(
+                    rng.sample(teacher_ids, booked),
+                    rng.sample(room_ids, booked),
+                    rng.sample(group_ids, booked),
+                ):
+                    lessons.append(Lesson(
+                        stage=stage,
+                        teacher_id=teacher_id,
+                        room_id=room_id,
+                        class_group_id=group_id,
+                        subject_id=rng.choice(subjects).pk,
+                        timeslot=slot,
+                    ))
+            Lesson.objects.bulk_create(lessons, batch_size=BATCH_SIZE)
+
+            counts['teachers'] += len(teacher_ids)
+            counts['rooms'] += len(room_ids)
+            counts['class_groups'] += len(group_ids)
+            counts['timeslots'] += len(slots)
+            counts['lessons'] += len(lessons)
+
+        lessons_bulk_changed.send(sender=Lesson, stage_ids=[stage.pk for stage in stage_objs])
+
+    return counts
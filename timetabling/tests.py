@@ -1,3 +1,1375 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from datetime import date, time
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import include, path, resolve, reverse
+from school_scheduling import urls as project_urls
+from django.utils.text import slugify
+from timetabling.models import (
+    Stage, Subject, Room, ClassGroup, TimeSlot, Teacher, Lesson, BellSchedule, BellPeriod, Term, Holiday, LessonOverride,
+    LessonRequirement, UtilisationSummary, DraftSchedule,
+)
+from .analytics import rebuild_utilisation, utilisation
+from .bells import expand_bell_schedule, find_overlaps, retime_stage
+from .caching import bump_stage_version, entity_version
+from .calendars import feed_url, reset_feed_key
+from .checks import check_shared_cache
+from .availability import search
+from .cover import find_cover
+from .drafts import create_draft, draft_diff, publish_draft
+from .exports import SCHEDULE_EMPTY_ROW, SCHEDULE_HEADER, TEACHER_HEADER, stream_csv
+from .forms import LessonForm
+from .imports import IMPORT_COLUMNS, import_lessons, read_csv
+from .instrumentation import QueryCounter
+from .occupancy import get_occupancy
+from .occurrences import occurrences, school_days
+from .pagination import PAGE_SIZE, encode_cursor
+from .repair import RepairConflict, apply_repair, plan_repair
+from .replicas import PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter, replica_reads
+from .report import build_report, report_limits
+from .roles import role_cache_key
+from .solver import apply_solution, load_problem, solve, solve_once
+from .synthetic import generate_school, period_times
+from .timetables import get_grid
+from .urls import async_urlpatterns
+
+
+DAYS = [day for day, _ in TimeSlot.DAY_CHOICES]
+
+
+def seed_stage(stage, prefix, class_groups=6, teachers=8, rooms=8, periods=5, first_hour=8):
+    """
+    Add a fully scheduled block to a stage with bulk_create: every new class
+    group has a lesson in every new timeslot, and teachers and rooms rotate
+    so nothing is double-booked.
+    """
+    slots = TimeSlot.objects.bulk_create([
+        TimeSlot(stage=stage, day=day, weekday=weekday, start_time=time(hour), end_time=time(hour, 50))
+        for weekday, day in enumerate(DAYS) for hour in range(first_hour, first_hour + periods)
+    ])
+    subjects = Subject.objects.bulk_create([Subject(stage=stage, name=f"{prefix} Subject {i}") for i in range(5)])
+    room_objs = Room.objects.bulk_create([Room(stage=stage, name=f"{prefix} Room {i}") for i in range(rooms)])
+    groups = ClassGroup.objects.bulk_create([
+        ClassGroup(stage=stage, name=f"{prefix} Group {i}") for i in range(class_groups)
+    ])
+    users = User.objects.bulk_create([
+        User(username=f"{slugify(stage.name)}.{slugify(prefix)}.{i}", first_name=f"Teacher{i}", last_name=prefix)
+        for i in range(teachers)
+    ])
+    teacher_objs = Teacher.objects.bulk_create([Teacher(user=user, stage=stage) for user in users])
+
+    Lesson.objects.bulk_create([
+        Lesson(
+            stage=stage,
+            teacher=teacher_objs[(g + s) % teachers],
+            room=room_objs[(g + s) % rooms],
+            subject=subjects[(g + s) % len(subjects)],
+            class_group=groups[g],
+            timeslot=slot,
+        )
+        for s, slot in enumerate(slots) for g in range(class_groups)
+    ])
+
+
+class SolverTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6', class_groups=2, teachers=3, rooms=3, periods=3)
+        cls.groups = list(ClassGroup.objects.filter(stage=cls.stage))
+        cls.teachers = list(Teacher.objects.filter(stage=cls.stage))
+        cls.subjects = list(Subject.objects.filter(stage=cls.stage))
+
+    def test_repair_never_moves_existing_lessons(self):
+        # Group 0 already has lessons in slots 0 and 2 and teacher 0 in
+        # slot 1, so group 0's period with teacher 0 has nowhere to go.
+        # Repairing it must not put it on top of an existing lesson.
+        problem = {
+            'slot_ids': [10, 11, 12],
+            'slot_days': [0, 0, 0],
+            'room_ids': [1, 2, 3],
+            'teacher_busy': {100: 0b010},
+            'group_busy': {1: 0b101, 3: 0b010},
+            'room_busy': {1: 0b111},
+            'units': [(2, 5, 100), (1, 5, 100)],
+        }
+        for seed in range(20):
+            unplaced_count, _, assignments, unplaced = solve_once(problem, seed)
+            self.assertEqual(unplaced, [(1, 5, 100)])
+            self.assertEqual(unplaced_count, 1)
+            self.assertEqual(len(assignments), 1)
+            self.assertNotEqual(assignments[0][4], 11)
+            self.assertNotEqual(assignments[0][3], 1)
+
+    def test_solution_fills_requirements_around_existing_lessons(self):
+        # Free the last period of the week and ask for more lessons than fit
+        last = TimeSlot.objects.filter(stage=self.stage).order_by('-weekday', '-start_time').first()
+        Lesson.objects.filter(timeslot=last).delete()
+        for group, subject in zip(self.groups, self.subjects):
+            existing = Lesson.objects.filter(class_group=group, subject=subject).count()
+            LessonRequirement.objects.create(
+                class_group=group, subject=subject, teacher=self.teachers[-1], periods_per_week=existing + 2,
+            )
+
+        problem = load_problem(self.stage)
+        self.assertEqual(len(problem['units']), 4)
+        unplaced_count, _, assignments, _ = solve(problem, restarts=4, workers=1, seed=3)
+        # One free slot, and both groups need the same teacher in it
+        self.assertEqual((unplaced_count, len(assignments)), (3, 1))
+        self.assertEqual(assignments[0][4], last.pk)
+
+        self.assertEqual(apply_solution(self.stage, assignments), 1)
+        self.assertEqual(len(load_problem(self.stage)['units']), 3)
+        self.assertEqual(Lesson.objects.filter(timeslot=last).count(), 1)
+
+
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6', class_groups=2, teachers=3, rooms=3, periods=2)
+        cls.secretary = User.objects.create_user('secretary', password='x')
+        cls.secretary.groups.add(Group.objects.create(name='Secretaries'))
+
+    def export(self):
+        self.client.force_login(self.secretary)
+        return b''.join(self.client.get(reverse('export_schedule_csv')).streaming_content).decode()
+
+    def csv(self, *rows):
+        return '\n'.join([','.join(IMPORT_COLUMNS)] + [','.join(row) for row in rows])
+
+    def test_exported_schedule_imports_back(self):
+        text = self.export()
+        lessons = set(Lesson.objects.values_list('teacher', 'room', 'class_group', 'subject', 'timeslot'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(import_lessons(read_csv(text), replace=True), len(lessons))
+        self.assertEqual(set(Lesson.objects.values_list('teacher', 'room', 'class_group', 'subject', 'timeslot')), lessons)
+        self.assertEqual(self.export(), text)
+
+        response = self.client.post(reverse('import_schedule_csv'), {
+            'file': io.BytesIO(text.encode()), 'replace': 'on',
+        })
+        self.assertRedirects(response, reverse('create_schedule'), fetch_redirect_response=False)
+        self.assertEqual(Lesson.objects.count(), len(lessons))
+
+    def test_conflicts_and_bad_rows_import_nothing(self):
+        Lesson.objects.filter(timeslot__day='Friday', timeslot__start_time=time(9)).delete()
+        free = ['Middle School', 'Friday', '09:00', '09:50']
+        Teacher.objects.create(
+            stage=self.stage, user=User.objects.create_user('namesake', first_name='Teacher0', last_name='Year 6'),
+        )
+        rows = read_csv(self.csv(
+            free + ['Year 6 Group 0', 'Year 6 Subject 0', 'Year 6 Room 0', 'Teacher1 Year 6'],
+            # Same room as row 2
+            free + ['Year 6 Group 1', 'Year 6 Subject 1', 'Year 6 Room 0', 'Teacher2 Year 6'],
+            # Group 0 already has a lesson on Monday at 8
+            ['Middle School', 'Monday', '08:00', '08:50', 'Year 6 Group 0', 'Year 6 Subject 0', 'Year 6 Room 2',
+             'Teacher2 Year 6'],
+            free + ['Year 6 Group 1', 'Year 6 Subject 1', 'Year 6 Room 1', 'Teacher0 Year 6'],
+            free + ['Year 6 Group 1', 'Nope', 'Year 6 Room 1', 'Teacher2 Year 6'],
+            ['Middle School', 'Friday', '25:00', '09:50', 'Year 6 Group 1', 'Year 6 Subject 1', 'Year 6 Room 1',
+             'Teacher2 Year 6'],
+            ['High School'] + free[1:] + ['Year 6 Group 1', 'Year 6 Subject 1', 'Year 6 Room 1', 'Teacher2 Year 6'],
+        ))
+        count = Lesson.objects.count()
+
+        with self.assertRaises(ValidationError) as raised:
+            import_lessons(rows)
+        self.assertEqual(raised.exception.messages, [
+            "Row 3: room Year 6 Room 0 is already booked by row 2 at Friday 09:00.",
+            "Row 4: class group Year 6 Group 0 is already booked by an existing lesson at Monday 08:00.",
+            "Row 5: teacher 'Teacher0 Year 6' matches several teachers in Middle School; use their username.",
+            "Row 6: no matching subject in Middle School.",
+            "Row 7: no matching timeslot in Middle School.",
+            "Row 8: unknown stage 'High School'.",
+        ])
+        self.assertEqual(Lesson.objects.count(), count)
+
+        # The username resolves the ambiguous teacher
+        rows = read_csv(self.csv(free + ['Year 6 Group 1', 'Year 6 Subject 1', 'Year 6 Room 1', 'namesake']))
+        self.assertEqual(import_lessons(rows), 1)
+
+        with self.assertRaisesMessage(ValidationError, 'Missing columns: Teacher.'):
+            read_csv(','.join(IMPORT_COLUMNS[:-1]))
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6', class_groups=3, teachers=4, rooms=3, periods=3)
+        cls.secretary = User.objects.create_user('secretary', password='x')
+        cls.secretary.groups.add(Group.objects.create(name='Secretaries'))
+        cls.teacher = Teacher.objects.select_related('user').first()
+        cls.teacher.user.groups.add(Group.objects.create(name='Teachers'))
+
+    def download(self, user, name, data=None):
+        self.client.force_login(user)
+        response = self.client.get(reverse(name), data)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Disposition'].startswith('attachment; filename='))
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def expected(self, lessons):
+        return [
+            [
+                lesson.stage.name, lesson.timeslot.day, f"{lesson.timeslot.start_time:%H:%M}",
+                f"{lesson.timeslot.end_time:%H:%M}", lesson.class_group.name, lesson.subject.name, lesson.room.name,
+                lesson.teacher.user.get_full_name(),
+            ]
+            for lesson in lessons.select_related('stage', 'timeslot', 'class_group', 'subject', 'room', 'teacher__user')
+        ]
+
+    def test_schedule_export(self):
+        rows = self.download(self.secretary, 'export_schedule_csv')
+        self.assertEqual(rows[0], SCHEDULE_HEADER)
+        lessons = Lesson.objects.order_by('timeslot__weekday', 'timeslot__start_time')
+        # Week order; lessons within a period in any order
+        self.assertEqual([row[1:3] for row in rows[1:]], [row[1:3] for row in self.expected(lessons)])
+        self.assertCountEqual(rows[1:], self.expected(lessons))
+
+        rows = self.download(self.secretary, 'export_schedule_csv', {'teacher': self.teacher.pk})
+        self.assertCountEqual(rows[1:], self.expected(lessons.filter(teacher=self.teacher)))
+        rows = self.download(self.secretary, 'export_schedule_csv', {'teacher': self.teacher.pk + 1000})
+        self.assertEqual(rows, [SCHEDULE_HEADER, SCHEDULE_EMPTY_ROW])
+
+    def test_teacher_export_has_only_their_lessons(self):
+        rows = self.download(self.teacher.user, 'export_teacher_schedule_csv')
+        self.assertEqual(rows[0], TEACHER_HEADER)
+        self.assertEqual(rows[1:], [
+            row[:7] for row in self.expected(Lesson.objects.filter(teacher=self.teacher).order_by(
+                'timeslot__weekday', 'timeslot__start_time',
+            ))
+        ])
+
+    def test_rows_are_streamed_in_batches(self):
+        rows = ([i, f"row {i}"] for i in range(1200))
+        chunks = list(stream_csv(['Number', 'Name'], rows, ['None']))
+        # 500 lines per chunk, the header counting as one
+        self.assertEqual([chunk.count('\r\n') for chunk in chunks], [500, 500, 201])
+        parsed = list(csv.reader(io.StringIO(''.join(chunks))))
+        self.assertEqual(parsed[0], ['Number', 'Name'])
+        self.assertEqual(parsed[1:], [[str(i), f"row {i}"] for i in range(1200)])
+
+        self.assertEqual(list(stream_csv(['Number'], iter([]), ['None'])), ['Number\r\nNone\r\n'])
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # 150 lessons, six per timeslot, so page boundaries fall inside a timeslot
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6')
+        seed_stage(Stage.objects.create(name='High School'), 'Year 10', class_groups=2, periods=2)
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def walk(self, params):
+        # Every page of admin_schedule, following the next links
+        pages = []
+        query = params
+        while query is not None:
+            response = self.client.get(f"{reverse('admin_schedule')}?{query}")
+            pages.append([lesson.pk for lesson in response.context['lessons']])
+            query = response.context['next_query']
+        return pages
+
+    def ordered(self, lessons):
+        return list(lessons.order_by('timeslot__weekday', 'timeslot__start_time', 'id').values_list('pk', flat=True))
+
+    def test_pages_cover_every_lesson_once_in_week_order(self):
+        pages = self.walk(f"stage={self.stage.pk}")
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE] * 3)
+        self.assertEqual(sum(pages, []), self.ordered(Lesson.objects.filter(stage=self.stage)))
+
+        # Unlike an OFFSET, a lesson removed from an earlier page does not shift the next one
+        response = self.client.get(reverse('admin_schedule'), {'stage': self.stage.pk})
+        Lesson.objects.filter(pk=pages[0][0]).delete()
+        second = self.client.get(f"{reverse('admin_schedule')}?{response.context['next_query']}")
+        self.assertEqual([lesson.pk for lesson in second.context['lessons']], pages[1])
+        self.assertEqual(second.context['first_query'], f"stage={self.stage.pk}")
+
+    def test_filters(self):
+        lesson = Lesson.objects.filter(stage=self.stage).select_related('timeslot').first()
+        for params, lessons in [
+            ({'teacher': lesson.teacher_id}, Lesson.objects.filter(teacher=lesson.teacher)),
+            ({'class_group': lesson.class_group_id, 'day': 'Tuesday'},
+             Lesson.objects.filter(class_group=lesson.class_group, timeslot__weekday=1)),
+            ({'day': 'Friday'}, Lesson.objects.filter(timeslot__weekday=4)),
+            ({}, Lesson.objects.all()),
+        ]:
+            with self.subTest(params=params):
+                query = '&'.join(f"{name}={value}" for name, value in params.items())
+                self.assertEqual(sum(self.walk(query), []), self.ordered(lessons))
+
+        # Unknown days and non-numeric ids are ignored
+        response = self.client.get(reverse('admin_schedule'), {'day': 'Someday', 'teacher': 'x'})
+        self.assertEqual(response.context['filters'], {})
+
+    def test_bad_cursor_starts_over(self):
+        first = self.client.get(reverse('admin_schedule'))
+        for cursor in ['nonsense', 'bm9uc2Vuc2U=', encode_cursor(first.context['lessons'][0])[:-2]]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('admin_schedule'), {'after': cursor})
+                self.assertEqual(list(response.context['lessons']), list(first.context['lessons']))
+
+
+class RoleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.secretaries = Group.objects.create(name='Secretaries')
+        cls.secretary = User.objects.create_user('secretary', password='x')
+        cls.secretary.groups.add(cls.secretaries)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.secretary)
+
+    def assertAllowed(self, allowed):
+        response = self.client.get(reverse('create_schedule'))
+        self.assertEqual(response.status_code, 200 if allowed else 302)
+
+    @override_settings(SHARED_CACHE=True)
+    def test_revoked_roles_take_effect_on_the_next_request(self):
+        for revoke, restore in [
+            (lambda: self.secretary.groups.remove(self.secretaries), lambda: self.secretary.groups.add(self.secretaries)),
+            (lambda: self.secretaries.user_set.remove(self.secretary), lambda: self.secretaries.user_set.add(self.secretary)),
+            (lambda: self.secretaries.user_set.clear(), lambda: self.secretaries.user_set.add(self.secretary)),
+        ]:
+            self.assertAllowed(True)
+            self.assertIsNotNone(cache.get(role_cache_key(self.secretary.pk)))
+            revoke()
+            self.assertAllowed(False)
+            restore()
+
+        self.assertAllowed(True)
+        self.secretaries.delete()
+        self.assertAllowed(False)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_roles_not_kept_in_a_process_local_cache(self):
+        self.assertAllowed(True)
+        self.assertIsNone(cache.get(role_cache_key(self.secretary.pk)))
+        # Revoked without signals, as another process's change would look here
+        User.groups.through.objects.filter(user=self.secretary).delete()
+        self.assertAllowed(False)
+
+
+class LessonFormTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6', class_groups=2, teachers=3, rooms=3, periods=2)
+        cls.lesson = Lesson.objects.filter(stage=cls.stage).first()
+
+    def setUp(self):
+        # Occupancy indexes are keyed on the cached stage version
+        cache.clear()
+
+    def form(self, lesson=None, **changes):
+        lesson = lesson or self.lesson
+        data = {field: getattr(lesson, f'{field}_id') for field in LessonForm.Meta.fields}
+        data.update((field, value.pk) for field, value in changes.items())
+        form = LessonForm(data, instance=lesson if lesson.pk else None)
+        form.limit_to_stage(self.stage.pk)
+        return form
+
+    def test_conflicts_come_from_the_index(self):
+        # Editing a lesson in place does not clash with itself
+        self.assertTrue(self.form().is_valid())
+
+        index = get_occupancy(self.stage.pk)
+        new = Lesson(
+            teacher=self.lesson.teacher, room=self.lesson.room, class_group=self.lesson.class_group,
+            subject=self.lesson.subject, timeslot=self.lesson.timeslot,
+        )
+        form = self.form(new)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(set(form.errors), {'teacher', 'room', 'class_group'})
+        self.assertIn('is already booked at Monday 08:00.', form.errors['room'][0])
+        # Checked against the same index, not a rebuilt one
+        self.assertIs(get_occupancy(self.stage.pk), index)
+
+        # Once the lesson moves, its old slot is free for the new one
+        free_slot = TimeSlot.objects.filter(stage=self.stage).order_by('-weekday', '-start_time').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            for lesson in Lesson.objects.filter(timeslot=free_slot):
+                lesson.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            moved = self.form(timeslot=free_slot)
+            self.assertTrue(moved.is_valid(), moved.errors)
+            moved.save()
+        self.assertTrue(self.form(new).is_valid())
+
+    def test_bulk_delete_invalidates_once(self):
+        index = get_occupancy(self.stage.pk)
+        deleted = Lesson.objects.filter(stage=self.stage, timeslot__weekday=0)
+        lesson_ids = set(deleted.values_list('id', flat=True))
+        teachers = set(deleted.values_list('teacher_id', flat=True))
+        versions = {pk: entity_version('teacher', pk) for pk in teachers}
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            count, _ = deleted.delete()
+        self.assertEqual(count, len(lesson_ids))
+        # One for utilisation, one for the index and owner versions
+        self.assertEqual(len(callbacks), 2)
+        rebuilt = get_occupancy(self.stage.pk)
+        self.assertIsNot(rebuilt, index)
+        self.assertFalse(lesson_ids & set(rebuilt.lessons))
+        self.assertTrue(all(entity_version('teacher', pk) != version for pk, version in versions.items()))
+
+    def test_index_follows_changes_from_other_processes(self):
+        self.assertTrue(self.form().is_valid())
+        other = Lesson.objects.filter(timeslot=self.lesson.timeslot).exclude(pk=self.lesson.pk).first()
+        # As another worker would: write, then bump the shared version
+        Lesson.objects.filter(pk=self.lesson.pk).delete()
+        Lesson.objects.filter(pk=other.pk).update(room=self.lesson.room_id)
+        bump_stage_version(self.stage.pk)
+
+        form = self.form(Lesson(
+            teacher=other.teacher, room=self.lesson.room, class_group=self.lesson.class_group,
+            subject=self.lesson.subject, timeslot=self.lesson.timeslot,
+        ))
+        self.assertFalse(form.is_valid())
+        self.assertEqual(set(form.errors), {'teacher', 'room'})
+
+    def test_process_local_cache_is_reported(self):
+        with override_settings(SHARED_CACHE=False):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['timetabling.W001'])
+        with override_settings(SHARED_CACHE=True):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class TimetableGridTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6', class_groups=2, teachers=3, rooms=3, periods=2)
+        cls.other_stage = Stage.objects.create(name='High School')
+        seed_stage(cls.other_stage, 'Year 10', class_groups=2, teachers=3, rooms=3, periods=2)
+        cls.lesson = Lesson.objects.filter(stage=cls.stage).select_related('timeslot').first()
+        cls.spare_room = Room.objects.create(stage=cls.stage, name='Year 6 Spare')
+
+    def setUp(self):
+        cache.clear()
+
+    def cell(self, kind, entity):
+        grid = get_grid(kind, entity)
+        row = next(row for row in grid['rows'] if row['start'] == f"{self.lesson.timeslot.start_time:%H:%M}")
+        return row['cells'][self.lesson.timeslot.weekday]
+
+    def assertCached(self, kind, entity):
+        with QueryCounter() as counter:
+            get_grid(kind, entity)
+        self.assertEqual(counter.count, 0)
+
+    def test_grid_rebuilt_after_lesson_save(self):
+        other = ClassGroup.objects.filter(stage=self.other_stage).first()
+        self.assertEqual(len(self.cell('stage', self.stage)), 2)
+        self.assertEqual(self.cell('room', self.spare_room), [])
+        get_grid('class_group', other)
+        self.assertCached('stage', self.stage)
+
+        self.lesson.room = self.spare_room
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.save()
+
+        self.assertIn('Year 6 Spare', [lesson['room'] for lesson in self.cell('stage', self.stage)])
+        self.assertEqual([lesson['room'] for lesson in self.cell('room', self.spare_room)], ['Year 6 Spare'])
+        # Only the lesson's stage is rebuilt
+        self.assertCached('class_group', other)
+
+    def test_grid_rebuilt_after_rename(self):
+        self.lesson.room = self.spare_room
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.save()
+        self.assertEqual([lesson['room'] for lesson in self.cell('room', self.spare_room)], ['Year 6 Spare'])
+
+        self.spare_room.name = 'Year 6 Lab'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.spare_room.save()
+        self.assertEqual([lesson['room'] for lesson in self.cell('room', self.spare_room)], ['Year 6 Lab'])
+
+        # Nothing is invalidated before the change commits
+        with self.captureOnCommitCallbacks(execute=False):
+            self.lesson.delete()
+        self.assertCached('room', self.spare_room)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every view and export must stay within its @query_budget, and its query
+    count must not grow with the size of the school.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Middle School')
+        seed_stage(cls.stage, 'Year 6')
+        # seed_stage bypasses the signals that keep the summary current
+        rebuild_utilisation()
+
+        cls.secretary = User.objects.create_user('secretary', password='x', is_staff=True)
+        cls.secretary.groups.add(Group.objects.create(name='Secretaries'))
+
+        cls.teacher = Teacher.objects.filter(stage=cls.stage).select_related('user').first()
+        cls.teacher.user.groups.add(Group.objects.create(name='Teachers'))
+
+        cls.lesson = Lesson.objects.filter(teacher=cls.teacher).first()
+        cls.draft = create_draft(cls.stage, 'Next term')
+        Term.objects.create(stage=cls.stage, name='Autumn', start_date=date(2026, 9, 1), end_date=date(2026, 12, 18))
+
+    def setUp(self):
+        # Role and grid caches outlive the test transaction
+        cache.clear()
+        self.added_slots = 0
+
+    def lesson_data(self, timeslot_id):
+        return {
+            'stage': self.stage.pk, 'save_lesson': '', 'class_group': self.lesson.class_group_id,
+            'subject': self.lesson.subject_id, 'room': self.lesson.room_id, 'teacher': self.lesson.teacher_id,
+            'timeslot': timeslot_id,
+        }
+
+    def new_lesson_data(self):
+        # self.lesson's entities in a new, free evening timeslot
+        day, hour = DAYS[self.added_slots % len(DAYS)], 17 + self.added_slots // len(DAYS)
+        slot = TimeSlot.objects.create(stage=self.stage, day=day, start_time=time(hour), end_time=time(hour, 50))
+        self.added_slots += 1
+        return self.lesson_data(slot.pk)
+
+    def pages(self):
+        # (user, method, url, data[, status, headers])
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        edit_url = reverse('edit_lesson', args=[self.lesson.pk])
+        return [
+            (self.secretary, 'post', reverse('create_schedule'), self.new_lesson_data(), 302),
+            (self.secretary, 'post', reverse('create_schedule'), self.new_lesson_data(), 201, ajax),
+            # Moves the lesson
+            (self.secretary, 'post', edit_url, self.new_lesson_data(), 302),
+            (self.secretary, 'post', edit_url, self.new_lesson_data(), 200, ajax),
+            (self.secretary, 'get', reverse('home'), None),
+            (self.secretary, 'get', reverse('create_schedule'), None),
+            (self.secretary, 'post', reverse('create_schedule'), {'stage': self.stage.pk, 'select_stage': ''}),
+            (self.secretary, 'get', reverse('edit_lesson', args=[self.lesson.pk]), None),
+            (self.secretary, 'get', reverse('admin_schedule'), None),
+            (self.secretary, 'get', reverse('export_schedule_csv'), None),
+            (self.secretary, 'get', reverse('export_all_timetables'), None),
+            (self.secretary, 'get', reverse('cover_finder'), {'teacher': self.teacher.pk, 'day': 'Monday'}),
+            (self.secretary, 'get', reverse('api_cover'), {'teacher': self.teacher.pk, 'day': 'Monday'}),
+            (self.secretary, 'get', reverse('api_stage_options', args=[self.stage.pk]), None),
+            (self.secretary, 'get', reverse('availability'), self.availability_query()),
+            (self.secretary, 'get', reverse('draft_schedules'), None),
+            (self.secretary, 'get', reverse('timetable_report'), {'stage': self.stage.pk, 'max_gaps': 0}),
+            (self.secretary, 'get', reverse('utilisation_dashboard'), {'stage': self.stage.pk}),
+            (self.secretary, 'get', reverse('utilisation_heatmap', args=['room']), {'stage': self.stage.pk}),
+            (self.secretary, 'get', reverse('export_utilisation_csv'), {'stage': self.stage.pk}),
+            (self.secretary, 'get', reverse('draft_schedule', args=[self.draft.pk]), None),
+            (self.secretary, 'get', reverse('repair_schedule'), {
+                'stage': self.stage.pk, 'resource': f"teacher:{self.teacher.pk}", 'unavailable': self.lesson.timeslot_id,
+            }),
+            (self.teacher.user, 'get', reverse('api_availability'), self.availability_query()),
+            (self.secretary, 'get', reverse('timetable', args=['stage', self.stage.pk]), None),
+            (self.secretary, 'get', reverse('day_timetable', args=['class_group', self.lesson.class_group_id]),
+             {'date': '2026-11-02'}),
+            (self.secretary, 'get', reverse('api_timetable', args=['stage', self.stage.pk]), None),
+            (self.teacher.user, 'get', reverse('api_timetable', args=['teacher', self.teacher.pk]), None),
+            (self.teacher.user, 'get', feed_url('teacher', self.teacher), None),
+            (self.teacher.user, 'get', reverse('home'), None),
+            (self.teacher.user, 'get', reverse('view_schedule'), None),
+            (self.teacher.user, 'get', reverse('export_teacher_schedule_csv'), None),
+        ]
+
+    def availability_query(self):
+        return {
+            'stage': self.stage.pk, 'teacher': self.teacher.pk,
+            'class_group': self.lesson.class_group_id, 'timeslot': self.lesson.timeslot_id,
+        }
+
+    def count_queries(self, user, method, url, data, status=200, headers=None):
+        self.client.force_login(user)
+        cache.clear()
+        with transaction.atomic():
+            with QueryCounter() as counter:
+                response = getattr(self.client, method)(url, data, **(headers or {}))
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            # Every page is measured against the same lessons
+            transaction.set_rollback(True)
+        self.assertEqual(response.status_code, status, url)
+        return counter.count
+
+    def test_views_within_budget(self):
+        for user, method, url, *request in self.pages():
+            budget = getattr(resolve(url).func, 'query_budget', None)
+            with self.subTest(url=url, method=method):
+                self.assertIsNotNone(budget, f"{url} has no @query_budget")
+                self.assertLessEqual(self.count_queries(user, method, url, *request), budget)
+
+    def test_query_count_does_not_scale_with_school(self):
+        before = [self.count_queries(*page) for page in self.pages()]
+
+        # Grow the stage under test and add other stages around it
+        seed_stage(self.stage, 'Year 7', class_groups=12, teachers=14, rooms=14, periods=4, first_hour=13)
+        for i in range(3):
+            seed_stage(Stage.objects.create(name=f"Extra {i}"), 'Year 9', class_groups=12, teachers=14, rooms=14)
+
+        after = [self.count_queries(*page) for page in self.pages()]
+        for (_, method, url, *_), small, large in zip(self.pages(), before, after):
+            with self.subTest(url=url, method=method):
+                self.assertEqual(small, large)
+
+    # Roles cached between requests, as in production
+    @override_settings(SHARED_CACHE=True)
+    def test_api_revalidation_skips_lesson_query(self):
+        self.client.force_login(self.teacher.user)
+        url = reverse('api_timetable', args=['teacher', self.teacher.pk])
+        response = self.client.get(url)
+        self.assertEqual(len(response.json()['lessons']), Lesson.objects.filter(teacher=self.teacher).count())
+
+        with QueryCounter() as counter:
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        # Session and user only
+        self.assertLessEqual(counter.count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_calendar_feed_rebuilt_only_for_its_own_changes(self):
+        url = feed_url('teacher', self.teacher)
+        body = self.client.get(url).content.decode()
+        self.assertEqual(body.count('BEGIN:VEVENT'), Lesson.objects.filter(teacher=self.teacher).count())
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=', body)
+
+        # Another teacher's lesson changing leaves this feed cached
+        other = Lesson.objects.exclude(teacher=self.teacher).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        with QueryCounter() as counter:
+            self.assertEqual(self.client.get(url).content.decode(), body)
+        self.assertEqual(counter.count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.delete()
+        self.assertEqual(self.client.get(url).content.decode().count('BEGIN:VEVENT'), body.count('BEGIN:VEVENT') - 1)
+
+        self.assertEqual(self.client.get(url.replace('teacher', 'room')).status_code, 404)
+
+    def test_reset_feed_key_revokes_calendar_links(self):
+        url = feed_url('teacher', self.teacher)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            new_url = reset_feed_key('teacher', self.teacher)
+        self.assertNotEqual(new_url, url)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(new_url).status_code, 200)
+        # Other teachers' links are untouched
+        other = Teacher.objects.exclude(pk=self.teacher.pk).first()
+        self.assertEqual(self.client.get(feed_url('teacher', other)).status_code, 200)
+
+    def test_all_timetables_archive(self):
+        self.client.force_login(self.secretary)
+        response = self.client.get(reverse('export_all_timetables'))
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        names = archive.namelist()
+        self.assertEqual(names[0], 'full_schedule.csv')
+        self.assertEqual(len(names), 1 + Teacher.objects.count() + ClassGroup.objects.count() + Room.objects.count())
+        teacher_file = next(name for name in names if name.endswith(f"-{self.teacher.pk}.csv") and 'teachers/' in name)
+        rows = archive.read(teacher_file).decode().splitlines()
+        self.assertEqual(len(rows) - 1, Lesson.objects.filter(teacher=self.teacher).count())
+
+        # Served from the cache until a stage changes
+        with QueryCounter() as counter:
+            self.assertEqual(self.client.get(reverse('export_all_timetables')).content, response.content)
+        self.assertLessEqual(counter.count, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.delete()
+        self.assertNotEqual(self.client.get(reverse('export_all_timetables')).content, response.content)
+
+    @override_settings(DEBUG=True)
+    def test_middleware_reports_query_count(self):
+        self.client.force_login(self.secretary)
+        response = self.client.get(reverse('home'))
+        self.assertTrue(response['X-Query-Count'].isdigit())
+        self.assertTrue(response['X-Query-Time'].endswith('ms'))
+
+
+
+class SyntheticSchoolTests(TestCase):
+
+    def test_seed_rejects_a_prefix_in_use(self):
+        options = dict(synthetic=True, stages=1, teachers=3, rooms=3, class_groups=3, periods_per_day=2,
+                       seed=1, prefix='Bench', stdout=io.StringIO())
+        call_command('seed_school', **options)
+        lessons = Lesson.objects.count()
+        with self.assertRaisesMessage(CommandError, 'Bench Stage 1'):
+            call_command('seed_school', **options)
+        self.assertEqual(Lesson.objects.count(), lessons)
+
+    def test_periods_must_end_before_midnight(self):
+        self.assertEqual(period_times(2)[-1], (time(9), time(9, 50)))
+        with self.assertRaises(ValidationError):
+            period_times(17)
+        with self.assertRaises(ValidationError):
+            generate_school(stages=1, teachers=0)
+        self.assertFalse(Stage.objects.exists())
+
+    def test_benchmark_leaves_the_database_untouched(self):
+        generate_school(stages=1, teachers=3, rooms=3, class_groups=3, periods_per_day=2, seed=1)
+        memberships = User.groups.through.objects.count()
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'benchmark.json')
+            call_command('benchmark', runs=1, validations=5, output=output, stdout=io.StringIO())
+            self.assertTrue(os.path.getsize(output))
+        self.assertFalse(User.objects.filter(username='benchmark-secretary').exists())
+        self.assertEqual(User.groups.through.objects.count(), memberships)
+
+
+class BellScheduleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        cls.bells = BellSchedule.objects.create(name='Standard Day')
+        for hour in (8, 9, 10, 11):
+            BellPeriod.objects.create(bell_schedule=cls.bells, start_time=time(hour), end_time=time(hour, 50))
+
+    def test_find_overlaps(self):
+        intervals = [(time(9), time(10)), (time(8), time(12)), (time(12), time(13))]
+        self.assertEqual(find_overlaps(intervals), [((time(8), time(12)), (time(9), time(10)))])
+
+    def test_expand_creates_missing_slots_in_constant_queries(self):
+        TimeSlot.objects.create(stage=self.stage, day='Monday', start_time=time(8), end_time=time(8, 50))
+        with QueryCounter() as counter:
+            created = expand_bell_schedule(self.bells, self.stage)
+        self.assertEqual(created, 4 * len(DAYS) - 1)
+        self.assertEqual(TimeSlot.objects.filter(stage=self.stage).count(), 4 * len(DAYS))
+        self.assertLess(counter.count, 10)
+
+    def test_expand_rejects_overlapping_slots(self):
+        TimeSlot.objects.create(stage=self.stage, day='Tuesday', start_time=time(8, 30), end_time=time(9, 20))
+        with self.assertRaises(ValidationError):
+            expand_bell_schedule(self.bells, self.stage)
+        self.assertEqual(TimeSlot.objects.filter(stage=self.stage).count(), 1)
+
+    def test_retime_moves_slots_and_keeps_lessons(self):
+        seed_stage(self.stage, 'Year 1', class_groups=2, teachers=2, rooms=2, periods=4, first_hour=13)
+        lessons = Lesson.objects.filter(stage=self.stage).count()
+        self.assertEqual(retime_stage(self.bells, self.stage), 4 * len(DAYS))
+        self.assertEqual(
+            sorted(set(TimeSlot.objects.filter(stage=self.stage).values_list('start_time', flat=True))),
+            [time(8), time(9), time(10), time(11)],
+        )
+        self.assertEqual(Lesson.objects.filter(stage=self.stage).count(), lessons)
+
+    def test_retime_shifts_slots_onto_each_others_times(self):
+        # 9/10/11 become 10/11/12: each slot takes the next one's old times
+        for hour in (9, 10, 11):
+            TimeSlot.objects.create(stage=self.stage, day='Monday', start_time=time(hour), end_time=time(hour, 50))
+        later = BellSchedule.objects.create(name='Late Start')
+        for hour in (10, 11, 12):
+            BellPeriod.objects.create(bell_schedule=later, start_time=time(hour), end_time=time(hour, 50))
+        self.assertEqual(retime_stage(later, self.stage, days=['Monday']), 3)
+        self.assertEqual(
+            list(TimeSlot.objects.filter(stage=self.stage).order_by('start_time').values_list('start_time', flat=True)),
+            [time(10), time(11), time(12)],
+        )
+
+
+class LessonStageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        cls.other = Stage.objects.create(name='Secondary')
+        seed_stage(cls.stage, 'Year 1', class_groups=2, teachers=2, rooms=2, periods=1)
+        seed_stage(cls.other, 'Year 7', class_groups=2, teachers=2, rooms=2, periods=1)
+
+    def lesson(self, **overrides):
+        existing = Lesson.objects.filter(stage=self.stage).first()
+        lesson = Lesson(
+            teacher_id=existing.teacher_id,
+            subject_id=existing.subject_id,
+            room_id=existing.room_id,
+            class_group_id=existing.class_group_id,
+            timeslot=TimeSlot.objects.create(stage=self.stage, day='Monday', start_time=time(15), end_time=time(15, 50)),
+        )
+        for field, value in overrides.items():
+            setattr(lesson, field, value)
+        return lesson
+
+    def test_stage_is_set_from_related_entities(self):
+        lesson = self.lesson()
+        lesson.save()
+        self.assertEqual(Lesson.objects.get(pk=lesson.pk).stage_id, self.stage.pk)
+
+    def test_mixed_stages_are_rejected(self):
+        lesson = self.lesson(room=Room.objects.filter(stage=self.other).first())
+        with self.assertRaises(ValidationError):
+            lesson.save()
+
+    def test_related_stages_fetched_in_one_query(self):
+        lesson = Lesson.objects.get(pk=Lesson.objects.filter(stage=self.stage).first().pk)
+        with QueryCounter() as counter:
+            stage_ids = lesson.related_stage_ids()
+        self.assertEqual(set(stage_ids.values()), {self.stage.pk})
+        self.assertEqual(counter.count, 1)
+
+    def test_entities_with_lessons_keep_their_stage(self):
+        teacher = Teacher.objects.filter(stage=self.stage, lesson__isnull=False).first()
+        teacher.stage = self.other
+        with self.assertRaises(ValidationError):
+            teacher.save()
+        with self.assertRaises(ValidationError):
+            teacher.full_clean()
+        self.assertEqual(Teacher.objects.get(pk=teacher.pk).stage, self.stage)
+
+        # Once its lessons are gone it can move
+        Lesson.objects.filter(teacher=teacher).delete()
+        teacher.save()
+        self.assertEqual(Teacher.objects.get(pk=teacher.pk).stage, self.other)
+
+
+class ScheduleOrderingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        seed_stage(cls.stage, 'Year 1', class_groups=2, teachers=2, rooms=2, periods=2)
+        cls.secretary = User.objects.create_user('secretary', password='x', is_staff=True)
+        cls.secretary.groups.add(Group.objects.create(name='Secretaries'))
+
+    def test_lessons_are_listed_in_week_order(self):
+        self.client.force_login(self.secretary)
+        response = self.client.get(reverse('admin_schedule'))
+        days = [lesson.timeslot.day for lesson in response.context['lessons']]
+        self.assertEqual(list(dict.fromkeys(days)), DAYS)
+
+        response = self.client.get(reverse('export_schedule_csv'))
+        rows = b''.join(response.streaming_content).decode().splitlines()[1:]
+        self.assertEqual(list(dict.fromkeys(row.split(',')[1] for row in rows)), DAYS)
+
+
+class AsyncURLConf:
+    # The project's URLs as served with ASYNC_READ_VIEWS on
+    urlpatterns = [path('', include(async_urlpatterns))] + project_urls.urlpatterns
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncReadViewTests(QueryBudgetTests):
+    """
+    The async read views, run through the async middleware stack, match the
+    sync ones and stay within the same budgets.
+    """
+
+    def pages(self):
+        return [page for page in super().pages() if resolve(page[2]).func.__module__.endswith('async_views')]
+
+    def count_queries(self, user, method, url, data, status=200):
+        return async_to_sync(self.acount_queries)(user, method, url, data, status)
+
+    async def acount_queries(self, user, method, url, data, status=200):
+        await sync_to_async(self.async_client.force_login)(user)
+        await cache.aclear()
+        async with QueryCounter() as counter:
+            response = await getattr(self.async_client, method)(url, data)
+            if response.streaming:
+                [chunk async for chunk in response.streaming_content]
+        self.assertEqual(response.status_code, status, url)
+        return counter.count
+
+    def test_pages_are_async(self):
+        self.assertEqual(len(self.pages()), 8)
+
+    async def test_async_export_matches_sync(self):
+        await sync_to_async(self.async_client.force_login)(self.teacher.user)
+        response = await self.async_client.get(reverse('export_teacher_schedule_csv'))
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        with override_settings(ROOT_URLCONF='school_scheduling.urls'):
+            await sync_to_async(self.client.force_login)(self.teacher.user)
+            sync_response = await sync_to_async(self.client.get)(reverse('export_teacher_schedule_csv'))
+            sync_body = await sync_to_async(lambda: b''.join(sync_response.streaming_content).decode())()
+        self.assertEqual(body, sync_body)
+        self.assertEqual(body.count('\n') - 1, await Lesson.objects.filter(teacher=self.teacher).acount())
+
+
+class CoverFinderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        # Four teachers over two class groups: two teachers are free each period
+        seed_stage(cls.stage, 'Year 1', class_groups=2, teachers=4, rooms=2, periods=3)
+
+    def setUp(self):
+        # Occupancy indexes are keyed on the cached stage version
+        cache.clear()
+
+    def test_free_teachers_ranked_by_subject_then_load(self):
+        absent = Teacher.objects.filter(stage=self.stage).first()
+        cover = find_cover(absent, 0)
+        lessons = Lesson.objects.filter(teacher=absent, timeslot__weekday=0)
+        self.assertEqual([entry['lesson'] for entry in cover], list(lessons.order_by('timeslot__start_time')))
+
+        for entry in cover:
+            busy = set(Lesson.objects.filter(timeslot=entry['lesson'].timeslot).values_list('teacher_id', flat=True))
+            candidates = entry['candidates']
+            self.assertTrue(candidates)
+            self.assertFalse(busy & {candidate['teacher'].pk for candidate in candidates})
+            keys = [(not c['teaches_subject'], c['day_load'], c['week_load']) for c in candidates]
+            self.assertEqual(keys, sorted(keys))
+
+    def test_occupancy_tracks_lesson_moves(self):
+        lesson = Lesson.objects.filter(stage=self.stage).first()
+        other_slot = TimeSlot.objects.filter(stage=self.stage).exclude(
+            lesson__teacher=lesson.teacher
+        ).first()
+        occupancy = get_occupancy(self.stage.pk)
+        self.assertFalse(occupancy.is_free(lesson.teacher_id, lesson.timeslot_id))
+
+        old_slot = lesson.timeslot_id
+        lesson.timeslot = other_slot
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.filter(timeslot=other_slot, class_group=lesson.class_group).delete()
+            Lesson.objects.filter(timeslot=other_slot, room=lesson.room).delete()
+            lesson.save()
+        occupancy = get_occupancy(self.stage.pk)
+        self.assertTrue(occupancy.is_free(lesson.teacher_id, old_slot))
+        self.assertFalse(occupancy.is_free(lesson.teacher_id, other_slot.pk))
+
+
+class AvailabilityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        seed_stage(cls.stage, 'Year 2', class_groups=2, teachers=4, rooms=3, periods=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_search_matches_lessons(self):
+        teacher, other = Teacher.objects.filter(stage=self.stage)[:2]
+        room = Room.objects.filter(stage=self.stage).first()
+        result = search(self.stage.pk, resources={'teacher': [teacher.pk, other.pk], 'room': [room.pk]}, weekday=1)
+
+        booked = Lesson.objects.filter(Q(teacher__in=[teacher, other]) | Q(room=room))
+        expected = TimeSlot.objects.filter(stage=self.stage, weekday=1).exclude(lesson__in=booked)
+        self.assertEqual([slot[0] for slot in result['free_slots']], list(expected.values_list('pk', flat=True)))
+
+        timeslots = list(TimeSlot.objects.filter(stage=self.stage, weekday=0).values_list('pk', flat=True)[:2])
+        result = search(self.stage.pk, timeslots=timeslots)
+        busy_rooms = Lesson.objects.filter(timeslot__in=timeslots).values_list('room_id', flat=True)
+        free_rooms = Room.objects.filter(stage=self.stage).exclude(pk__in=busy_rooms)
+        self.assertEqual({pk for pk, _ in result['free']['room']}, set(free_rooms.values_list('pk', flat=True)))
+
+
+class RepairTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        # One spare room and teacher per period, and no lessons after 10:00
+        seed_stage(cls.stage, 'Year 3', class_groups=2, teachers=3, rooms=3, periods=2)
+        TimeSlot.objects.create(stage=cls.stage, day='Monday', start_time=time(11), end_time=time(11, 50))
+
+    def setUp(self):
+        cache.clear()
+
+    def apply(self, plan, delete=False):
+        with self.captureOnCommitCallbacks(execute=True):
+            return apply_repair(plan, delete=delete)
+
+    def test_removed_room_keeps_every_lesson(self):
+        room = Room.objects.filter(stage=self.stage, lesson__isnull=False).first()
+        lessons = Lesson.objects.filter(stage=self.stage).count()
+        plan = plan_repair(self.stage.pk, 'room', room.pk)
+
+        # A free room exists in every slot, so nothing else has to move
+        self.assertEqual(plan['unplaced'], [])
+        self.assertEqual(len(plan['moves']), room.lesson_set.count())
+        self.assertTrue(all(before[0] == after[0] for _, before, after, _ in plan['moves']))
+
+        self.assertEqual(self.apply(plan, delete=True), len(plan['moves']))
+        self.assertFalse(Room.objects.filter(pk=room.pk).exists())
+        self.assertEqual(Lesson.objects.filter(stage=self.stage).count(), lessons)
+
+    def test_unavailable_teacher_moves_to_free_slot(self):
+        lesson = Lesson.objects.filter(stage=self.stage, timeslot__weekday=0).first()
+        timeslot_id = lesson.timeslot_id
+        plan = plan_repair(self.stage.pk, 'teacher', lesson.teacher_id, [timeslot_id])
+        self.apply(plan)
+
+        lesson.refresh_from_db()
+        self.assertNotEqual(lesson.timeslot_id, timeslot_id)
+        self.assertFalse(
+            Lesson.objects.filter(teacher_id=plan['resource'], timeslot_id__in=plan['timeslots']).exists()
+        )
+        # Planned against the old schedule, the same moves no longer apply
+        with self.assertRaises(RepairConflict):
+            self.apply(plan)
+
+    def test_taken_destination_is_a_conflict(self):
+        lesson = Lesson.objects.filter(stage=self.stage, timeslot__weekday=0).first()
+        plan = plan_repair(self.stage.pk, 'teacher', lesson.teacher_id, [lesson.timeslot_id])
+        pk, before, after, _ = plan['moves'][0]
+        moving = Lesson.objects.get(pk=pk)
+        # Another lesson for the same class group lands where the move goes
+        Lesson.objects.create(
+            teacher=Teacher.objects.filter(stage=self.stage).exclude(pk=after[1]).first(),
+            room=Room.objects.filter(stage=self.stage).exclude(pk=after[2]).first(),
+            class_group_id=moving.class_group_id,
+            subject_id=moving.subject_id,
+            timeslot_id=after[0],
+        )
+        with self.assertRaises(RepairConflict):
+            self.apply(plan)
+        moving.refresh_from_db()
+        self.assertEqual([moving.timeslot_id, moving.teacher_id, moving.room_id], list(before))
+
+
+class DraftScheduleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        seed_stage(cls.stage, 'Year 4', class_groups=2, teachers=3, rooms=3, periods=2)
+
+    def live(self):
+        return set(Lesson.objects.filter(stage=self.stage).values_list('teacher', 'room', 'class_group', 'timeslot'))
+
+    def drafted(self, draft):
+        return set(draft.lessons.values_list('teacher', 'room', 'class_group', 'timeslot'))
+
+    def test_clone_diff_publish(self):
+        with self.assertNumQueries(4):
+            draft = create_draft(self.stage, 'Next term')
+        self.assertEqual(self.drafted(draft), self.live())
+        self.assertEqual(draft_diff(draft), {'added': [], 'removed': [], 'changed': []})
+
+        first, second = draft.lessons.order_by('timeslot', 'class_group')[:2]
+        first.delete()
+        second.room = Room.objects.filter(stage=self.stage).exclude(pk=second.room_id).exclude(
+            pk__in=draft.lessons.filter(timeslot=second.timeslot_id).values('room')
+        ).first()
+        second.save()
+        kept = Lesson.objects.get(class_group=second.class_group_id, timeslot=second.timeslot_id).pk
+
+        diff = draft_diff(draft)
+        self.assertEqual(len(diff['removed']), 1)
+        self.assertEqual(diff['added'], [])
+        self.assertEqual([(before['room_id'], after['room_id']) for before, after in diff['changed']],
+                         [(Lesson.objects.get(pk=kept).room_id, second.room_id)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(publish_draft(draft), (2, 1))
+        self.assertEqual(self.live(), self.drafted(draft))
+        self.assertFalse(Lesson.objects.filter(pk=kept).exists())
+
+        copy = create_draft(self.stage, 'Copy', source=draft)
+        self.assertEqual(self.drafted(copy), self.drafted(draft))
+
+    def test_draft_lesson_stays_in_stage(self):
+        draft = create_draft(self.stage, 'Next term')
+        lesson = draft.lessons.first()
+        other = Stage.objects.create(name='Secondary')
+        lesson.room = Room.objects.create(stage=other, name='Lab')
+        with self.assertRaises(ValidationError):
+            lesson.save()
+
+
+class OccurrenceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        # Teacher 2 is free every Monday, so they can cover
+        seed_stage(cls.stage, 'Year 5', class_groups=2, teachers=3, rooms=3, periods=1)
+        Term.objects.create(stage=cls.stage, name='Autumn', start_date=date(2026, 9, 1), end_date=date(2026, 12, 18))
+        Holiday.objects.create(name='Founders Day', start_date=date(2026, 11, 4), end_date=date(2026, 11, 4))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_school_days_skip_weekends_holidays_and_gaps(self):
+        days = list(school_days(self.stage.pk, date(2026, 11, 2), date(2026, 11, 8)))
+        self.assertEqual(days, [date(2026, 11, 2), date(2026, 11, 3), date(2026, 11, 5), date(2026, 11, 6)])
+        self.assertEqual(list(school_days(self.stage.pk, date(2026, 12, 19), date(2027, 1, 3))), [])
+
+    def test_overrides_layer_on_weekly_lessons(self):
+        monday = date(2026, 11, 2)
+        cancelled, covered = Lesson.objects.filter(stage=self.stage, timeslot__weekday=0).order_by('class_group')
+        busy = {cancelled.teacher_id, covered.teacher_id}
+        cover = Teacher.objects.filter(stage=self.stage).exclude(pk__in=busy).get()
+        LessonOverride.objects.create(lesson=cancelled, date=monday, cancelled=True)
+        LessonOverride.objects.create(lesson=covered, date=monday, teacher=cover, note='Trip')
+
+        with self.assertNumQueries(5):
+            day = list(occurrences('class_group', covered.class_group_id, monday, monday))
+        self.assertEqual([(entry['lesson'], entry['teacher'], entry['note']) for entry in day],
+                         [(covered, cover, 'Trip')])
+
+        # The cover moves the occurrence from one teacher's day to the other's
+        self.assertEqual([entry['lesson'] for entry in occurrences('teacher', cover.pk, monday, monday)], [covered])
+        self.assertEqual(list(occurrences('teacher', covered.teacher_id, monday, monday)), [])
+        self.assertTrue(next(occurrences('class_group', cancelled.class_group_id, monday, monday))['cancelled'])
+
+        # Four weeks of Mondays to Fridays, without the holiday
+        weeks = list(occurrences('class_group', covered.class_group_id, date(2026, 11, 2), date(2026, 11, 29)))
+        self.assertEqual(len(weeks), 19)
+
+        # A teacher cannot cover two lessons at the same time
+        with self.assertRaises(ValidationError):
+            LessonOverride.objects.create(lesson=cancelled, date=monday, teacher=cover)
+
+
+class TimetableReportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        # One teacher and class group in every period; then free periods 2 and 3 on Monday
+        seed_stage(cls.stage, 'Year 6', class_groups=1, teachers=1, rooms=1, periods=5)
+        Lesson.objects.filter(stage=cls.stage, timeslot__weekday=0, timeslot__start_time__in=[time(9), time(10)]).delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_metrics_and_violations(self):
+        report = build_report(self.stage, report_limits(max_gaps=1, max_consecutive=4, max_daily=6, max_subject_daily=1))
+        self.assertEqual(report['lessons'], 23)
+        for kind in ('teacher', 'class_group'):
+            self.assertEqual(report['summary'][kind]['gaps'], 2)
+            self.assertEqual(report['summary'][kind]['longest_run'], 5)
+            self.assertEqual(report['summary'][kind]['max_daily'], 5)
+        self.assertEqual(report['summary']['subject_spread']['clustered'], 0)
+
+        violations = {(v['kind'], v['day'], v['metric'], v['value']) for v in report['violations']}
+        expected = {(kind, 'Monday', 'gaps', 2) for kind in ('teacher', 'class_group')}
+        expected |= {(kind, day, 'longest_run', 5) for kind in ('teacher', 'class_group') for day in DAYS[1:]}
+        self.assertEqual(violations, expected)
+
+    def test_stage_without_timeslots(self):
+        stage = Stage.objects.create(name='Nursery')
+        ClassGroup.objects.create(stage=stage, name='Ducklings')
+        Teacher.objects.create(user=User.objects.create_user('nursery-teacher'), stage=stage)
+        report = build_report(stage)
+        self.assertEqual(report['lessons'], 0)
+        self.assertEqual(report['violations'], [])
+        for kind in ('teacher', 'class_group'):
+            self.assertEqual(report['summary'][kind]['entities'], 1)
+            self.assertEqual(report['summary'][kind]['gaps'], 0)
+
+
+class UtilisationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        # 20 timeslots of 50 minutes, two class groups in each
+        seed_stage(cls.stage, 'Year 3', class_groups=2, teachers=3, rooms=4, periods=4)
+        rebuild_utilisation([cls.stage.pk])
+
+    def setUp(self):
+        cache.clear()
+
+    def summary(self):
+        # Rows emptied by the signals stay at zero; a rebuild drops them
+        rows = UtilisationSummary.objects.filter(periods__gt=0)
+        return sorted(rows.values_list('kind', 'entity_id', 'weekday', 'periods', 'minutes'))
+
+    def test_signals_match_rebuild(self):
+        lesson = Lesson.objects.filter(stage=self.stage).first()
+        # Nobody has a lesson in the new timeslot, so its rows are created
+        lesson.timeslot = TimeSlot.objects.create(stage=self.stage, day='Friday', start_time=time(16), end_time=time(16, 30))
+        lesson.save()
+        Lesson.objects.filter(stage=self.stage).exclude(pk=lesson.pk).last().delete()
+        moved = Lesson.objects.filter(stage=self.stage).exclude(pk=lesson.pk)[1]
+        moved.room = Room.objects.create(stage=self.stage, name='Annexe')
+        moved.save()
+
+        incremental = self.summary()
+        rebuild_utilisation([self.stage.pk])
+        self.assertEqual(incremental, self.summary())
+
+        # Re-timing a timeslot changes the minutes of its lessons
+        friday = UtilisationSummary.objects.filter(kind='teacher', entity_id=lesson.teacher_id, weekday=4)
+        minutes = friday.get().minutes
+        lesson.timeslot.end_time = time(17)
+        lesson.timeslot.save()
+        self.assertEqual(friday.get().minutes, minutes + 30)
+
+    def test_bulk_deletes_rebuild_each_stage_once(self):
+        draft = create_draft(self.stage, 'Short week')
+        draft.lessons.filter(timeslot__weekday__gte=2).delete()
+        removed = Lesson.objects.filter(stage=self.stage, timeslot__weekday__gte=2).count()
+        with QueryCounter() as counter:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(publish_draft(draft), (removed, 0))
+        # Not two queries per removed lesson
+        self.assertLess(counter.count, removed)
+        incremental = self.summary()
+        rebuild_utilisation([self.stage.pk])
+        self.assertEqual(incremental, self.summary())
+
+        # A cascade has no bulk change to rely on, so it rebuilds on commit
+        room = Room.objects.filter(stage=self.stage, lesson__isnull=False).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            room.delete()
+        incremental = self.summary()
+        rebuild_utilisation([self.stage.pk])
+        self.assertEqual(incremental, self.summary())
+
+    def test_figures(self):
+        data = utilisation(self.stage)
+        self.assertEqual(data['slots'], 20)
+        self.assertEqual(sum(teacher['periods'] for teacher in data['teacher']), 40)
+        self.assertEqual([room['occupancy'] for room in data['room']], [50, 50, 50, 50])
+        self.assertEqual([subject['hours'] for subject in data['subject']], [6.7] * 5)
+        self.assertEqual(data['room'][0]['days'][0], {'periods': 2, 'share': 0.5})
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    Routing decisions only: the test database has no replica, so a query
+    sent to one would fail with ConnectionDoesNotExist.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        seed_stage(cls.stage, 'Year 1', class_groups=1, teachers=1, rooms=1, periods=1)
+        cls.secretary = User.objects.create_user('secretary', password='x', is_staff=True)
+        cls.secretary.groups.add(Group.objects.create(name='Secretaries'))
+
+    def read_view(self, write=False):
+        @replica_reads
+        def view(request):
+            if write:
+                Stage.objects.create(name='Secondary')
+            return HttpResponse(ReplicaRouter().db_for_read(Lesson))
+        return ReplicaPinMiddleware(view)
+
+    def test_routing(self):
+        request = RequestFactory().get('/')
+        self.assertEqual(self.read_view()(request).content, b'default')
+        with override_settings(REPLICA_DATABASE='replica'):
+            self.assertEqual(ReplicaRouter().db_for_read(Lesson), 'default')
+            self.assertEqual(self.read_view()(request).content, b'replica')
+
+            # Reads after a write in the same request stay on the primary
+            response = self.read_view(write=True)(request)
+            self.assertEqual(response.content, b'default')
+            self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+
+            request.COOKIES[PIN_COOKIE] = '1'
+            self.assertEqual(self.read_view()(request).content, b'default')
+
+    def test_client_pinned_after_write(self):
+        self.client.force_login(self.secretary)
+        lesson = Lesson.objects.first()
+        with override_settings(REPLICA_DATABASE='replica'):
+            response = self.client.post(reverse('delete_lesson', args=[lesson.pk]))
+            self.assertIn(PIN_COOKIE, response.cookies)
+            # Pinned, so the routed page reads the primary
+            self.assertEqual(self.client.get(reverse('admin_schedule')).status_code, 200)
+
+        # No replica, no cookie
+        self.client.cookies.pop(PIN_COOKIE)
+        response = self.client.post(reverse('delete_lesson', args=[Lesson.objects.first().pk]))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_draft_copies_run_on_the_primary(self):
+        @replica_reads
+        def view(request, name, source=None):
+            return HttpResponse(create_draft(self.stage, name, source=source).pk)
+
+        request = RequestFactory().get('/')
+        with override_settings(REPLICA_DATABASE='replica'):
+            draft = DraftSchedule.objects.get(pk=int(view(request, 'Draft').content))
+            self.assertEqual(draft.lessons.count(), Lesson.objects.filter(stage=self.stage).count())
+            copy = DraftSchedule.objects.get(pk=int(view(request, 'Copy', source=draft).content))
+            self.assertEqual(copy.lessons.count(), draft.lessons.count())
+
+
+class LessonEditorTests(TestCase):
+    """
+    The fragments and JSON the Create Schedule page's script uses.
+    """
+    ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stage = Stage.objects.create(name='Primary')
+        seed_stage(cls.stage, 'Year 1', class_groups=1, teachers=2, rooms=2, periods=2)
+        rebuild_utilisation()
+        cls.secretary = User.objects.create_user('secretary', password='x')
+        cls.secretary.groups.add(Group.objects.create(name='Secretaries'))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.secretary)
+
+    def test_stage_options(self):
+        url = reverse('api_stage_options', args=[self.stage.pk])
+        response = self.client.get(url)
+        options = response.json()['options']
+        self.assertEqual(set(options), {'class_group', 'subject', 'room', 'teacher', 'timeslot'})
+        self.assertEqual(len(options['timeslot']), 10)
+        self.assertIn({'id': Room.objects.first().pk, 'label': str(Room.objects.first())}, options['room'])
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('api_stage_options', args=[0])).status_code, 404)
+
+    def test_add_edit_and_delete_return_fragments(self):
+        lesson = Lesson.objects.first()
+        # A second lesson for the class group's first timeslot
+        data = {
+            'stage': self.stage.pk, 'save_lesson': '', 'class_group': lesson.class_group_id,
+            'subject': lesson.subject_id, 'room': lesson.room_id, 'teacher': lesson.teacher_id,
+            'timeslot': lesson.timeslot_id,
+        }
+        response = self.client.post(reverse('create_schedule'), data, **self.ajax)
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'errorlist', status_code=400)
+        self.assertNotContains(response, '<table', status_code=400)
+
+        slot = TimeSlot.objects.create(stage=self.stage, day='Monday', start_time=time(15), end_time=time(15, 50))
+        response = self.client.post(reverse('create_schedule'), {**data, 'timeslot': slot.pk}, **self.ajax)
+        added = Lesson.objects.get(timeslot=slot)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.content.decode().startswith(f'<tr id="lesson-{added.pk}"'))
+
+        response = self.client.get(reverse('edit_lesson', args=[added.pk]), **self.ajax)
+        self.assertContains(response, 'name="timeslot"')
+        self.assertNotContains(response, '<html')
+        response = self.client.post(
+            reverse('edit_lesson', args=[added.pk]), {**data, 'timeslot': slot.pk, 'room': Room.objects.last().pk},
+            **self.ajax,
+        )
+        self.assertContains(response, f'id="lesson-{added.pk}"')
+        self.assertContains(response, Room.objects.last().name)
+
+        response = self.client.post(reverse('delete_lesson', args=[added.pk]), **self.ajax)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Lesson.objects.filter(pk=added.pk).exists())
+        # No message is left behind for the next full page
+        self.assertNotContains(self.client.get(reverse('home')), 'successfully')
 
-# Create your tests here.
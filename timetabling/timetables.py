@@ -0,0 +1,111 @@
+"""
+Weekly timetable grids (day x period) for a stage, teacher, class group or
+room.
+
+Grid data is cached under the stage's version counter (caching.py), which
+the receivers in signals.py bump whenever a lesson or any of the stage's
+timeslots, rooms, class groups, subjects or teachers change. A read is a
+cache hit until that stage is touched, and only that stage is recomputed.
+"""
+from django.core.cache import cache
+from timetabling.models import Lesson, TimeSlot, Stage, Teacher, ClassGroup, Room
+from .caching import stage_version
+
+
+GRID_CACHE_TIMEOUT = 60 * 60 * 24
+
+# kind -> (model, Lesson lookup for one entity)
+GRID_KINDS = {
+    'stage': (Stage, 'stage_id'),
+    'teacher': (Teacher, 'teacher_id'),
+    'class_group': (ClassGroup, 'class_group_id'),
+    'room': (Room, 'room_id'),
+}
+
+
+def entity_stage_id(kind, entity):
+    return entity.pk if kind == 'stage' else entity.stage_id
+
+
+def entity_stage_cache_key(kind, pk):
+    return f"timetabling:entity-stage:{kind}:{pk}"
+
+
+def cached_entity_stage_id(kind, pk):
+    """
+    Return the stage id of an entity by primary key, or None if it does not
+    exist, without loading the entity. Cached (and cleared by signals.py)
+    so a conditional request can be answered from the cache alone.
+    """
+    key = entity_stage_cache_key(kind, pk)
+    stage_id = cache.get(key)
+    if stage_id is None:
+        model = GRID_KINDS[kind][0]
+        stage_id = model.objects.filter(pk=pk).values_list('pk' if kind == 'stage' else 'stage_id', flat=True).first()
+        if stage_id is not None:
+            cache.set(key, stage_id, GRID_CACHE_TIMEOUT)
+    return stage_id
+
+
+def grid_cache_key(kind, pk, version):
+    return f"timetabling:grid:{kind}:{pk}:{version}"
+
+
+def build_grid(kind, entity):
+    """
+    Return ``{'days': [...], 'rows': [...]}`` where each row is a period
+    with one cell per day. A cell is None when the stage has no timeslot
+    there, otherwise a (possibly empty) list of lesson dicts.
+    """
+    stage_id = entity_stage_id(kind, entity)
+    days = [day for day, _ in TimeSlot.DAY_CHOICES]
+    slots = TimeSlot.objects.filter(stage_id=stage_id).values_list('id', 'weekday', 'start_time', 'end_time')
+
+    periods = sorted({(start_time, end_time) for _, _, start_time, end_time in slots})
+    period_index = {period: i for i, period in enumerate(periods)}
+    cells = [[None] * len(days) for _ in periods]
+    slot_cell = {}
+    for slot_id, weekday, start_time, end_time in slots:
+        row, column = period_index[(start_time, end_time)], weekday
+        cells[row][column] = []
+        slot_cell[slot_id] = (row, column)
+
+    lessons = Lesson.objects.filter(**{GRID_KINDS[kind][1]: entity.pk}).values_list(
+        'timeslot_id', 'subject__name', 'class_group__name', 'room__name',
+        'teacher__user__first_name', 'teacher__user__last_name', 'teacher__user__username',
+    )
+    for timeslot_id, subject, class_group, room, first_name, last_name, username in lessons:
+        row, column = slot_cell[timeslot_id]
+        cells[row][column].append({
+            'subject': subject,
+            'class_group': class_group,
+            'room': room,
+            'teacher': f"{first_name} {last_name}".strip() or username,
+        })
+
+    for row in cells:
+        for cell in row:
+            if cell:
+                cell.sort(key=lambda lesson: lesson['class_group'])
+
+    return {
+        'days': days,
+        'rows': [
+            {'start': start_time.strftime('%H:%M'), 'end': end_time.strftime('%H:%M'), 'cells': row}
+            for (start_time, end_time), row in zip(periods, cells)
+        ],
+    }
+
+
+def get_grid(kind, entity, version=None):
+    """
+    Return the cached grid for an entity, building it on a miss.
+    """
+    if version is None:
+        version = stage_version(entity_stage_id(kind, entity))
+    key = grid_cache_key(kind, entity.pk, version)
+    grid = cache.get(key)
+    if grid is None:
+        grid = build_grid(kind, entity)
+        cache.set(key, grid, GRID_CACHE_TIMEOUT)
+    return grid
@@ -1,14 +1,57 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+from . import async_views
+from . import api
+from . import archives
+from . import calendars
 from . import exports
+from . import imports
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('create_schedule/', views.create_schedule, name='create_schedule'),
+    path('generate_schedule/', views.generate_schedule, name='generate_schedule'),
     path('view_schedule/', views.view_schedule, name='view_schedule'),
+    path('timetables/', views.timetable_index, name='timetable_index'),
+    path('cover/', views.cover_finder, name='cover_finder'),
+    path('repair/', views.repair_schedule, name='repair_schedule'),
+    path('report/', views.timetable_report, name='timetable_report'),
+    path('utilisation/', views.utilisation_dashboard, name='utilisation_dashboard'),
+    path('utilisation/heatmap/<str:kind>/', views.utilisation_heatmap, name='utilisation_heatmap'),
+    path('utilisation/csv/', views.export_utilisation_csv, name='export_utilisation_csv'),
+    path('repair/apply/', views.apply_schedule_repair, name='apply_schedule_repair'),
+    path('drafts/', views.draft_schedules, name='draft_schedules'),
+    path('drafts/<int:draft_id>/', views.draft_schedule, name='draft_schedule'),
+    path('drafts/<int:draft_id>/publish/', views.publish_draft_schedule, name='publish_draft_schedule'),
+    path('drafts/<int:draft_id>/delete/', views.delete_draft_schedule, name='delete_draft_schedule'),
+    path('availability/', views.availability, name='availability'),
+    path('timetable/<slug:kind>/<int:pk>/', views.timetable, name='timetable'),
+    path('timetable/<slug:kind>/<int:pk>/day/', views.day_timetable, name='day_timetable'),
     path('admin_schedule/', views.admin_schedule, name='admin_schedule'),
     path('lesson/<int:lesson_id>/edit/', views.edit_lesson, name='edit_lesson'),
     path('delete_lesson/<int:lesson_id>/', views.delete_lesson, name='delete_lesson'),
     path('schedule/export/', exports.export_schedule_csv, name='export_schedule_csv'),
     path('schedule/export/me/', exports.export_teacher_schedule_csv, name='export_teacher_schedule_csv'),
-]
\ No newline at end of file
+    path('schedule/export/all/', archives.export_all_timetables, name='export_all_timetables'),
+    path('schedule/import/', imports.import_schedule_csv, name='import_schedule_csv'),
+    path('api/timetables/<slug:kind>/<int:pk>/', api.api_timetable, name='api_timetable'),
+    path('api/cover/', api.api_cover, name='api_cover'),
+    path('api/availability/', api.api_availability, name='api_availability'),
+    path('api/stages/<int:stage_id>/options/', api.api_stage_options, name='api_stage_options'),
+    path('calendar/<str:token>.ics', calendars.calendar_feed, name='calendar_feed'),
+]
+
+# Async versions of the read-only pages, for ASGI deployments (see README)
+async_urlpatterns = [
+    path('', async_views.home, name='home'),
+    path('view_schedule/', async_views.view_schedule, name='view_schedule'),
+    path('admin_schedule/', async_views.admin_schedule, name='admin_schedule'),
+    path('schedule/export/', async_views.export_schedule_csv, name='export_schedule_csv'),
+    path('schedule/export/me/', async_views.export_teacher_schedule_csv, name='export_teacher_schedule_csv'),
+    path('api/timetables/<slug:kind>/<int:pk>/', async_views.api_timetable, name='api_timetable'),
+]
+
+if settings.ASYNC_READ_VIEWS:
+    # Listed first, so they take over those URLs
+    urlpatterns = async_urlpatterns + urlpatterns
@@ -1,37 +1,71 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib import messages
+from django.core import signing
+from django.http import Http404, HttpResponse
+from django.db import IntegrityError
+from django.db.models import Count
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from timetabling.models import Lesson, TimeSlot, Stage, ClassGroup, Subject, Room, Teacher
-from .forms import LessonForm
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.functional import SimpleLazyObject
+from django.utils.text import slugify
+from timetabling.models import Lesson, TimeSlot, Stage, ClassGroup, Room, Teacher, DraftSchedule
+from .analytics import UTILISATION_HEADER, UTILISATION_KINDS, utilisation, utilisation_rows
+from .availability import availability_search, bind_stage_form
+from .calendars import FEED_KINDS, feed_url
+from .caching import stage_version
+from .decorators import role_required
+from .instrumentation import query_budget
+from .cover import find_cover
+from .drafts import create_draft, draft_diff, publish_draft
+from .exports import csv_response, stream_csv
+from .occurrences import occurrences
+from .forms import LessonForm, GenerateScheduleForm, CoverForm, RepairForm, DraftScheduleForm, ReportForm, UtilisationForm
+from .pagination import filter_lessons, keyset_page
+from .replicas import replica_reads
+from .report import DEFAULT_LIMITS, build_report, report_limits
+from .repair import REPAIR_SALT, RepairConflict, apply_repair, plan_repair, plan_rows
+from .roles import SECRETARIES, TEACHERS
+from .solver import apply_solution, load_problem, solve
+from .timetables import GRID_CACHE_TIMEOUT, GRID_KINDS, entity_stage_id, get_grid
 
 
 # -------------------------
 # Home page
 # -------------------------
+@query_budget(4)
+@replica_reads
 def home(request):
-    user = request.user
-    is_secretary = False
-    is_teacher = False
-
-    if user.is_authenticated:
-        is_secretary = user.groups.filter(name='Secretaries').exists()
-        is_teacher = user.groups.filter(name='Teachers').exists()
-
     return render(request, "timetabling/index.html", {
-        'is_secretary': is_secretary,
-        'is_teacher': is_teacher,
+        'is_secretary': SECRETARIES in request.roles,
+        'is_teacher': TEACHERS in request.roles,
     })
 
 
 # -------------------------
 # Secretaries: create schedule
 # -------------------------
-@login_required
-def create_schedule(request):
-    if not request.user.groups.filter(name='Secretaries').exists():
-        return redirect('home')
+def wants_fragment(request):
+    # The lesson editor's script asks for the changed row or form only
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def lesson_row(request, lesson, status=200):
+    return render(request, "timetabling/partials/lesson_row.html", {'lesson': lesson}, status=status)
+
 
+def lesson_form_fragment(request, form, status=200):
+    return render(request, "timetabling/partials/lesson_form.html", {'form': form}, status=status)
+
+
+# Saving a lesson is the costliest path: choices, unique checks, insert
+# and the utilisation update
+@query_budget(16)
+@role_required(SECRETARIES)
+def create_schedule(request):
     selected_stage = None
     form = None
 
@@ -41,26 +75,21 @@ def create_schedule(request):
         if stage_id and 'select_stage' in request.POST:
             selected_stage = Stage.objects.get(pk=stage_id)
             form = LessonForm()
-            form.fields['class_group'].queryset = ClassGroup.objects.filter(stage_id=stage_id)
-            form.fields['subject'].queryset = Subject.objects.filter(stage_id=stage_id)
-            form.fields['room'].queryset = Room.objects.filter(stage_id=stage_id)
-            form.fields['teacher'].queryset = Teacher.objects.filter(stage_id=stage_id)
-            form.fields['timeslot'].queryset = TimeSlot.objects.filter(stage_id=stage_id)
+            form.limit_to_stage(stage_id)
 
         elif stage_id and 'save_lesson' in request.POST:
             selected_stage = Stage.objects.get(pk=stage_id)
             form = LessonForm(request.POST)
-
-            form.fields['class_group'].queryset = ClassGroup.objects.filter(stage_id=stage_id)
-            form.fields['subject'].queryset = Subject.objects.filter(stage_id=stage_id)
-            form.fields['room'].queryset = Room.objects.filter(stage_id=stage_id)
-            form.fields['teacher'].queryset = Teacher.objects.filter(stage_id=stage_id)
-            form.fields['timeslot'].queryset = TimeSlot.objects.filter(stage_id=stage_id)
+            form.limit_to_stage(stage_id)
 
             if form.is_valid():
-                form.save()
+                lesson = form.save()
+                if wants_fragment(request):
+                    return lesson_row(request, lesson, status=201)
                 messages.success(request, "Lesson added successfully!")  # ✅
                 return redirect('create_schedule')
+            if wants_fragment(request):
+                return lesson_form_fragment(request, form, status=400)
 
         else:
             form = LessonForm()
@@ -72,13 +101,20 @@ def create_schedule(request):
         for field in ['class_group', 'subject', 'room', 'teacher', 'timeslot']:
             form.fields[field].queryset = form.fields[field].queryset.none()
 
-    lessons = Lesson.objects.select_related(
-        'teacher', 'subject', 'room', 'class_group', 'timeslot'
-    ).order_by('timeslot__day', 'timeslot__start_time')
+    # The lesson table follows the stage being edited unless filtered otherwise
+    params = request.GET.copy()
+    if selected_stage and 'stage' not in params:
+        params['stage'] = str(selected_stage.pk)
+
+    lessons, filters = filter_lessons(Lesson.objects.select_related(
+        'stage', 'teacher__user', 'subject', 'room', 'class_group', 'timeslot'
+    ), params)
 
     return render(request, "timetabling/create_schedule.html", {
         'form': form,
-        'lessons': lessons,
+        **keyset_page(lessons, params),
+        'filters': filters,
+        'days': [day for day, _ in TimeSlot.DAY_CHOICES],
         'stages': Stage.objects.all(),
         'selected_stage': selected_stage,
         'teachers': Teacher.objects.select_related('user', 'stage').order_by('user__last_name'),
@@ -89,36 +125,32 @@ def create_schedule(request):
 # -------------------------
 # Secretaries: edit lesson (NEW)
 # -------------------------
-@login_required
+# As create_schedule, plus moving the lesson's utilisation counts
+@query_budget(18)
+@role_required(SECRETARIES)
 def edit_lesson(request, lesson_id):
-    if not request.user.groups.filter(name='Secretaries').exists():
-        return redirect('home')
-
     lesson = get_object_or_404(Lesson, pk=lesson_id)
-    stage_id = lesson.class_group.stage_id
+    stage_id = lesson.stage_id
 
     if request.method == "POST":
         form = LessonForm(request.POST, instance=lesson)
-
-        form.fields['class_group'].queryset = ClassGroup.objects.filter(stage_id=stage_id)
-        form.fields['subject'].queryset = Subject.objects.filter(stage_id=stage_id)
-        form.fields['room'].queryset = Room.objects.filter(stage_id=stage_id)
-        form.fields['teacher'].queryset = Teacher.objects.filter(stage_id=stage_id)
-        form.fields['timeslot'].queryset = TimeSlot.objects.filter(stage_id=stage_id)
+        form.limit_to_stage(stage_id)
 
         if form.is_valid():
-            form.save()
+            lesson = form.save()
+            if wants_fragment(request):
+                return lesson_row(request, lesson)
             messages.success(request, "Lesson updated successfully!")  # ✅
             return redirect('create_schedule')
+        if wants_fragment(request):
+            return lesson_form_fragment(request, form, status=400)
 
     else:
         form = LessonForm(instance=lesson)
-
-        form.fields['class_group'].queryset = ClassGroup.objects.filter(stage_id=stage_id)
-        form.fields['subject'].queryset = Subject.objects.filter(stage_id=stage_id)
-        form.fields['room'].queryset = Room.objects.filter(stage_id=stage_id)
-        form.fields['teacher'].queryset = Teacher.objects.filter(stage_id=stage_id)
-        form.fields['timeslot'].queryset = TimeSlot.objects.filter(stage_id=stage_id)
+        form.limit_to_stage(stage_id)
+        form.hide_booked(lesson.timeslot)
+        if wants_fragment(request):
+            return lesson_form_fragment(request, form)
 
     return render(request, "timetabling/edit_lesson.html", {
         'form': form,
@@ -129,45 +161,355 @@ def edit_lesson(request, lesson_id):
 # -------------------------
 # Teachers: view schedule
 # -------------------------
-@login_required
+@query_budget(5)
+@replica_reads
+@role_required(TEACHERS)
 def view_schedule(request):
-    if not request.user.groups.filter(name='Teachers').exists():
-        return redirect('home')
-
     lessons = Lesson.objects.filter(
-        teacher__user=request.user
-    ).order_by('timeslot__day', 'timeslot__start_time')
+        teacher=request.teacher
+    ).select_related(
+        'subject', 'room', 'class_group', 'timeslot'
+    ).order_by('timeslot__weekday', 'timeslot__start_time')
 
     return render(request, "timetabling/view_schedule.html", {
         'lessons': lessons,
+        'calendar_url': feed_url('teacher', request.teacher) if request.teacher else None,
     })
 
 
 # -------------------------
 # Admin: full schedule
 # -------------------------
+@query_budget(8)
+@replica_reads
 @staff_member_required
 def admin_schedule(request):
-    lessons = Lesson.objects.select_related(
-        'teacher', 'subject', 'room', 'class_group', 'timeslot'
-    ).order_by('timeslot__day', 'timeslot__start_time')
+    lessons, filters = filter_lessons(Lesson.objects.select_related(
+        'stage', 'teacher__user', 'subject', 'room', 'class_group', 'timeslot'
+    ), request.GET)
 
     return render(request, "timetabling/admin_schedule.html", {
-        'lessons': lessons,
+        **keyset_page(lessons, request.GET),
+        'filters': filters,
+        'days': [day for day, _ in TimeSlot.DAY_CHOICES],
+        'stages': Stage.objects.all(),
+        'teachers': Teacher.objects.select_related('user', 'stage').order_by('user__last_name'),
+        'class_groups': ClassGroup.objects.select_related('stage').order_by('stage', 'name'),
     })
 
 
 # -------------------------
 # Secretaries: delete lesson
 # -------------------------
-@login_required
+@role_required(SECRETARIES)
 def delete_lesson(request, lesson_id):
-    if not request.user.groups.filter(name='Secretaries').exists():
-        return redirect('home')
-
-    lesson = get_object_or_404(Lesson, pk=lesson_id)
+    # The utilisation signal reads the loaded timeslot
+    lesson = get_object_or_404(Lesson.objects.select_related('timeslot'), pk=lesson_id)
 
     if request.method == "POST":
         lesson.delete()
+        if wants_fragment(request):
+            # The row just goes
+            return HttpResponse(status=204)
         messages.success(request, "Lesson deleted successfully!")  # ✅
-        return redirect('create_schedule')
\ No newline at end of file
+        return redirect('create_schedule')
+
+
+# -------------------------
+# Secretaries: generate schedule
+# -------------------------
+@role_required(SECRETARIES)
+def generate_schedule(request):
+    if request.method == "POST":
+        form = GenerateScheduleForm(request.POST)
+
+        if form.is_valid():
+            stage = form.cleaned_data['stage']
+            replace = form.cleaned_data['replace']
+            problem = load_problem(stage, replace=replace)
+
+            if not problem['units']:
+                messages.info(request, f"{stage.name} has no unscheduled lesson requirements.")
+                return redirect('generate_schedule')
+
+            # In-process and capped, so a request never forks a pool or
+            # holds its worker for long; solve_timetable runs the full search
+            unplaced_count, _, assignments, _ = solve(problem, restarts=settings.SOLVER_REQUEST_RESTARTS, workers=1)
+            created = apply_solution(stage, assignments, replace=replace)
+
+            if unplaced_count:
+                messages.warning(
+                    request,
+                    f"{created} lessons created for {stage.name}; "
+                    f"{unplaced_count} periods could not be placed."
+                )
+            else:
+                messages.success(request, f"{created} lessons created for {stage.name}!")
+            return redirect('create_schedule')
+
+    else:
+        form = GenerateScheduleForm()
+
+    return render(request, "timetabling/generate_schedule.html", {
+        'form': form,
+    })
+
+
+# -------------------------
+# Secretaries: repair around removed or unavailable resources
+# -------------------------
+@query_budget(12)
+@role_required(SECRETARIES)
+def repair_schedule(request):
+    form = bind_stage_form(RepairForm, request.GET)
+    context = {'form': form}
+
+    if form.is_valid():
+        kind, resource_id = form.cleaned_data['resource']
+        plan = plan_repair(form.cleaned_data['stage'].pk, kind, resource_id, form.cleaned_data['unavailable'])
+        moves, unplaced = plan_rows(plan, form.catalogue)
+        labels = dict(choice for _, group in form.fields['resource'].choices for choice in group)
+        context.update({
+            'plan': signing.dumps(plan, salt=REPAIR_SALT),
+            'resource_name': labels[f"{kind}:{resource_id}"],
+            'removing': plan['timeslots'] is None,
+            'moves': moves,
+            'unplaced': unplaced,
+        })
+
+    return render(request, "timetabling/repair_schedule.html", context)
+
+
+@role_required(SECRETARIES)
+def apply_schedule_repair(request):
+    if request.method != "POST":
+        return redirect('repair_schedule')
+
+    try:
+        plan = signing.loads(request.POST.get('plan', ''), salt=REPAIR_SALT, max_age=60 * 60)
+    except signing.BadSignature:
+        messages.error(request, "This repair has expired. Please plan it again.")
+        return redirect('repair_schedule')
+
+    # Only a removal can end with deleting the resource
+    delete = plan['timeslots'] is None and bool(request.POST.get('delete'))
+    try:
+        moved = apply_repair(plan, delete=delete)
+    except RepairConflict:
+        messages.error(request, "The schedule changed after this repair was planned. Please plan it again.")
+        return redirect('repair_schedule')
+
+    messages.success(request, f"{moved} lessons moved.")
+    return redirect('create_schedule')
+
+
+# -------------------------
+# Secretaries: draft timetables
+# -------------------------
+@query_budget(10)
+@role_required(SECRETARIES)
+def draft_schedules(request):
+    if request.method == "POST":
+        form = DraftScheduleForm(request.POST)
+        if form.is_valid():
+            draft = create_draft(form.cleaned_data['stage'], form.cleaned_data['name'], form.cleaned_data['source'])
+            messages.success(request, f"Draft {draft.name} created.")
+            return redirect('draft_schedule', draft_id=draft.pk)
+    else:
+        form = DraftScheduleForm()
+
+    return render(request, "timetabling/draft_schedules.html", {
+        'form': form,
+        'drafts': DraftSchedule.objects.select_related('stage').annotate(lesson_count=Count('lessons')),
+    })
+
+
+@query_budget(7)
+@role_required(SECRETARIES)
+def draft_schedule(request, draft_id):
+    draft = get_object_or_404(DraftSchedule.objects.select_related('stage'), pk=draft_id)
+    return render(request, "timetabling/draft_schedule.html", {
+        'draft': draft,
+        'diff': draft_diff(draft),
+    })
+
+
+@role_required(SECRETARIES)
+def publish_draft_schedule(request, draft_id):
+    draft = get_object_or_404(DraftSchedule.objects.select_related('stage'), pk=draft_id)
+
+    if request.method == "POST":
+        try:
+            removed, added = publish_draft(draft)
+        except IntegrityError:
+            # Only possible if the draft was edited around its constraints
+            messages.error(request, f"{draft.name} could not be published: it double-books a resource.")
+        else:
+            messages.success(
+                request, f"{draft.name} is now live for {draft.stage.name}: {removed} lessons removed, {added} added."
+            )
+    return redirect('draft_schedule', draft_id=draft.pk)
+
+
+@role_required(SECRETARIES)
+def delete_draft_schedule(request, draft_id):
+    draft = get_object_or_404(DraftSchedule, pk=draft_id)
+
+    if request.method == "POST":
+        draft.delete()
+        messages.success(request, f"Draft {draft.name} deleted.")
+        return redirect('draft_schedules')
+    return redirect('draft_schedule', draft_id=draft.pk)
+
+
+# -------------------------
+# Secretaries: timetable quality report
+# -------------------------
+@query_budget(11)
+@role_required(SECRETARIES)
+def timetable_report(request):
+    form = ReportForm(request.GET or None, initial=report_limits())
+    report = None
+
+    if form.is_valid():
+        limits = report_limits(**{name: form.cleaned_data[name] for name in DEFAULT_LIMITS})
+        report = build_report(form.cleaned_data['stage'], limits)
+
+    return render(request, "timetabling/timetable_report.html", {
+        'form': form,
+        'report': report,
+        'shown_violations': 200,
+    })
+
+
+# -------------------------
+# Secretaries: utilisation analytics
+# -------------------------
+@query_budget(12)
+@role_required(SECRETARIES)
+def utilisation_dashboard(request):
+    form = UtilisationForm(request.GET or None)
+    data = utilisation(form.cleaned_data['stage']) if form.is_valid() else None
+    return render(request, "timetabling/utilisation.html", {'form': form, 'data': data})
+
+
+@query_budget(12)
+@role_required(SECRETARIES)
+def utilisation_heatmap(request, kind):
+    if kind not in UTILISATION_KINDS:
+        raise Http404("No such heatmap.")
+    form = UtilisationForm(request.GET or None)
+    data = utilisation(form.cleaned_data['stage']) if form.is_valid() else None
+    return render(request, "timetabling/utilisation_heatmap.html", {
+        'form': form,
+        'data': data,
+        'kind': kind,
+        'entities': data[kind] if data else None,
+    })
+
+
+@query_budget(11)
+@role_required(SECRETARIES)
+def export_utilisation_csv(request):
+    form = UtilisationForm(request.GET)
+    if not form.is_valid():
+        messages.error(request, "Choose a stage to download.")
+        return redirect('utilisation_dashboard')
+    data = utilisation(form.cleaned_data['stage'])
+    return csv_response(
+        stream_csv(UTILISATION_HEADER, utilisation_rows(data), ['No teachers, rooms or subjects.']),
+        f"{slugify(data['stage'].name)}_utilisation.csv",
+    )
+
+
+# -------------------------
+# Secretaries: cover for absent teachers
+# -------------------------
+@query_budget(11)
+@role_required(SECRETARIES)
+def cover_finder(request):
+    form = CoverForm(request.GET or None)
+    cover = None
+
+    if form.is_valid():
+        cover = find_cover(form.cleaned_data['teacher'], TimeSlot.WEEKDAY_NUMBERS[form.cleaned_data['day']])
+
+    return render(request, "timetabling/cover_finder.html", {
+        'form': form,
+        'cover': cover,
+    })
+
+
+# -------------------------
+# Secretaries & Teachers: free slots and free resources
+# -------------------------
+@query_budget(11)
+@role_required(SECRETARIES, TEACHERS)
+def availability(request):
+    form, result = availability_search(request.GET)
+    return render(request, "timetabling/availability.html", {
+        'form': form,
+        'result': result,
+    })
+
+
+# -------------------------
+# Secretaries & Teachers: weekly timetable grids
+# -------------------------
+@role_required(SECRETARIES, TEACHERS)
+def timetable_index(request):
+    return render(request, "timetabling/timetable_index.html", {
+        'stages': Stage.objects.all(),
+        'teachers': Teacher.objects.select_related('user', 'stage').order_by('user__last_name', 'user__first_name'),
+        'class_groups': ClassGroup.objects.select_related('stage').order_by('stage', 'name'),
+        'rooms': Room.objects.select_related('stage').order_by('stage', 'name'),
+    })
+
+
+def get_timetable_entity(kind, pk):
+    if kind not in GRID_KINDS:
+        raise Http404("Unknown timetable type.")
+
+    model = GRID_KINDS[kind][0]
+    if kind == 'stage':
+        entities = model.objects.all()
+    else:
+        entities = model.objects.select_related(*(['user', 'stage'] if kind == 'teacher' else ['stage']))
+    return get_object_or_404(entities, pk=pk)
+
+
+@query_budget(7)
+@role_required(SECRETARIES, TEACHERS)
+def timetable(request, kind, pk):
+    entity = get_timetable_entity(kind, pk)
+    version = stage_version(entity_stage_id(kind, entity))
+
+    return render(request, "timetabling/timetable.html", {
+        'kind': kind,
+        'entity': entity,
+        'version': version,
+        'cache_timeout': GRID_CACHE_TIMEOUT,
+        'calendar_url': feed_url(kind, entity) if kind in FEED_KINDS else None,
+        # Only built when the rendered fragment is not cached
+        'grid': SimpleLazyObject(lambda: get_grid(kind, entity, version)),
+    })
+
+
+@query_budget(10)
+@role_required(SECRETARIES, TEACHERS)
+def day_timetable(request, kind, pk):
+    entity = get_timetable_entity(kind, pk)
+    try:
+        day = parse_date(request.GET.get('date') or '') or timezone.localdate()
+    except ValueError:
+        # Well-formed but impossible, e.g. 2026-02-30
+        day = timezone.localdate()
+
+    return render(request, "timetabling/day_timetable.html", {
+        'kind': kind,
+        'entity': entity,
+        'day': day,
+        'previous_day': day - timedelta(days=1),
+        'next_day': day + timedelta(days=1),
+        'occurrences': list(occurrences(kind, entity.pk, day, day)),
+    })